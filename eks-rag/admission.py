@@ -0,0 +1,233 @@
+import os
+import math
+import time
+import heapq
+import asyncio
+import itertools
+import threading
+
+# Lower ranks are served first; interactive UI queries jump ahead of batch
+# jobs and canaries such as rag-service.py's consistency_check
+PRIORITIES = {"interactive": 0, "batch": 1, "canary": 2}
+DEFAULT_PRIORITY = "interactive"
+PRIORITY_HEADER = 'X-Request-Priority'
+
+
+class Overloaded(Exception):
+    """vLLM's queue is too long for the request to be answered in time"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def request_priority(headers, data, default=DEFAULT_PRIORITY):
+    """Priority class from the body's "priority" field or the X-Request-Priority header"""
+    value = str(data.get('priority') or headers.get(PRIORITY_HEADER) or default).lower()
+    return value if value in PRIORITIES else default
+
+
+class _Waiter:
+    def __init__(self):
+        self.event = threading.Event()
+        self.cancelled = False
+        self.granted = False
+
+    def grant(self):
+        self.granted = True
+        self.event.set()
+
+
+class AdmissionController:
+    """Bounds the vLLM requests of this process and queues the rest by priority.
+
+    At most ``capacity`` requests hold a slot; the others wait in priority
+    order, first come first served within a class. A request is turned away
+    when its estimated wait, the requests queued ahead of it times the
+    average slot holding time divided by ``capacity``, exceeds the time it
+    may wait: ``max_wait`` or less if its deadline is nearer. A capacity of
+    0 admits everything and only counts outstanding requests.
+    """
+
+    def __init__(self, capacity, max_wait=10.0, service_time=5.0, smoothing=0.2):
+        self.capacity = capacity
+        self.max_wait = max_wait
+        self.service_time = service_time
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+        self._queue = []
+        self._order = itertools.count()
+        self.outstanding = 0
+        self.queued = dict.fromkeys(PRIORITIES, 0)
+        self.admitted = dict.fromkeys(PRIORITIES, 0)
+        self.rejected = dict.fromkeys(PRIORITIES, 0)
+        self.queue_seconds = 0.0
+
+    def _estimated_wait(self, priority):
+        """Seconds a new request of this class would queue; caller holds the lock"""
+        if self.capacity <= 0 or (self.outstanding < self.capacity and not self._queue):
+            return 0.0
+        ahead = sum(count for name, count in self.queued.items() if PRIORITIES[name] <= PRIORITIES[priority])
+        return (ahead + 1) * self.service_time / self.capacity
+
+    def _bound(self, timeout):
+        return self.max_wait if timeout is None else max(0.0, min(self.max_wait, timeout))
+
+    def _reject(self, priority, wait, bound):
+        self.rejected[priority] += 1
+        return Overloaded(f"vLLM queue wait of {wait:.1f}s exceeds {bound:.1f}s",
+                          max(1, math.ceil(wait - bound)))
+
+    def check(self, priority, timeout=None):
+        """Raise Overloaded now if a request of this class would be turned away"""
+        bound = self._bound(timeout)
+        with self._lock:
+            wait = self._estimated_wait(priority)
+            if wait > bound:
+                raise self._reject(priority, wait, bound)
+
+    def _enter(self, priority, timeout, waiter_class):
+        """None when a slot was taken at once, else the waiter queued for one"""
+        bound = self._bound(timeout)
+        with self._lock:
+            if self.capacity <= 0 or (self.outstanding < self.capacity and not self._queue):
+                self.outstanding += 1
+                self.admitted[priority] += 1
+                return None
+            wait = self._estimated_wait(priority)
+            if wait > bound:
+                raise self._reject(priority, wait, bound)
+            waiter = waiter_class()
+            heapq.heappush(self._queue, (PRIORITIES[priority], next(self._order), waiter))
+            self.queued[priority] += 1
+            return waiter
+
+    def _granted(self, priority, waiter, started):
+        """After a wait ended: True if the slot was handed over, else the waiter leaves the queue"""
+        with self._lock:
+            self.queued[priority] -= 1
+            # Granted under this lock, so a waiter that timed out meanwhile still sees it
+            if waiter.granted:
+                self.admitted[priority] += 1
+                self.queue_seconds += time.monotonic() - started
+                return True
+            waiter.cancelled = True
+            self.rejected[priority] += 1
+            return False
+
+    def _leave(self, held):
+        """Hand the slot to the first live waiter, or free it"""
+        with self._lock:
+            self.service_time += self.smoothing * (held - self.service_time)
+            while self._queue:
+                _, _, waiter = heapq.heappop(self._queue)
+                if not waiter.cancelled:
+                    waiter.grant()
+                    return
+            self.outstanding -= 1
+
+    def slot(self, priority=DEFAULT_PRIORITY, timeout=None):
+        """Context manager holding a vLLM slot; raises Overloaded instead of waiting too long"""
+        return _Slot(self, priority, timeout)
+
+    def stats(self):
+        with self._lock:
+            queue_depth = sum(self.queued.values())
+            return {
+                "capacity": self.capacity,
+                "outstanding": self.outstanding,
+                "queue_depth": queue_depth,
+                # (outstanding + queued) / capacity, the signal to scale out on
+                "load": round((self.outstanding + queue_depth) / self.capacity, 3) if self.capacity > 0 else 0.0,
+                "estimated_wait_seconds": round(self._estimated_wait(DEFAULT_PRIORITY), 3),
+                "service_seconds": round(self.service_time, 3),
+                "queue_seconds": round(self.queue_seconds, 3),
+                "queued": dict(self.queued),
+                "admitted": dict(self.admitted),
+                "rejected": dict(self.rejected),
+            }
+
+
+class _Slot:
+    def __init__(self, controller, priority, timeout):
+        self.controller = controller
+        self.priority = priority
+        self.timeout = timeout
+
+    def __enter__(self):
+        controller = self.controller
+        started = time.monotonic()
+        waiter = controller._enter(self.priority, self.timeout, _Waiter)
+        if waiter is not None:
+            waiter.event.wait(controller._bound(self.timeout))
+            if not controller._granted(self.priority, waiter, started):
+                raise Overloaded("Timed out waiting for a vLLM slot", max(1, math.ceil(controller.service_time)))
+        self.acquired = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        self.controller._leave(time.monotonic() - self.acquired)
+        return False
+
+
+class _AsyncWaiter:
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.future = self.loop.create_future()
+        self.cancelled = False
+        self.granted = False
+
+    def grant(self):
+        self.granted = True
+        self.loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class AsyncAdmissionController(AdmissionController):
+    """asyncio counterpart of AdmissionController; use ``async with controller.slot(...)``"""
+
+    def slot(self, priority=DEFAULT_PRIORITY, timeout=None):
+        return _AsyncSlot(self, priority, timeout)
+
+
+class _AsyncSlot:
+    def __init__(self, controller, priority, timeout):
+        self.controller = controller
+        self.priority = priority
+        self.timeout = timeout
+
+    async def __aenter__(self):
+        controller = self.controller
+        started = time.monotonic()
+        waiter = controller._enter(self.priority, self.timeout, _AsyncWaiter)
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(waiter.future, controller._bound(self.timeout))
+            except asyncio.TimeoutError:
+                pass
+            except asyncio.CancelledError:
+                # A slot handed to a cancelled request goes straight to the next one
+                if controller._granted(self.priority, waiter, started):
+                    controller._leave(controller.service_time)
+                raise
+            if not controller._granted(self.priority, waiter, started):
+                raise Overloaded("Timed out waiting for a vLLM slot", max(1, math.ceil(controller.service_time)))
+        self.acquired = time.monotonic()
+        return self
+
+    async def __aexit__(self, *exc):
+        self.controller._leave(time.monotonic() - self.acquired)
+        return False
+
+
+def admission_from_env(asynchronous=False):
+    """AdmissionController (or AsyncAdmissionController) from ADMISSION_* settings"""
+    cls = AsyncAdmissionController if asynchronous else AdmissionController
+    return cls(
+        int(os.environ.get('ADMISSION_MAX_OUTSTANDING', '16')),
+        max_wait=float(os.environ.get('ADMISSION_MAX_WAIT', '10')),
+        service_time=float(os.environ.get('ADMISSION_SERVICE_TIME', '5'))
+    )
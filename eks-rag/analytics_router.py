@@ -0,0 +1,143 @@
+import re
+
+from query_filters import SENSOR_PHRASES, build_filter_clauses
+
+# Questions about counts, extremes, trends or breakdowns are answered from
+# size-0 aggregations instead of kNN top-k plus the LLM, which can only see
+# k documents and cannot count.
+ANALYTICAL_PATTERNS = re.compile(
+    r'\b(?:how\s+many|count|number\s+of|total|average|mean|avg|median|max(?:imum)?|min(?:imum)?|'
+    r'highest|lowest|trend|over\s+time|per\s+(?:minute|hour|day|week)|hourly|daily|breakdown|'
+    r'distribution|histogram|top\s+\d+|most\s+(?:common|frequent)|least\s+common)\b',
+    re.IGNORECASE
+)
+# Asking for causes or actions needs the log text, even alongside a count
+EXPLANATORY_PATTERNS = re.compile(
+    r'\b(?:why|explain|cause[sd]?|recommend|fix|should|actions?|what\s+does|how\s+(?:do|can|to))\b',
+    re.IGNORECASE
+)
+
+GROUP_BY_FIELDS = [
+    ("diagnostic_info.dtc_codes", r'\b(?:dtcs?|trouble\s+codes?|diagnostic\s+codes?)\b'),
+    ("error_code", r'\berror\s*codes?\b|\berror\s+types?\b'),
+    ("service", r'\bservices?\b'),
+    ("vehicle_state", r'\b(?:vehicle\s+)?states?\b'),
+    ("vehicle_id", r'\b(?:by|per|each|which|top\s+\d+)\s+vehicles?\b'),
+]
+INTERVAL_PATTERNS = [
+    ("minute", re.compile(r'\bper\s+minute|by\s+minute|minutely\b', re.IGNORECASE)),
+    ("hour", re.compile(r'\bper\s+hour|by\s+hour|hourly\b', re.IGNORECASE)),
+    ("day", re.compile(r'\bper\s+day|by\s+day|daily\b', re.IGNORECASE)),
+    ("week", re.compile(r'\bper\s+week|by\s+week|weekly\b', re.IGNORECASE)),
+]
+TREND_PATTERN = re.compile(r'\b(?:trend|over\s+time|timeline)\b', re.IGNORECASE)
+DISTRIBUTION_PATTERN = re.compile(r'\b(?:distribution|histogram|ranges?|buckets?)\b', re.IGNORECASE)
+TOP_PATTERN = re.compile(r'\btop\s+(\d+)\b', re.IGNORECASE)
+
+# Bucket edges for range aggregations, spanning the generated sensor values
+SENSOR_RANGES = {
+    "engine_temp": [80, 90, 100, 110],
+    "battery_voltage": [11.5, 12.0, 12.5, 13.5],
+    "fuel_pressure": [30, 40, 50, 60, 70],
+    "speed": [10, 50, 90],
+    "battery_level": [20, 40, 60, 80],
+}
+
+
+def is_analytical(query):
+    """Whether a question asks for an aggregate rather than an explanation"""
+    return bool(ANALYTICAL_PATTERNS.search(query)) and not EXPLANATORY_PATTERNS.search(query)
+
+
+def _mentioned_sensors(query):
+    sensors = []
+    for field, phrase in SENSOR_PHRASES:
+        if re.search(rf'\b(?:{phrase})\b', query, re.IGNORECASE):
+            sensors.append(field)
+    return sensors
+
+
+def _interval(query, filters):
+    for interval, pattern in INTERVAL_PATTERNS:
+        if pattern.search(query):
+            return interval
+    window = filters.get("timestamp", {}).get("gte", "")
+    return "hour" if window.endswith(("m", "h")) or window == "now/d" else "day"
+
+
+def build_analytics_query(query, filters):
+    """size-0 search whose aggregations answer an analytical question"""
+    top = TOP_PATTERN.search(query)
+    size = int(top.group(1)) if top else 10
+    aggs = {"vehicles": {"cardinality": {"field": "vehicle_id"}}}
+
+    group_by = [field for field, pattern in GROUP_BY_FIELDS if re.search(pattern, query, re.IGNORECASE)]
+    for field in group_by or ["error_code"]:
+        aggs[f"by_{field.split('.')[-1]}"] = {"terms": {"field": field, "size": size}}
+
+    for sensor in _mentioned_sensors(query):
+        field = f"sensor_readings.{sensor}"
+        aggs[f"{sensor}_stats"] = {"stats": {"field": field}}
+        if DISTRIBUTION_PATTERN.search(query):
+            edges = SENSOR_RANGES[sensor]
+            ranges = [{"to": edges[0]}] + [{"from": a, "to": b} for a, b in zip(edges, edges[1:])] + [{"from": edges[-1]}]
+            aggs[f"{sensor}_ranges"] = {"range": {"field": field, "ranges": ranges}}
+
+    if TREND_PATTERN.search(query) or any(pattern.search(query) for _, pattern in INTERVAL_PATTERNS):
+        aggs["over_time"] = {
+            "date_histogram": {"field": "timestamp", "calendar_interval": _interval(query, filters), "min_doc_count": 1}
+        }
+
+    clauses = build_filter_clauses(filters)
+    return {
+        "size": 0,
+        "track_total_hits": True,
+        "query": {"bool": {"filter": clauses}} if clauses else {"match_all": {}},
+        "aggs": aggs
+    }
+
+
+def summarize_aggregations(response):
+    """Flatten an analytics response into a small JSON-friendly table"""
+    total = response["hits"]["total"]
+    summary = {"matching_logs": total["value"] if isinstance(total, dict) else total}
+    for name, agg in response.get("aggregations", {}).items():
+        if "buckets" in agg:
+            summary[name] = {
+                bucket.get("key_as_string", bucket.get("key")): bucket["doc_count"]
+                for bucket in agg["buckets"] if bucket["doc_count"] or name.endswith("_ranges")
+            }
+        elif "avg" in agg:
+            summary[name] = {stat: round(agg[stat], 2) if agg[stat] is not None else None
+                             for stat in ("count", "min", "avg", "max")}
+        else:
+            summary[name] = agg.get("value")
+    return summary
+
+
+def render_table(summary):
+    """Compact one-line-per-aggregate rendering used as LLM context"""
+    lines = []
+    for name, value in summary.items():
+        if isinstance(value, dict):
+            value = ", ".join(f"{key}={count}" for key, count in value.items()) or "none"
+        lines.append(f"{name}: {value}")
+    return "\n".join(lines)
+
+
+def direct_answer(summary, filters):
+    """Plain-text answer built from the aggregates alone, without the LLM"""
+    scope = f" matching {format_filters(filters)}" if filters else ""
+    headline = f"{summary['matching_logs']} error logs from {summary.get('vehicles', 0)} vehicles{scope}."
+    details = {name: value for name, value in summary.items() if name not in ("matching_logs", "vehicles")}
+    return headline + ("\n" + render_table(details) if details else "")
+
+
+def format_filters(filters):
+    parts = []
+    for field, constraint in filters.items():
+        if isinstance(constraint, dict):
+            parts.extend(f"{field} {op} {value}" for op, value in constraint.items())
+        else:
+            parts.append(f"{field} in {', '.join(constraint)}")
+    return "; ".join(parts)
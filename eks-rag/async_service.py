@@ -0,0 +1,342 @@
+import os
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.config import Config
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from opensearchpy import AsyncOpenSearch, AsyncHttpConnection, AWSV4SignerAsyncAuth
+from embedding_batcher import AsyncEmbeddingBatcher, MAX_EMBED_BATCH
+from embedding_stage import embedding_stage_from_env
+from embedding_cache import cache_from_env
+from vllm_client import AsyncVLLMClient, client_settings_from_env
+from semantic_cache import semantic_cache_from_env
+from context_packer import tokenizer_from_env
+from log_setup import configure_logging
+from request_deadline import search_options, stage_budget
+from singleflight import singleflight_from_env
+from admission import admission_from_env
+from stage_timing import StageTimer, current_timer, record_opensearch_time, metrics_exposition, wants_json
+from rag_common import AWS_REGION, INDEX_NAME, QueryError, get_collection_endpoint, embed_texts
+from rag_pipeline import RagPipeline
+
+# ASGI variant of vector_search_service.py with the same API contract, over
+# the same rag_pipeline.py. Run with: gunicorn -k uvicorn.workers.UvicornWorker async_service:app
+configure_logging()
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """Clients of the worker: set up before it serves, closed when it stops"""
+    init_clients()
+    try:
+        yield
+    finally:
+        await close_clients()
+
+
+app = FastAPI(lifespan=lifespan)
+
+# Upper bound on in-flight requests to each backend, per worker process
+MAX_CONCURRENCY = int(os.environ.get('ASYNC_MAX_CONCURRENCY', '256'))
+# Window for coalescing concurrent query embeddings into one Bedrock call; 0 disables
+EMBED_BATCH_WINDOW_MS = float(os.environ.get('EMBED_BATCH_WINDOW_MS', '5'))
+EMBED_BATCH_MAX_TEXTS = int(os.environ.get('EMBED_BATCH_MAX_TEXTS', MAX_EMBED_BATCH))
+# Local or self-managed backends instead of the AWS ones, e.g. the stand-ins
+# in benchmarks/stand_ins.py: an unsigned OpenSearch URL and a Bedrock endpoint
+OPENSEARCH_URL = os.environ.get('OPENSEARCH_URL')
+BEDROCK_ENDPOINT_URL = os.environ.get('BEDROCK_ENDPOINT_URL')
+
+# boto3 has no native asyncio support, so Bedrock calls run on a dedicated
+# thread pool sized for the target concurrency instead of blocking the loop.
+# A request stops waiting at its embed budget; the client timeouts free the
+# thread soon after
+boto3_config = Config(
+    connect_timeout=min(5, stage_budget('embed')),
+    read_timeout=min(30, stage_budget('embed')),
+    retries={'max_attempts': 2},
+    max_pool_connections=MAX_CONCURRENCY
+)
+
+bedrock_runtime = None
+bedrock_executor = None
+opensearch_client = None
+vllm_client = None
+embedding_batcher = None
+embedding_stage = None
+embedding_cache = None
+semantic_cache = None
+context_tokenizer = None
+flights = None
+admission = None
+pipeline = None
+
+
+class TimedAsyncHttpConnection(AsyncHttpConnection):
+    """AsyncHttpConnection reporting each round trip to the stage timer of the query.
+
+    The async transport has no metrics hook, so this times perform_request
+    the way MetricsEvents times the sync client's send.
+    """
+
+    async def perform_request(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await super().perform_request(*args, **kwargs)
+        finally:
+            record_opensearch_time(time.perf_counter() - started)
+
+
+def init_clients():
+    """Create any backend client that has not been provided already"""
+    global bedrock_runtime, bedrock_executor, opensearch_client, vllm_client
+    global embedding_batcher, embedding_stage, embedding_cache, semantic_cache, context_tokenizer, flights, admission
+    global pipeline
+
+    if bedrock_executor is None:
+        bedrock_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENCY, thread_name_prefix='bedrock')
+
+    if bedrock_runtime is None:
+        try:
+            bedrock_runtime = boto3.client(
+                service_name='bedrock-runtime',
+                region_name=AWS_REGION,
+                endpoint_url=BEDROCK_ENDPOINT_URL,
+                config=boto3_config
+            )
+            logger.info("Bedrock client initialized successfully")
+        except Exception as e:
+            logger.error("Failed to initialize Bedrock client: %s", e)
+
+    if opensearch_client is None and OPENSEARCH_URL:
+        opensearch_client = AsyncOpenSearch(hosts=[OPENSEARCH_URL], timeout=30, pool_maxsize=MAX_CONCURRENCY,
+                                            connection_class=TimedAsyncHttpConnection)
+        logger.info("OpenSearch client initialized for %s", OPENSEARCH_URL)
+
+    if opensearch_client is None:
+        try:
+            os_serverless = boto3.client('opensearchserverless')
+            endpoint = get_collection_endpoint(os_serverless)
+            if endpoint:
+                # The async signer re-reads the (refreshable) credentials per request
+                credentials = boto3.Session().get_credentials()
+                opensearch_client = AsyncOpenSearch(
+                    hosts=[{'host': endpoint, 'port': 443}],
+                    http_auth=AWSV4SignerAsyncAuth(credentials, AWS_REGION, 'aoss'),
+                    use_ssl=True,
+                    verify_certs=True,
+                    timeout=30,
+                    # Searches get the request's remaining budget as their timeout; a
+                    # timed-out search is not retried past it
+                    retry_on_timeout=False,
+                    max_retries=3,
+                    pool_maxsize=MAX_CONCURRENCY,
+                    connection_class=TimedAsyncHttpConnection
+                )
+                logger.info("OpenSearch client initialized successfully")
+        except Exception as e:
+            logger.error("Failed to initialize OpenSearch client: %s", e)
+
+    if embedding_batcher is None and EMBED_BATCH_WINDOW_MS > 0:
+        embedding_batcher = AsyncEmbeddingBatcher(
+            embed_batch,
+            max_wait=EMBED_BATCH_WINDOW_MS / 1000,
+            max_batch_size=EMBED_BATCH_MAX_TEXTS
+        )
+
+    # Batch embeddings go out in concurrent, rate-limited Bedrock calls that back off on throttling
+    if embedding_stage is None:
+        embedding_stage = embedding_stage_from_env(lambda texts: embed_texts(bedrock_runtime, texts))
+
+    if embedding_cache is None:
+        try:
+            embedding_cache = cache_from_env()
+        except Exception as e:
+            logger.error("Failed to initialize embedding cache: %s", e)
+
+    if semantic_cache is None:
+        try:
+            semantic_cache = semantic_cache_from_env()
+        except Exception as e:
+            logger.error("Failed to initialize semantic cache: %s", e)
+
+    if context_tokenizer is None:
+        context_tokenizer = tokenizer_from_env()
+
+    # Identical questions in flight at the same time share one retrieval and one generation
+    if flights is None:
+        try:
+            flights = singleflight_from_env(asynchronous=True)
+        except Exception as e:
+            logger.error("Failed to initialize request coalescing: %s", e)
+
+    if vllm_client is None:
+        vllm_client = AsyncVLLMClient(pool_size=MAX_CONCURRENCY, **client_settings_from_env())
+
+    # Outstanding vLLM requests of this worker, queued by priority past ADMISSION_MAX_OUTSTANDING
+    if admission is None:
+        admission = admission_from_env(asynchronous=True)
+
+    pipeline = RagPipeline(AsyncBackend(), embedding_cache=embedding_cache, semantic_cache=semantic_cache,
+                           context_tokenizer=context_tokenizer, admission=admission)
+
+
+async def close_clients():
+    if vllm_client is not None:
+        await vllm_client.aclose()
+    if opensearch_client is not None:
+        await opensearch_client.close()
+    if bedrock_executor is not None:
+        bedrock_executor.shutdown(wait=False)
+    if embedding_stage is not None:
+        embedding_stage.close()
+
+
+async def embed_batch(texts):
+    """Embed a batch of texts on the Bedrock thread pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(bedrock_executor, embed_texts, bedrock_runtime, texts)
+
+
+class AsyncBackend:
+    """The pipeline's I/O through the clients init_clients sets up, read when called"""
+
+    async def search(self, body, timeout):
+        return await opensearch_client.search(index=INDEX_NAME, body=body, **search_options(timeout))
+
+    async def msearch(self, body, timeout):
+        return await opensearch_client.msearch(body=body, **search_options(timeout))
+
+    async def embed(self, text, timeout):
+        try:
+            if embedding_batcher is not None:
+                return await asyncio.wait_for(embedding_batcher.embed(text), timeout)
+            return (await asyncio.wait_for(embed_batch([text]), timeout))[0]
+        except asyncio.TimeoutError:
+            raise QueryError("Request deadline exceeded", 504)
+
+    async def embed_many(self, texts, timeout):
+        loop = asyncio.get_running_loop()
+        return await asyncio.wait_for(loop.run_in_executor(bedrock_executor, embedding_stage.embed, texts), timeout)
+
+    async def chat(self, payload, timeout):
+        return await vllm_client.chat(payload, timeout=timeout)
+
+    def stream_chat(self, payload, timeout):
+        return vllm_client.stream_chat(payload, timeout=timeout)
+
+    def slot(self, priority, timeout):
+        return admission.slot(priority, timeout)
+
+    async def coalesce(self, key, fn, timeout):
+        if flights is None:
+            return await fn(), False
+        return await flights.do(key, fn, timeout=timeout)
+
+    def coalesce_stream(self, key, fn, timeout):
+        if flights is None:
+            return fn(), False
+        return flights.stream(key, fn, timeout=timeout)
+
+    async def map_completed(self, fn, items, parallelism):
+        slots = asyncio.Semaphore(parallelism)
+
+        async def run(item):
+            async with slots:
+                return await fn(item)
+
+        tasks = [asyncio.ensure_future(run(item)) for item in items]
+        try:
+            for completed in asyncio.as_completed(tasks):
+                yield await completed
+        finally:
+            # A client that disconnects cancels the questions still running
+            for task in tasks:
+                task.cancel()
+
+
+def timed_response(timer, route, body, status_code=200):
+    """JSON response with the request's stage durations in a Server-Timing header"""
+    with timer.stage("serialize"):
+        response = JSONResponse(body, status_code=status_code)
+    response.headers['Server-Timing'] = timer.server_timing()
+    timer.finish(route)
+    return response
+
+
+def respond(timer, reply):
+    """FastAPI response of a pipeline Reply"""
+    if reply.events is None:
+        response = timed_response(timer, reply.route, reply.body, status_code=reply.status)
+    else:
+        # Only the stages before the first line; the rest go to the histograms
+        response = StreamingResponse(reply.events, media_type=reply.media_type,
+                                     headers={'Server-Timing': timer.server_timing()})
+    response.headers.update(reply.headers)
+    return response
+
+
+async def request_body(request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+@app.post('/submit_query')
+async def submit_query(request: Request):
+    timer = StageTimer()
+    timer_token = current_timer.set(timer)
+    logger.info("Received submit_query request")
+    try:
+        return respond(timer, await pipeline.submit_query(await request_body(request), request.headers, timer))
+    finally:
+        current_timer.reset(timer_token)
+
+
+@app.post('/submit_queries')
+async def submit_queries(request: Request):
+    """Many questions in one request: batched embedding and search, answers as NDJSON in completion order"""
+    timer = StageTimer()
+    timer_token = current_timer.set(timer)
+    logger.info("Received submit_queries request")
+    try:
+        return respond(timer, await pipeline.submit_queries(await request_body(request), request.headers, timer))
+    finally:
+        current_timer.reset(timer_token)
+
+
+def service_stats():
+    return {
+        "embedding_batcher": embedding_batcher.stats.snapshot() if embedding_batcher else None,
+        "embedding_cache": embedding_cache.stats() if embedding_cache else None,
+        "embedding_stage": embedding_stage.stats() if embedding_stage else None,
+        "semantic_cache": semantic_cache.stats() if semantic_cache else None,
+        "singleflight": flights.snapshot() if flights else None,
+        "vllm_client": vllm_client.stats() if vllm_client else None,
+        "admission": admission.stats() if admission else None
+    }
+
+
+@app.get('/metrics')
+async def metrics(request: Request):
+    """Prometheus histograms and stats; the JSON stats with ?format=json or Accept: application/json"""
+    if wants_json(request.headers.get('accept'), request.query_params):
+        return service_stats()
+    body, content_type = metrics_exposition(service_stats)
+    return Response(body, media_type=content_type)
+
+
+@app.get('/health')
+async def health_check():
+    return {"status": "healthy"}
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
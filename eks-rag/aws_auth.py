@@ -0,0 +1,126 @@
+import time
+import logging
+import datetime
+import threading
+
+import boto3
+from requests.auth import AuthBase
+from requests_aws4auth import AWS4Auth
+
+logger = logging.getLogger(__name__)
+
+
+class CachedCredentialProvider:
+    """AWS credentials resolved once and reused until shortly before they expire.
+
+    The credential chain is resolved on first use. Temporary credentials
+    (IRSA, instance or container roles) are frozen and handed out until
+    ``refresh_margin`` seconds before their expiry, when a background thread
+    fetches new ones; a request only refreshes inline if the background
+    refresh has not caught up within ``min_validity`` seconds of expiry.
+    Static credentials never expire and are never refreshed.
+    """
+
+    def __init__(self, session=None, refresh_margin=300, min_validity=60, background_refresh=True):
+        self.session = session
+        self.refresh_margin = refresh_margin
+        self.min_validity = min_validity
+        self.background_refresh = background_refresh
+        self._credentials = None
+        # (frozen credentials, expiry epoch or None), swapped as one tuple
+        self._current = (None, None)
+        self._lock = threading.Lock()
+        self._refresher = None
+        self._stats = dict.fromkeys(["resolves", "refreshes", "inline_refreshes", "refresh_errors"], 0)
+
+    def _expiry(self):
+        expiry = getattr(self._credentials, '_expiry_time', None)
+        return expiry.timestamp() if expiry is not None else None
+
+    def _refresh(self):
+        # Caller holds self._lock
+        if self._credentials is None:
+            self._credentials = (self.session or boto3.Session()).get_credentials()
+            if self._credentials is None:
+                raise RuntimeError("No AWS credentials found")
+            self._stats["resolves"] += 1
+        # botocore refreshes temporary credentials close to expiry on its own
+        self._current = (self._credentials.get_frozen_credentials(), self._expiry())
+        self._stats["refreshes"] += 1
+        if self._current[1] is not None and self.background_refresh and self._refresher is None:
+            self._refresher = threading.Thread(target=self._refresh_loop, name='aws-credentials', daemon=True)
+            self._refresher.start()
+
+    def _refresh_loop(self):
+        while True:
+            refresh_at = self._current[1] - self.refresh_margin
+            time.sleep(max(1.0, refresh_at - time.time()))
+            try:
+                with self._lock:
+                    if time.time() >= self._current[1] - self.refresh_margin:
+                        self._refresh()
+            except Exception as e:
+                with self._lock:
+                    self._stats["refresh_errors"] += 1
+                logger.error("Failed to refresh AWS credentials: %s", e)
+                time.sleep(5)
+
+    def get(self):
+        """Frozen credentials with at least ``min_validity`` seconds left"""
+        frozen, expires_at = self._current
+        if frozen is not None and (expires_at is None or time.time() < expires_at - self.min_validity):
+            return frozen
+        with self._lock:
+            frozen, expires_at = self._current
+            if frozen is None or (expires_at is not None and time.time() >= expires_at - self.min_validity):
+                if frozen is not None:
+                    self._stats["inline_refreshes"] += 1
+                self._refresh()
+            return self._current[0]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            expires_at = self._current[1]
+            stats["expires_in_s"] = round(expires_at - time.time()) if expires_at else None
+        return stats
+
+
+class CachedAWS4Auth(AuthBase):
+    """requests auth signing with cached credentials and a reused SigV4 signing key.
+
+    The derived signing key depends only on the secret key, date, region and
+    service, so one AWS4Auth is kept per credential set and UTC date and
+    rebuilt only when the credentials rotate or the date rolls over.
+    """
+
+    def __init__(self, provider, region, service):
+        self.provider = provider
+        self.region = region
+        self.service = service
+        self._current = (None, None)
+        self._lock = threading.Lock()
+        self.signers_built = 0
+
+    def _signer_for(self, credentials, date):
+        key = (credentials.access_key, credentials.token, date)
+        current_key, signer = self._current
+        if current_key == key:
+            return signer
+        with self._lock:
+            current_key, signer = self._current
+            if current_key != key:
+                signer = AWS4Auth(credentials.access_key, credentials.secret_key, self.region,
+                                  self.service, date, session_token=credentials.token)
+                self._current = (key, signer)
+                self.signers_built += 1
+            return signer
+
+    def __call__(self, request):
+        # Stamp the request time ourselves so the signer's scope date always
+        # matches it and AWS4Auth never regenerates its key mid-request
+        now = datetime.datetime.now(datetime.timezone.utc)
+        request.headers.pop('date', None)
+        request.headers['x-amz-date'] = now.strftime('%Y%m%dT%H%M%SZ')
+        signer = self._signer_for(self.provider.get(), now.strftime('%Y%m%d'))
+        return signer(request)
@@ -0,0 +1,73 @@
+import os
+import json
+import time
+
+from rag_common import QueryError, build_knn_query
+from hybrid_search import build_hybrid_msearch
+
+# Most questions one /submit_queries request may carry, and how many of
+# its answers are generated at once
+BATCH_MAX_QUERIES = int(os.environ.get('BATCH_MAX_QUERIES', '500'))
+BATCH_PARALLELISM = int(os.environ.get('BATCH_PARALLELISM', '8'))
+BATCH_PRIORITY = "batch"
+
+
+def parse_batch(data, max_queries=BATCH_MAX_QUERIES):
+    """Questions of a /submit_queries body as {"index", "id", "query"}; QueryError(400) if malformed.
+
+    "queries" holds strings or objects with a "query" and an optional "id"
+    echoed back in the question's result line.
+    """
+    queries = data.get('queries') if isinstance(data, dict) else None
+    if not isinstance(queries, list) or not queries:
+        raise QueryError("Missing queries parameter", 400)
+    if len(queries) > max_queries:
+        raise QueryError(f"At most {max_queries} queries per request", 400)
+    items = []
+    for index, entry in enumerate(queries):
+        if isinstance(entry, dict):
+            query, item_id = entry.get('query'), entry.get('id')
+        else:
+            query, item_id = entry, None
+        if not isinstance(query, str) or not query.strip():
+            raise QueryError(f"Query {index} is not a non-empty string", 400)
+        items.append({"index": index, "id": item_id, "query": query})
+    return items
+
+
+def batch_parallelism(data, limit=BATCH_PARALLELISM):
+    """Concurrent generations for a batch: the body's "parallelism", at most the configured limit"""
+    try:
+        requested = int(data.get('parallelism', limit))
+    except (TypeError, ValueError):
+        requested = limit
+    return max(1, min(requested, limit))
+
+
+def retrieval_searches(index, query, embedding, k, filter_clauses=None, hybrid=False, candidates=20):
+    """msearch entries of one question's retrieval: kNN, or BM25 and kNN to be fused"""
+    if hybrid:
+        return build_hybrid_msearch(index, query, embedding, max(k, candidates), filter_clauses)
+    return [{"index": index}, build_knn_query(embedding, k, filter_clauses)]
+
+
+def split_msearch(response, counts):
+    """Per-question lists of sub-responses from a combined msearch, ``counts`` searches each"""
+    responses = response['responses']
+    slices = []
+    start = 0
+    for count in counts:
+        slices.append(responses[start:start + count])
+        start += count
+    return slices
+
+
+def format_ndjson(payload):
+    """Encode one line of a newline-delimited JSON response"""
+    return json.dumps(payload) + "\n"
+
+
+def batch_summary(results, start_time):
+    """Last line of a /submit_queries response"""
+    failed = sum(1 for result in results if "error" in result)
+    return {"done": True, "queries": len(results), "failed": failed, "processing_time": time.time() - start_time}
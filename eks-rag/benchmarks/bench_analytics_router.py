@@ -0,0 +1,124 @@
+"""Analytical query routing against the retrieval path, through the ASGI app.
+
+Sends counting, extreme and trend questions about the generated logs to
+async_service with the router off (embedding, kNN top-5 and the full
+context prompt), routed with vLLM phrasing the aggregate table, and routed
+with a direct answer. Reports latency, prompt tokens sent to vLLM, Bedrock
+calls and, for direct answers, whether the stated count is exact. The
+stand-ins charge per-call latencies, and vLLM prefill time grows with the
+prompt.
+
+    python benchmarks/bench_analytics_router.py --rounds 5
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+# Repeated questions would otherwise be answered from the caches
+os.environ.setdefault('EMBEDDING_CACHE_ENTRIES', '0')
+os.environ.setdefault('SEMANTIC_CACHE_ENTRIES', '0')
+
+import httpx
+
+import async_service
+import rag_pipeline
+from vllm_client import AsyncVLLMClient
+from fakes import FakeBedrockRuntime, FakeAsyncOpenSearch, fake_vllm_transport, load_corpus
+
+
+def parse(timestamp):
+    return datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+
+
+def labelled_questions(corpus):
+    """Analytical questions with the log and vehicle counts that answer them"""
+    now = datetime.now(timezone.utc)
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    def truth(predicate):
+        docs = [doc for doc in corpus if predicate(doc)]
+        return len(docs), len({doc['vehicle_id'] for doc in docs})
+
+    return [
+        ("how many vehicles reported SENSOR_002 today",
+         truth(lambda d: d['error_code'] == 'SENSOR_002' and parse(d['timestamp']) >= today)),
+        ("how many CONN_001 errors were logged in the last 24 hours",
+         truth(lambda d: d['error_code'] == 'CONN_001' and (now - parse(d['timestamp'])).total_seconds() <= 86400)),
+        ("how many vehicles in MOVING state reported GPS_002 in the last 2 days",
+         truth(lambda d: d['error_code'] == 'GPS_002' and d['vehicle_state'] == 'MOVING'
+               and (now - parse(d['timestamp'])).total_seconds() <= 2 * 86400)),
+        ("what is the average engine temperature per hour in the last 12 hours",
+         truth(lambda d: (now - parse(d['timestamp'])).total_seconds() <= 12 * 3600)),
+        ("top 3 error codes in the last week", truth(lambda d: True)),
+        ("daily trend of DIAG_002 errors over the last week", truth(lambda d: d['error_code'] == 'DIAG_002')),
+    ]
+
+
+async def run(args, corpus, questions, router, answer_mode):
+    prompt_tokens = []
+    bedrock = FakeBedrockRuntime(latency=args.bedrock_latency)
+    async_service.bedrock_runtime = bedrock
+    async_service.opensearch_client = FakeAsyncOpenSearch(corpus, latency=args.opensearch_latency)
+    async_service.vllm_client = AsyncVLLMClient(['http://vllm.local'], transport=fake_vllm_transport(
+        latency=args.vllm_latency, token_interval=args.token_interval,
+        prefill_per_1k_tokens=args.prefill_per_1k_tokens, prompt_tokens=prompt_tokens
+    ))
+    rag_pipeline.ANALYTICS_ROUTER = router
+    rag_pipeline.ANALYTICS_ANSWER = answer_mode
+    async_service.init_clients()
+
+    latencies = []
+    exact = 0
+    transport = httpx.ASGITransport(app=async_service.app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://rag', timeout=60) as client:
+        for _ in range(args.rounds):
+            for question, (logs, vehicles) in questions:
+                started = time.perf_counter()
+                response = await client.post('/submit_query', json={"query": question})
+                latencies.append(time.perf_counter() - started)
+                body = response.json()
+                if answer_mode == 'direct' and body.get('route') == 'analytics':
+                    exact += body['llm_response'].startswith(f"{logs} error logs from {vehicles} vehicles")
+    await async_service.vllm_client.aclose()
+    async_service.vllm_client = None
+
+    result = {
+        "router": router,
+        "answer": answer_mode if router else "llm",
+        "mean_latency_ms": round(sum(latencies) / len(latencies) * 1000, 1),
+        "mean_prompt_tokens": round(sum(prompt_tokens) / len(prompt_tokens), 1) if prompt_tokens else 0,
+        "vllm_calls": len(prompt_tokens),
+        "bedrock_calls": bedrock.calls,
+    }
+    if router and answer_mode == 'direct':
+        result["exact_counts"] = f"{exact}/{len(latencies)}"
+    return result
+
+
+async def main_async(args):
+    corpus = load_corpus(recent=True)
+    questions = labelled_questions(corpus)
+    for router, answer_mode in ((False, 'llm'), (True, 'llm'), (True, 'direct')):
+        print(json.dumps(await run(args, corpus, questions, router, answer_mode)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--bedrock-latency', type=float, default=0.03)
+    parser.add_argument('--opensearch-latency', type=float, default=0.02)
+    parser.add_argument('--vllm-latency', type=float, default=0.1)
+    parser.add_argument('--token-interval', type=float, default=0.02)
+    parser.add_argument('--prefill-per-1k-tokens', type=float, default=0.15)
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == '__main__':
+    main()
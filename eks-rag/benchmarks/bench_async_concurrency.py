@@ -0,0 +1,113 @@
+"""Concurrency scaling of the async /submit_query pipeline.
+
+Runs async_service against in-process stand-ins for Bedrock, OpenSearch and
+vLLM with fixed latencies and compares it with the sync deployment, which is
+modelled as two gunicorn sync workers each running the three calls serially.
+
+    python benchmarks/bench_async_concurrency.py --requests 128
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+# Every request sends the same question; keep the caches and request
+# coalescing out of the measurement, and let every request reach the fake vLLM
+os.environ.setdefault('EMBEDDING_CACHE_ENTRIES', '0')
+os.environ.setdefault('SEMANTIC_CACHE_ENTRIES', '0')
+os.environ.setdefault('SINGLEFLIGHT', 'false')
+os.environ.setdefault('ADMISSION_MAX_OUTSTANDING', '0')
+
+import httpx
+
+import async_service
+from vllm_client import AsyncVLLMClient
+from fakes import FakeBedrockRuntime, FakeAsyncOpenSearch, fake_vllm_transport, load_corpus
+
+QUERY = "Are there any vehicles reporting engine temperatures above 110°C in the last hour?"
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def summarize(mode, concurrency, latencies, elapsed):
+    return {
+        "mode": mode,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+        "p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+    }
+
+
+def run_sync_baseline(args, concurrency):
+    """Two sync workers: each request holds a worker for embed + search + LLM"""
+    def handle(submitted_at):
+        time.sleep(args.embed_latency)
+        time.sleep(args.search_latency)
+        time.sleep(args.llm_latency)
+        return time.perf_counter() - submitted_at
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.sync_workers) as workers:
+        # Clients beyond the worker count queue in the listen backlog
+        with ThreadPoolExecutor(max_workers=concurrency) as clients:
+            futures = [clients.submit(lambda: workers.submit(handle, time.perf_counter()).result())
+                       for _ in range(args.requests)]
+            latencies = [f.result() for f in futures]
+    return summarize("sync", concurrency, latencies, time.perf_counter() - start)
+
+
+async def run_async(args, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=async_service.app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def one():
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post('/submit_query', json={"query": QUERY})
+                assert response.status_code == 200, response.text
+                return time.perf_counter() - started
+
+        start = time.perf_counter()
+        latencies = await asyncio.gather(*(one() for _ in range(args.requests)))
+        return summarize("async", concurrency, latencies, time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=128)
+    parser.add_argument('--concurrency', default='1,2,8,32,128,256')
+    parser.add_argument('--embed-latency', type=float, default=0.05)
+    parser.add_argument('--search-latency', type=float, default=0.03)
+    parser.add_argument('--llm-latency', type=float, default=0.5)
+    parser.add_argument('--sync-workers', type=int, default=2)
+    parser.add_argument('--skip-sync', action='store_true')
+    args = parser.parse_args()
+
+    async_service.bedrock_runtime = FakeBedrockRuntime(latency=args.embed_latency)
+    async_service.opensearch_client = FakeAsyncOpenSearch(load_corpus(limit=500), latency=args.search_latency)
+    async_service.vllm_client = AsyncVLLMClient(
+        ['http://vllm.local'], transport=fake_vllm_transport(latency=args.llm_latency))
+    async_service.init_clients()
+
+    results = []
+    for concurrency in [int(c) for c in args.concurrency.split(',')]:
+        if not args.skip_sync:
+            results.append(run_sync_baseline(args, concurrency))
+            print(json.dumps(results[-1]))
+        results.append(asyncio.run(run_async(args, concurrency)))
+        print(json.dumps(results[-1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""Throughput of /submit_queries against a loop of /submit_query calls.
+
+Starts the HTTP stand-ins and the sync or async service under gunicorn as
+bench_end_to_end.py does, then answers the same --queries distinct questions
+twice: one /submit_query at a time, as the offline reports do, and in one
+/submit_queries request generating --parallelism answers at once. The
+questions are built from the generated log messages, so no two are alike and
+the caches stay off unless --caches is given.
+
+    python benchmarks/bench_batch_queries.py --mode async --queries 200 --parallelism 16
+"""
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+import httpx
+
+import stand_ins
+import bench_end_to_end
+from fakes import load_corpus
+
+QUESTION_TEMPLATES = [
+    "What could cause \"{message}\" on {vehicle_id}?",
+    "How should a technician respond to {error_code} reported by {service}?",
+    "Is \"{message}\" on {vehicle_id} a safety concern?",
+]
+
+
+def build_questions(count):
+    """``count`` distinct questions about the generated error logs"""
+    questions = []
+    seen = set()
+    for doc in load_corpus():
+        for template in QUESTION_TEMPLATES:
+            question = template.format(**doc)
+            if question not in seen:
+                seen.add(question)
+                questions.append(question)
+            if len(questions) == count:
+                return questions
+    return questions
+
+
+def run_sequential(client, questions):
+    started = time.perf_counter()
+    failed = 0
+    for question in questions:
+        response = client.post('/submit_query', json={"query": question})
+        failed += response.status_code != 200
+    elapsed = time.perf_counter() - started
+    return {"mode": "sequential", "queries": len(questions), "failed": failed, "seconds": round(elapsed, 2),
+            "queries_per_s": round(len(questions) / elapsed, 2)}
+
+
+def run_batch(client, questions, parallelism):
+    started = time.perf_counter()
+    first_line = None
+    lines = []
+    with client.stream('POST', '/submit_queries', json={"queries": questions, "parallelism": parallelism}) as response:
+        stages = response.headers.get('Server-Timing')
+        for line in response.iter_lines():
+            if first_line is None:
+                first_line = time.perf_counter() - started
+            lines.append(json.loads(line))
+    elapsed = time.perf_counter() - started
+    summary = lines[-1] if lines else {}
+    return {"mode": "batch", "queries": len(questions), "failed": summary.get("failed"),
+            "parallelism": parallelism, "seconds": round(elapsed, 2),
+            "queries_per_s": round(len(questions) / elapsed, 2),
+            "first_result_s": round(first_line, 2) if first_line is not None else None, "server_timing": stages}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mode', choices=['sync', 'async'], default='async')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--caches', action='store_true', help='keep the embedding and answer caches on')
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--parallelism', type=int, default=8)
+    parser.add_argument('--output', help='also write the results to this file')
+    stand_ins.add_arguments(parser)
+    args = parser.parse_args()
+    questions = build_questions(args.queries)
+
+    multiproc_dir = tempfile.mkdtemp(prefix='rag-bench-')
+    env = bench_end_to_end.service_environment(args, multiproc_dir)
+    env.setdefault('BATCH_PARALLELISM', str(args.parallelism))
+    processes = []
+    try:
+        processes.append(subprocess.Popen(bench_end_to_end.stand_in_command(args), stdout=subprocess.DEVNULL))
+        bench_end_to_end.wait_until_up(f"http://{args.host}:{args.vllm_port}/v1/models")
+        processes.append(subprocess.Popen(bench_end_to_end.service_command(args), cwd=bench_end_to_end.SERVICE_DIR,
+                                          env=env))
+        url = f"http://{args.host}:{args.port}"
+        bench_end_to_end.wait_until_up(f"{url}/health")
+        with httpx.Client(base_url=url, timeout=None) as client:
+            results = [run_sequential(client, questions), run_batch(client, questions, args.parallelism)]
+        results.append({"speedup": round(results[1]["queries_per_s"] / results[0]["queries_per_s"], 2),
+                        "server": args.mode, "workers": args.workers})
+        text = "\n".join(json.dumps(result) for result in results)
+        print(text)
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.write(text + "\n")
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            process.wait()
+        shutil.rmtree(multiproc_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
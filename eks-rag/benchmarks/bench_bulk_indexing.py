@@ -0,0 +1,114 @@
+"""Indexing throughput of index_logs.py: one request per log against bulk requests.
+
+Starts the HTTP stand-ins, whose OpenSearch accepts index creation, single
+documents and /_bulk requests with --opensearch-latency per request plus
+--opensearch-per-doc per document, then indexes --documents generated logs
+with their two 1024-d fake embeddings three ways: an os_client.index call per
+log as index_logs.py used to, bulk_index over streaming_bulk, and bulk_index
+over parallel_bulk with --threads requests in flight. --opensearch-reject-rate
+makes the stand-in reject that share of bulk items with 429 to exercise the
+retries.
+
+    python benchmarks/bench_bulk_indexing.py --documents 2000 --threads 4 --opensearch-reject-rate 0.02
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+import stand_ins
+import bench_end_to_end
+from fakes import fake_embedding, load_corpus
+
+sys.path.insert(0, os.path.join(bench_end_to_end.SERVICE_DIR, '..', 'opensearch-setup'))
+
+import index_logs
+
+INDEX_NAME = 'bench-error-logs'
+
+
+def build_logs(count):
+    """``count`` logs with their embeddings, cycling through the generated corpus"""
+    corpus = load_corpus()
+    logs = []
+    for i in range(count):
+        log = dict(corpus[i % len(corpus)])
+        log['message_embedding'] = fake_embedding(log['message'])
+        log['diagnostic_embedding'] = fake_embedding(index_logs.prepare_diagnostic_text(log['diagnostic_info']))
+        logs.append(log)
+    return logs
+
+
+def reset_index(client):
+    index_logs.delete_index_if_exists(client, INDEX_NAME)
+    client.indices.create(index=INDEX_NAME, body={})
+
+
+def run_per_document(client, logs):
+    reset_index(client)
+    started = time.perf_counter()
+    failed = 0
+    for log in logs:
+        try:
+            client.index(index=INDEX_NAME, body=log)
+        except Exception:
+            failed += 1
+    elapsed = time.perf_counter() - started
+    return {"mode": "per_document", "documents": len(logs), "failed": failed, "seconds": round(elapsed, 2),
+            "docs_per_s": round(len(logs) / elapsed, 1)}
+
+
+def run_bulk(client, logs, args, threads):
+    reset_index(client)
+    progress = index_logs.BulkProgress(interval=float('inf'))
+    started = time.perf_counter()
+    failures = index_logs.bulk_index(
+        client, ({"_index": INDEX_NAME, "_source": log} for log in logs), threads=threads,
+        chunk_size=args.chunk_size, max_chunk_bytes=args.max_chunk_bytes, initial_backoff=args.initial_backoff,
+        progress=progress
+    )
+    elapsed = time.perf_counter() - started
+    return {"mode": "parallel_bulk" if threads > 1 else "streaming_bulk", "documents": len(logs),
+            "indexed": progress.indexed, "failed": len(failures), "retried": progress.retried,
+            "threads": threads, "chunk_size": args.chunk_size, "seconds": round(elapsed, 2),
+            "docs_per_s": round(len(logs) / elapsed, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--documents', type=int, default=1000)
+    parser.add_argument('--per-document-limit', type=int, default=500,
+                        help='logs indexed one request at a time; the loop is slow')
+    parser.add_argument('--chunk-size', type=int, default=500)
+    parser.add_argument('--max-chunk-bytes', type=int, default=index_logs.DEFAULT_MAX_CHUNK_BYTES)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--initial-backoff', type=float, default=0.2)
+    parser.add_argument('--output', help='also write the results to this file')
+    stand_ins.add_arguments(parser)
+    args = parser.parse_args()
+    logs = build_logs(args.documents)
+
+    process = subprocess.Popen(bench_end_to_end.stand_in_command(args), stdout=subprocess.DEVNULL)
+    try:
+        url = f"http://{args.host}:{args.opensearch_port}"
+        bench_end_to_end.wait_until_up(url)
+        client = index_logs.get_local_opensearch_client(url)
+        results = [
+            run_per_document(client, logs[:args.per_document_limit]),
+            run_bulk(client, logs, args, threads=1),
+            run_bulk(client, logs, args, threads=args.threads),
+        ]
+        text = "\n".join(json.dumps(result) for result in results)
+        print(text)
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.write(text + "\n")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""Prompt size of the verbose context against the compact packed context.
+
+Retrieves the top-k logs for the UI's example prompts from the in-memory
+stand-in and builds the full vLLM chat payload both ways. The grouped
+variant over-fetches k x --overfetch hits and collapses duplicate messages
+before packing; it reports how many logs and distinct messages the
+context then covers. Token counts use the byte estimate, or a Hugging
+Face tokenizer when --tokenizer is given (requires transformers), in which
+case the byte estimate is also calibrated against it.
+
+    python benchmarks/bench_context_packer.py --k 5,20 --budget 1024
+"""
+import os
+import sys
+import json
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from rag_common import build_knn_query, parse_search_hits, build_context, build_vllm_payload
+from result_grouping import group_duplicates
+from context_packer import ByteEstimateTokenizer, HuggingFaceTokenizer, calibrate_bytes_per_token, pack_context
+from fakes import FakeOpenSearch, fake_embedding, load_corpus
+
+PROMPTS = [
+    "Are there any vehicles reporting engine temperatures above 110°C in the last hour? If yes, what immediate "
+    "actions should be taken based on the sensor readings and diagnostic codes?",
+    "Show me any vehicles with battery voltage below 11.5V that are currently in MOVING state. What should be "
+    "communicated to the drivers?",
+    "Are there any vehicles showing transmission failure codes P0700 in the last 30 minutes?",
+    "Why are vehicles losing their telematics connection?",
+]
+
+
+def prompt_text(payload):
+    return "".join(message["content"] for message in payload["messages"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--k', default='5,20', help='retrieved documents per prompt')
+    parser.add_argument('--budget', type=int, default=1024, help='context token budget')
+    parser.add_argument('--overfetch', type=int, default=4, help='candidates per final document when grouping')
+    parser.add_argument('--tokenizer', help='Hugging Face tokenizer name, e.g. NousResearch/Meta-Llama-3-8B-Instruct')
+    args = parser.parse_args()
+
+    count_tokens = ByteEstimateTokenizer()
+    if args.tokenizer:
+        count_tokens = HuggingFaceTokenizer(args.tokenizer)
+
+    client = FakeOpenSearch(load_corpus(), latency=0)
+    samples = []
+    for k in [int(k) for k in args.k.split(',')]:
+        totals = dict.fromkeys(["verbose_tokens", "compact_tokens", "verbose_bytes", "compact_bytes", "docs_kept",
+                                "grouped_tokens", "grouped_logs_covered", "grouped_messages"], 0)
+        for prompt in PROMPTS:
+            docs = parse_search_hits(client.search(index=None, body=build_knn_query(fake_embedding(prompt), k)))
+            verbose = prompt_text(build_vllm_payload(prompt, build_context(docs)))
+            context, packed = pack_context(docs, args.budget, count_tokens)
+            compact = prompt_text(build_vllm_payload(prompt, context))
+            samples.extend([verbose, compact])
+            totals["verbose_tokens"] += count_tokens(verbose)
+            totals["compact_tokens"] += count_tokens(compact)
+            totals["verbose_bytes"] += len(verbose.encode('utf-8'))
+            totals["compact_bytes"] += len(compact.encode('utf-8'))
+            totals["docs_kept"] += len(packed)
+
+            candidates = parse_search_hits(client.search(
+                index=None, body=build_knn_query(fake_embedding(prompt), k * args.overfetch)
+            ))
+            context, packed = pack_context(group_duplicates(candidates, k), args.budget, count_tokens)
+            totals["grouped_tokens"] += count_tokens(prompt_text(build_vllm_payload(prompt, context)))
+            totals["grouped_logs_covered"] += sum(doc["group"]["count"] for doc in packed)
+            totals["grouped_messages"] += len(packed)
+        result = {"k": k, "budget": args.budget, "prompts": len(PROMPTS)}
+        result.update({name: round(value / len(PROMPTS), 1) for name, value in totals.items()})
+        result["token_reduction"] = round(1 - totals["compact_tokens"] / totals["verbose_tokens"], 3)
+        print(json.dumps(result))
+
+    if args.tokenizer:
+        print(json.dumps({"calibrated_bytes_per_token": round(calibrate_bytes_per_token(count_tokens, samples), 2)}))
+
+
+if __name__ == '__main__':
+    main()
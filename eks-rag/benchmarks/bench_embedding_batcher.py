@@ -0,0 +1,95 @@
+"""Embedding coalescer against a local fake embedder.
+
+Replays an open-loop Poisson arrival of query texts and compares one Bedrock
+call per query with AsyncEmbeddingBatcher at several coalescing windows. The
+fake embedder charges a fixed per-call latency plus a per-text cost and only
+admits a limited number of concurrent calls, like a provisioned Bedrock quota.
+
+    python benchmarks/bench_embedding_batcher.py --qps 400 --requests 2000
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from embedding_batcher import AsyncEmbeddingBatcher
+from fakes import fake_embedding
+
+
+class FakeAsyncEmbedder:
+    def __init__(self, call_latency, per_text_latency, max_concurrent_calls):
+        self.call_latency = call_latency
+        self.per_text_latency = per_text_latency
+        self.slots = asyncio.Semaphore(max_concurrent_calls)
+        self.calls = 0
+
+    async def embed_batch(self, texts):
+        async with self.slots:
+            self.calls += 1
+            await asyncio.sleep(self.call_latency + self.per_text_latency * len(texts))
+            return [fake_embedding(text, dimension=8) for text in texts]
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def run(args, window_ms):
+    embedder = FakeAsyncEmbedder(args.call_latency, args.per_text_latency, args.max_concurrent_calls)
+    batcher = None
+    if window_ms > 0:
+        batcher = AsyncEmbeddingBatcher(embedder.embed_batch, max_wait=window_ms / 1000, max_batch_size=args.max_batch)
+
+    async def one(text):
+        started = time.perf_counter()
+        if batcher is not None:
+            await batcher.embed(text)
+        else:
+            await embedder.embed_batch([text])
+        return time.perf_counter() - started
+
+    rng = random.Random(7)
+    tasks = []
+    start = time.perf_counter()
+    for i in range(args.requests):
+        tasks.append(asyncio.ensure_future(one(f"query {i % 50}")))
+        await asyncio.sleep(rng.expovariate(args.qps))
+    latencies = await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+
+    result = {
+        "window_ms": window_ms,
+        "requests": args.requests,
+        "bedrock_calls": embedder.calls,
+        "throughput_rps": round(args.requests / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+    }
+    if batcher is not None:
+        result["batcher"] = batcher.stats.snapshot()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--qps', type=float, default=400)
+    parser.add_argument('--windows', default='0,2,5,10', help='coalescing windows in ms; 0 means unbatched')
+    parser.add_argument('--max-batch', type=int, default=96)
+    parser.add_argument('--call-latency', type=float, default=0.04)
+    parser.add_argument('--per-text-latency', type=float, default=0.0005)
+    parser.add_argument('--max-concurrent-calls', type=int, default=10)
+    args = parser.parse_args()
+
+    for window_ms in [float(w) for w in args.windows.split(',')]:
+        print(json.dumps(asyncio.run(run(args, window_ms))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""Ingestion embedding throughput: one Bedrock call per text against EmbeddingStage.
+
+Starts the HTTP stand-ins with a Bedrock invocation quota (--bedrock-quota
+calls per second, answered with ThrottlingException past it) and embeds the
+message and diagnostic text of --logs generated logs twice: two single-text
+calls per log as index_logs.py used to, with botocore's own retries, and
+through EmbeddingStage with batched, concurrent calls under its adaptive
+token bucket and botocore's retries off. Then runs the stage twice more with
+an EmbeddingStore in a fresh file: the first run only sends each distinct
+text once, the second finds them all stored. Checks that every log got its
+own vectors back.
+
+    python benchmarks/bench_embedding_stage.py --logs 3000 --bedrock-quota 10 --rate 20
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+import boto3
+from botocore.config import Config
+
+import stand_ins
+import bench_end_to_end
+from fakes import fake_embedding, load_corpus
+
+sys.path.insert(0, bench_end_to_end.SERVICE_DIR)
+sys.path.insert(0, os.path.join(bench_end_to_end.SERVICE_DIR, '..', 'opensearch-setup'))
+
+import index_logs
+from embedding_stage import EmbeddingStage
+from embedding_store import EmbeddingStore
+
+
+def bedrock_client(url, max_attempts):
+    return boto3.client('bedrock-runtime', region_name='us-west-2', endpoint_url=url,
+                        aws_access_key_id='stand-in', aws_secret_access_key='stand-in',
+                        config=Config(retries={'max_attempts': max_attempts, 'mode': 'standard'},
+                                      max_pool_connections=32))
+
+
+def correct(log, vectors):
+    # Stored vectors come back as float32
+    expected = [fake_embedding(text) for text in index_logs.log_texts(log)]
+    return vectors is not None and all(abs(a - b) < 1e-6 for got, want in zip(vectors, expected)
+                                       for a, b in zip(got, want))
+
+
+def run_single(bedrock, logs):
+    started = time.perf_counter()
+    failed = 0
+    wrong = 0
+    for log in logs:
+        try:
+            vectors = [index_logs.embed_texts(bedrock, [text])[0] for text in index_logs.log_texts(log)]
+        except Exception:
+            failed += 1
+            continue
+        wrong += not correct(log, vectors)
+    elapsed = time.perf_counter() - started
+    return {"mode": "single_text", "logs": len(logs), "calls": 2 * len(logs), "failed": failed, "wrong": wrong,
+            "seconds": round(elapsed, 2), "logs_per_s": round(len(logs) / elapsed, 1)}
+
+
+def run_stage(bedrock, logs, args, store_path=None, mode="embedding_stage"):
+    store = EmbeddingStore(store_path, index_logs.EMBEDDING_MODEL_ID) if store_path else None
+    stage = EmbeddingStage(lambda texts: index_logs.embed_texts(bedrock, texts), batch_size=args.batch_size,
+                           concurrency=args.concurrency, rate=args.rate, initial_backoff=0.2, store=store)
+    started = time.perf_counter()
+    failed = 0
+    wrong = 0
+    for log, vectors in stage.embed_items(iter(logs), index_logs.log_texts):
+        if vectors is None:
+            failed += 1
+        else:
+            wrong += not correct(log, vectors)
+    elapsed = time.perf_counter() - started
+    stats = stage.stats()
+    stage.close()
+    if store is not None:
+        store.close()
+    return {"mode": mode, "logs": len(logs), "calls": stats["calls"], "throttles": stats["throttles"],
+            "failed": failed, "wrong": wrong, "batch_size": args.batch_size, "concurrency": args.concurrency,
+            "final_rate": stats["rate_limit"], "dedupe_ratio": stats["dedupe_ratio"],
+            "calls_saved": stats["calls_saved"], "seconds": round(elapsed, 2),
+            "logs_per_s": round(len(logs) / elapsed, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--logs', type=int, default=2000)
+    parser.add_argument('--single-limit', type=int, default=200,
+                        help='logs embedded one text per call; the loop is slow')
+    parser.add_argument('--batch-size', type=int, default=96)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--rate', type=float, default=20.0, help="the stage's starting calls per second")
+    parser.add_argument('--output', help='also write the results to this file')
+    stand_ins.add_arguments(parser)
+    args = parser.parse_args()
+    corpus = load_corpus()
+    logs = [corpus[i % len(corpus)] for i in range(args.logs)]
+
+    store_dir = tempfile.mkdtemp(prefix='rag-bench-')
+    store_path = os.path.join(store_dir, 'embedding_store.bin')
+    process = subprocess.Popen(bench_end_to_end.stand_in_command(args), stdout=subprocess.DEVNULL)
+    try:
+        url = f"http://{args.host}:{args.bedrock_port}"
+        bench_end_to_end.wait_until_up(f"http://{args.host}:{args.vllm_port}/v1/models")
+        results = [
+            run_single(bedrock_client(url, 10), logs[:args.single_limit]),
+            run_stage(bedrock_client(url, 1), logs, args),
+            run_stage(bedrock_client(url, 1), logs, args, store_path, "store_cold"),
+            run_stage(bedrock_client(url, 1), logs, args, store_path, "store_warm"),
+        ]
+        text = "\n".join(json.dumps(result) for result in results)
+        print(text)
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.write(text + "\n")
+    finally:
+        process.terminate()
+        process.wait()
+        shutil.rmtree(store_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
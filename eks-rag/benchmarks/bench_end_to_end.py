@@ -0,0 +1,118 @@
+"""End-to-end load test of a service under gunicorn against the HTTP stand-ins.
+
+Starts benchmarks/stand_ins.py, then the sync or async service under
+gunicorn the way the container runs it, pointed at the stand-ins through
+OPENSEARCH_URL, BEDROCK_ENDPOINT_URL and VLLM_ENDPOINTS with dummy AWS
+credentials. Once /health answers, benchmarks/load_test.py replays the UI
+prompts at --qps and the JSON report is printed (and written to --output).
+The embedding and answer caches are off unless --caches is given, since
+the UI prompts repeat. Stand-in latencies take the stand_ins.py options.
+
+    python benchmarks/bench_end_to_end.py --mode async --qps 20 --duration 30 --output async.json
+"""
+import os
+import sys
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+import httpx
+
+import stand_ins
+import load_test
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVICE_DIR = os.path.join(BENCHMARKS_DIR, '..')
+
+
+def wait_until_up(url, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def stand_in_command(args):
+    command = [sys.executable, os.path.join(BENCHMARKS_DIR, 'stand_ins.py')]
+    for action in stand_in_options():
+        value = getattr(args, action.dest)
+        if action.nargs == 0:
+            command += [action.option_strings[0]] if value else []
+        else:
+            command += [action.option_strings[0], str(value)]
+    return command
+
+
+def stand_in_options():
+    parser = argparse.ArgumentParser(add_help=False)
+    stand_ins.add_arguments(parser)
+    return parser._actions
+
+
+def service_environment(args, multiproc_dir):
+    env = dict(os.environ)
+    env.setdefault('LOG_LEVEL', 'WARNING')
+    env.update({
+        'OPENSEARCH_URL': f"http://{args.host}:{args.opensearch_port}",
+        'BEDROCK_ENDPOINT_URL': f"http://{args.host}:{args.bedrock_port}",
+        'VLLM_ENDPOINTS': f"http://{args.host}:{args.vllm_port}",
+        'AWS_ACCESS_KEY_ID': 'stand-in',
+        'AWS_SECRET_ACCESS_KEY': 'stand-in',
+        'AWS_DEFAULT_REGION': 'us-west-2',
+        'AWS_EC2_METADATA_DISABLED': 'true',
+        'PROMETHEUS_MULTIPROC_DIR': multiproc_dir,
+        'EMBEDDING_CACHE_PATH': os.path.join(multiproc_dir, 'embedding-cache.bin'),
+    })
+    if not args.caches:
+        env.update({'EMBEDDING_CACHE_ENTRIES': '0', 'SEMANTIC_CACHE_ENTRIES': '0'})
+    return env
+
+
+def service_command(args):
+    command = [sys.executable, '-m', 'gunicorn', '--timeout', '120', '--workers', str(args.workers),
+               '--log-level', 'warning', '--bind', f"{args.host}:{args.port}"]
+    if args.mode == 'async':
+        return command + ['--worker-class', 'uvicorn.workers.UvicornWorker', 'async_service:app']
+    return command + ['vector_search_service:app']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mode', choices=['sync', 'async'], default='async')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--caches', action='store_true', help='keep the embedding and answer caches on')
+    load_test.add_arguments(parser)
+    stand_ins.add_arguments(parser)
+    args = parser.parse_args()
+    args.url = f"http://{args.host}:{args.port}"
+
+    multiproc_dir = tempfile.mkdtemp(prefix='rag-bench-')
+    processes = []
+    try:
+        processes.append(subprocess.Popen(stand_in_command(args), stdout=subprocess.DEVNULL))
+        wait_until_up(f"http://{args.host}:{args.vllm_port}/v1/models")
+        processes.append(subprocess.Popen(service_command(args), cwd=SERVICE_DIR,
+                                          env=service_environment(args, multiproc_dir)))
+        wait_until_up(f"{args.url}/health")
+        result = asyncio.run(load_test.run(args))
+        result["mode"] = args.mode
+        result["workers"] = args.workers
+        load_test.write_report(result, args.output)
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            process.wait()
+        shutil.rmtree(multiproc_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
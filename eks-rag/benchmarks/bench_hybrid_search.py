@@ -0,0 +1,128 @@
+"""Hybrid BM25 + kNN retrieval against kNN-only on the generated corpus.
+
+Builds labelled queries from opensearch-setup/error_logs.json: questions that
+name an error code, a DTC or a vehicle id (relevant: the logs carrying it)
+and descriptive paraphrases of each error template (relevant: logs with that
+error code). Reports precision@k, recall@k (against min(k, relevant)) and
+per-query latency, with the in-memory stand-in charging one round trip per
+search or msearch call.
+
+    python benchmarks/bench_hybrid_search.py --weights 0.3,0.5,0.7
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from rag_common import INDEX_NAME, build_knn_query, parse_search_hits
+from hybrid_search import build_hybrid_msearch, fuse_msearch_response
+from fakes import FakeOpenSearch, fake_embedding, load_corpus
+
+PARAPHRASES = {
+    "SENSOR_001": "engine running too hot, coolant problem",
+    "SENSOR_002": "low battery voltage and charging problems",
+    "SENSOR_003": "unstable fuel pressure causing misfires",
+    "DIAG_001": "cannot read trouble codes from the ECU over OBD",
+    "DIAG_002": "corrupted CAN bus messages between ECUs",
+    "DIAG_003": "ECU too slow to answer parameter requests",
+    "CONN_001": "vehicles that went offline and lost the telematics link",
+    "CONN_002": "health packets never reached the cloud",
+    "CONN_003": "telematics message queue overflowing",
+    "GPS_001": "no GPS signal for a long time",
+    "GPS_002": "vehicle entered a restricted geofence",
+    "GPS_003": "vehicle drove off its planned route",
+}
+
+
+def labelled_queries(corpus, per_kind, seed=7):
+    rng = random.Random(seed)
+    ids = {str(i): doc for i, doc in enumerate(corpus)}
+
+    def relevant(predicate):
+        return {doc_id for doc_id, doc in ids.items() if predicate(doc)}
+
+    queries = []
+    for code, text in PARAPHRASES.items():
+        queries.append(("paraphrase", text, relevant(lambda d: d['error_code'] == code)))
+    for code in rng.sample(sorted(PARAPHRASES), min(per_kind, len(PARAPHRASES))):
+        queries.append(("error_code", f"show recent {code} errors", relevant(lambda d: d['error_code'] == code)))
+    dtcs = sorted({dtc for doc in corpus for dtc in doc['diagnostic_info']['dtc_codes']})
+    for dtc in rng.sample(dtcs, per_kind):
+        queries.append(("dtc", f"which vehicles reported trouble code {dtc}",
+                        relevant(lambda d: dtc in d['diagnostic_info']['dtc_codes'])))
+    vins = sorted({doc['vehicle_id'] for doc in corpus})
+    for vin in rng.sample(vins, per_kind):
+        queries.append(("vehicle", f"what is wrong with vehicle {vin}", relevant(lambda d: d['vehicle_id'] == vin)))
+    return queries
+
+
+def knn_only(client, text, k, candidates, weight):
+    response = client.search(index=INDEX_NAME, body=build_knn_query(fake_embedding(text), k))
+    return parse_search_hits(response)
+
+
+def hybrid(client, text, k, candidates, weight):
+    response = client.msearch(body=build_hybrid_msearch(INDEX_NAME, text, fake_embedding(text), candidates))
+    return parse_search_hits(fuse_msearch_response(response, k, lexical_weight=weight))
+
+
+def evaluate(client, queries, retrieve, k, candidates=20, weight=0.5):
+    by_kind = {}
+    latencies = []
+    for kind, text, relevant in queries:
+        started = time.perf_counter()
+        docs = retrieve(client, text, k, candidates, weight)
+        latencies.append(time.perf_counter() - started)
+        found = sum(1 for doc in docs if doc['doc_id'] in relevant)
+        stats = by_kind.setdefault(kind, {"queries": 0, "precision": 0.0, "recall": 0.0})
+        stats["queries"] += 1
+        stats["precision"] += found / k
+        stats["recall"] += found / min(k, len(relevant)) if relevant else 1.0
+    for stats in by_kind.values():
+        stats["precision"] = round(stats["precision"] / stats["queries"], 3)
+        stats["recall"] = round(stats["recall"] / stats["queries"], 3)
+    total = sum(s["queries"] for s in by_kind.values())
+    return {
+        f"precision@{k}": round(sum(s["precision"] * s["queries"] for s in by_kind.values()) / total, 3),
+        f"recall@{k}": round(sum(s["recall"] * s["queries"] for s in by_kind.values()) / total, 3),
+        "mean_latency_ms": round(sum(latencies) / len(latencies) * 1000, 2),
+        "by_kind": by_kind,
+    }
+
+
+def fusion_cost(client, candidates, k, rounds=2000):
+    """Client-side cost of fusing one msearch response, in microseconds"""
+    text = "show recent SENSOR_002 errors"
+    response = client.msearch(body=build_hybrid_msearch(INDEX_NAME, text, fake_embedding(text), candidates))
+    started = time.perf_counter()
+    for _ in range(rounds):
+        fuse_msearch_response(response, k)
+    return round((time.perf_counter() - started) / rounds * 1e6, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--candidates', type=int, default=20, help='hits fetched per sub-search before fusion')
+    parser.add_argument('--weights', default='0.3,0.5,0.6,0.7', help='lexical weights to try')
+    parser.add_argument('--per-kind', type=int, default=12, help='queries per identifier kind')
+    parser.add_argument('--latency', type=float, default=0.02, help='simulated OpenSearch round trip in seconds')
+    args = parser.parse_args()
+
+    corpus = load_corpus()
+    client = FakeOpenSearch(corpus, latency=args.latency)
+    queries = labelled_queries(corpus, args.per_kind)
+
+    print(json.dumps({"mode": "knn", **evaluate(client, queries, knn_only, args.k)}))
+    print(json.dumps({"fusion_us": fusion_cost(client, args.candidates, args.k)}))
+    for weight in [float(w) for w in args.weights.split(',')]:
+        result = evaluate(client, queries, hybrid, args.k, args.candidates, weight)
+        print(json.dumps({"mode": "hybrid", "lexical_weight": weight, **result}))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""Peak memory of loading the log corpus: json.load against index_logs.py's streaming reader.
+
+Writes --logs generated logs (the corpus repeated) as a JSON array, NDJSON
+and gzip'd NDJSON, then walks each file with read_logs and the array with
+json.load as index_logs.py used to, measuring the time and the peak of
+Python allocations with tracemalloc.
+
+    python benchmarks/bench_log_reader.py --logs 100000
+"""
+import os
+import sys
+import gzip
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import bench_end_to_end
+from fakes import load_corpus
+
+sys.path.insert(0, os.path.join(bench_end_to_end.SERVICE_DIR, '..', 'opensearch-setup'))
+
+from log_reader import read_logs
+
+
+def write_files(directory, count):
+    corpus = load_corpus()
+    logs = [corpus[i % len(corpus)] for i in range(count)]
+    paths = {"json_array": os.path.join(directory, 'logs.json'),
+             "ndjson": os.path.join(directory, 'logs.ndjson'),
+             "ndjson_gz": os.path.join(directory, 'logs.ndjson.gz')}
+    with open(paths["json_array"], 'w') as f:
+        json.dump(logs, f, indent=2)
+    with open(paths["ndjson"], 'w') as f:
+        for log in logs:
+            f.write(json.dumps(log) + "\n")
+    with gzip.open(paths["ndjson_gz"], 'wt') as f:
+        for log in logs:
+            f.write(json.dumps(log) + "\n")
+    return paths
+
+
+def measure(mode, path, load):
+    tracemalloc.start()
+    started = time.perf_counter()
+    count = 0
+    for _ in load(path):
+        count += 1
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"mode": mode, "logs": count, "file_mb": round(os.path.getsize(path) / 2 ** 20, 1),
+            "peak_mb": round(peak / 2 ** 20, 2), "seconds": round(elapsed, 2)}
+
+
+def json_load(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--logs', type=int, default=50000)
+    parser.add_argument('--output', help='also write the results to this file')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='rag-bench-')
+    try:
+        paths = write_files(directory, args.logs)
+        results = [measure("json_load", paths["json_array"], json_load)]
+        results += [measure(mode, path, read_logs) for mode, path in paths.items()]
+        text = "\n".join(json.dumps(result) for result in results)
+        print(text)
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.write(text + "\n")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
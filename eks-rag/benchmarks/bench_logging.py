@@ -0,0 +1,153 @@
+"""Request throughput of vector_search_service under different logging setups.
+
+Sends /submit_query requests from --threads client threads through the Flask
+app, backed by the in-process stand-ins with no added latency so logging
+cost is not hidden behind backend waits. Embeddings are dense, like
+Cohere's, so a logged vector has its real size. Logs go to a file, so
+formatting and write I/O are both paid. Modes:
+
+    off        nothing logged
+    full       every request logs its unredacted search body and vLLM
+               response pretty-printed, synchronously (what the service
+               used to do at INFO)
+    text       INFO text lines on the queue listener, payloads sampled at 1%
+    json       the same as structured JSON lines
+    json_debug json at DEBUG, redacted payloads sampled at 1%
+
+    python benchmarks/bench_logging.py --requests 2000 --threads 4
+"""
+import os
+import sys
+import io
+import json
+import time
+import random
+import logging
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+os.environ.setdefault('AWS_EC2_METADATA_DISABLED', 'true')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-west-2')
+# Repeated questions would otherwise be answered from the caches
+os.environ.setdefault('EMBEDDING_CACHE_ENTRIES', '0')
+os.environ.setdefault('SEMANTIC_CACHE_ENTRIES', '0')
+
+import log_setup
+from fakes import FakeBedrockRuntime, FakeOpenSearch, FakeVLLMAdapter, load_corpus
+
+QUERIES = [
+    "Why are vehicles losing their telematics connection?",
+    "What is causing the GPS signal loss on parked vehicles?",
+    "Which sensor faults need a technician visit?",
+    "Explain the fuel pressure warnings we are seeing.",
+]
+
+
+class DenseBedrockRuntime(FakeBedrockRuntime):
+    """Stand-in embeddings with every component non-zero"""
+
+    def invoke_model(self, modelId, contentType, accept, body):
+        response = super().invoke_model(modelId, contentType, accept, body)
+        payload = json.loads(response['body'].read())
+        payload["embeddings"] = [[value + random.gauss(0, 0.01) for value in embedding]
+                                 for embedding in payload["embeddings"]]
+        return {'body': io.BytesIO(json.dumps(payload).encode('utf-8'))}
+
+
+def pretty_payload_logs():
+    """Log payloads the way the service used to: full, pretty-printed JSON"""
+    log_setup.Redacted.__str__ = lambda self: json.dumps(self.payload, indent=2, default=str)
+
+
+MODES = {
+    "off": dict(level='CRITICAL', fmt='text', async_handler=False, sample_rate='0', redact='true'),
+    "full": dict(level='DEBUG', fmt='text', async_handler=False, sample_rate='1', redact='false'),
+    "text": dict(level='INFO', fmt='text', async_handler=True, sample_rate='0.01', redact='true'),
+    "json": dict(level='INFO', fmt='json', async_handler=True, sample_rate='0.01', redact='true'),
+    "json_debug": dict(level='DEBUG', fmt='json', async_handler=True, sample_rate='0.01', redact='true'),
+}
+
+
+def run(args, mode, settings, app, requests=None):
+    os.environ['LOG_PAYLOAD_SAMPLE_RATE'] = settings['sample_rate']
+    os.environ['LOG_REDACT'] = settings['redact']
+    redacted_str = log_setup.Redacted.__str__
+    if mode == 'full':
+        pretty_payload_logs()
+    with tempfile.NamedTemporaryFile('w', suffix='.log', delete=False) as log_file:
+        path = log_file.name
+    stream = open(path, 'w')
+    log_setup.configure_logging(level=settings['level'], fmt=settings['fmt'],
+                                async_handler=settings['async_handler'], stream=stream)
+
+    per_thread = (requests or args.requests) // args.threads
+    failures = []
+
+    def client():
+        test_client = app.test_client()
+        for i in range(per_thread):
+            response = test_client.post('/submit_query', json={"query": QUERIES[i % len(QUERIES)]})
+            if response.status_code != 200:
+                failures.append(response.status_code)
+
+    threads = [threading.Thread(target=client) for _ in range(args.threads)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    # Drain the listener before measuring what was written
+    log_setup.configure_logging(level='CRITICAL', async_handler=False, stream=open(os.devnull, 'w'))
+    stream.close()
+    log_setup.Redacted.__str__ = redacted_str
+    log_bytes = os.path.getsize(path)
+    os.unlink(path)
+    total = per_thread * args.threads
+    return {
+        "mode": mode,
+        "requests": total,
+        "failures": len(failures),
+        "requests_per_s": round(total / elapsed, 1),
+        "mean_ms": round(elapsed / per_thread * 1000, 2),
+        "log_bytes_per_request": round(log_bytes / total),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--modes', default=','.join(MODES))
+    parser.add_argument('--warmup', type=int, default=500, help='untimed requests sent before the first mode')
+    parser.add_argument('--rounds', type=int, default=3,
+                        help='times each mode runs, in rotated order; the median round is reported')
+    args = parser.parse_args()
+
+    # Imported once the arguments parse: the service sets up its AWS clients on import
+    import vector_search_service
+    vector_search_service.bedrock_runtime = DenseBedrockRuntime(latency=0)
+    vector_search_service.opensearch_client = FakeOpenSearch(load_corpus(), latency=0)
+    vector_search_service.vllm_client.session.mount('http://', FakeVLLMAdapter())
+    logging.getLogger('werkzeug').disabled = True
+
+    # The first requests pay for imports, connection pools and caches; without
+    # a warm-up whichever mode runs first looks slowest
+    modes = args.modes.split(',')
+    run(args, 'warmup', MODES['off'], vector_search_service.app, requests=args.warmup)
+    results = {mode: [] for mode in modes}
+    for round_number in range(args.rounds):
+        shift = round_number % len(modes)
+        for mode in modes[shift:] + modes[:shift]:
+            results[mode].append(run(args, mode, MODES[mode], vector_search_service.app))
+    for mode in modes:
+        rounds = sorted(results[mode], key=lambda result: result['requests_per_s'])
+        print(json.dumps(dict(rounds[len(rounds) // 2], rounds=len(rounds))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""vLLM prefix-cache hit ratio of the previous and the prefix-stable prompt layouts.
+
+Retrieves, groups and packs context for a stream of fleet questions the way
+the services do: a --repeat share of popular questions, the rest generated
+from the corpus' vehicles, error codes and services. The chat completions
+are then sent with three layouts:
+
+    previous       one-line system prompt, then the context in score order
+    context_first  the current instructions, placed after the context
+    stable         the current instructions first, context in a fixed order
+
+The hit ratio is read from the prefix-cache counters on vLLM's /metrics
+before and after each run. By default vLLM is the in-process stand-in, which
+simulates block-level prefix caching and charges prefill time for uncached
+tokens only. --vllm-url runs the same requests against a real server;
+restart it between runs so the cache starts cold.
+
+    python benchmarks/bench_prefix_cache.py --requests 200
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import httpx
+
+from rag_common import build_knn_query, parse_search_hits, build_vllm_payload
+from result_grouping import group_duplicates
+from context_packer import pack_context, render_context
+from prompt_layout import SYSTEM_PROMPT
+from vllm_client import CHAT_COMPLETIONS_PATH
+from fakes import FakeOpenSearch, FakePrefixCache, fake_embedding, fake_vllm_transport, load_corpus
+
+QUESTIONS = [
+    "Are there any vehicles reporting engine temperatures above 110°C in the last hour? If yes, what immediate "
+    "actions should be taken based on the sensor readings and diagnostic codes?",
+    "Show me any vehicles with battery voltage below 11.5V that are currently in MOVING state. What should be "
+    "communicated to the drivers?",
+    "Are there any vehicles showing transmission failure codes P0700 in the last 30 minutes?",
+    "Why are vehicles losing their telematics connection?",
+    "What is causing the GPS signal loss on parked vehicles?",
+    "Which sensor faults need a technician visit?",
+    "Explain the fuel pressure warnings we are seeing.",
+    "What should drivers do when the battery management system reports a fault?",
+]
+
+GENERATED = [
+    "What is causing {error_code} errors on {vehicle_id}?",
+    "Why is {vehicle_id} reporting problems in the {service} service?",
+    "Which vehicles have {error_code} errors and what should the technicians check?",
+    "Summarize the recent {service} issues for {vehicle_id}.",
+]
+
+# vLLM v1 counts queried and hit tokens; older releases expose a hit-rate gauge
+COUNTER_PATTERN = re.compile(r'^vllm:(?:gpu_)?prefix_cache_(queries|hits)(?:_total)?(?:\{[^}]*\})?\s+(\S+)', re.MULTILINE)
+GAUGE_PATTERN = re.compile(r'^vllm:gpu_prefix_cache_hit_rate(?:\{[^}]*\})?\s+(\S+)', re.MULTILINE)
+
+
+def prefix_cache_counters(metrics_text):
+    """Queried and hit token counters, summed over label sets, or the hit-rate gauge"""
+    counters = {"queries": 0.0, "hits": 0.0}
+    for name, value in COUNTER_PATTERN.findall(metrics_text):
+        counters[name] += float(value)
+    gauge = GAUGE_PATTERN.search(metrics_text)
+    if gauge:
+        counters["hit_rate_gauge"] = float(gauge.group(1))
+    return counters
+
+
+def layout_payload(layout, prompt, score_ordered, fixed_order):
+    payload = build_vllm_payload(prompt, fixed_order)
+    if layout == 'previous':
+        payload["messages"] = [
+            {"role": "system", "content": "You are a helpful assistant."},
+            {"role": "user", "content": f"Context: {score_ordered}\n\nQuery: {prompt}"}
+        ]
+    elif layout == 'context_first':
+        payload["messages"] = [
+            {"role": "user", "content": f"Context:\n{score_ordered}\n\n{SYSTEM_PROMPT}\n\nQuery: {prompt}"}
+        ]
+    return payload
+
+
+def workload(args):
+    """(question, score-ordered context, fixed-order context) for each request"""
+    corpus = load_corpus()
+    client = FakeOpenSearch(corpus, latency=0)
+    rng = random.Random(args.seed)
+    requests = []
+    for _ in range(args.requests):
+        if rng.random() < args.repeat:
+            question = rng.choice(QUESTIONS)
+        else:
+            doc = rng.choice(corpus)
+            question = rng.choice(GENERATED).format(**doc)
+        candidates = parse_search_hits(client.search(
+            index=None, body=build_knn_query(fake_embedding(question), args.k * args.overfetch)
+        ))
+        context, packed = pack_context(group_duplicates(candidates, args.k), args.budget)
+        requests.append((question, render_context(packed), context))
+    return requests
+
+
+async def run(args, requests, layout):
+    transport = None
+    if not args.vllm_url:
+        transport = fake_vllm_transport(latency=args.vllm_latency, prefill_per_1k_tokens=args.prefill_per_1k_tokens,
+                                        prefix_cache=FakePrefixCache(block_size=args.block_size))
+    base_url = args.vllm_url or 'http://vllm.local'
+    async with httpx.AsyncClient(transport=transport, base_url=base_url, timeout=120) as client:
+        before = prefix_cache_counters((await client.get('/metrics')).text)
+        started = time.perf_counter()
+        for question, score_ordered, fixed_order in requests:
+            payload = layout_payload(layout, question, score_ordered, fixed_order)
+            (await client.post(CHAT_COMPLETIONS_PATH, json=payload)).raise_for_status()
+        elapsed = time.perf_counter() - started
+        after = prefix_cache_counters((await client.get('/metrics')).text)
+
+    queries = after["queries"] - before["queries"]
+    hits = after["hits"] - before["hits"]
+    result = {
+        "layout": layout,
+        "requests": len(requests),
+        "prompt_tokens": int(queries),
+        "cached_tokens": int(hits),
+        "uncached_tokens": int(queries - hits),
+        "hit_ratio": round(hits / queries, 3) if queries else None,
+        "mean_latency_ms": round(elapsed / len(requests) * 1000, 1),
+    }
+    if "hit_rate_gauge" in after:
+        result["hit_rate_gauge"] = after["hit_rate_gauge"]
+    return result
+
+
+async def main_async(args):
+    requests = workload(args)
+    for layout in ('previous', 'context_first', 'stable'):
+        print(json.dumps(await run(args, requests, layout)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--overfetch', type=int, default=4)
+    parser.add_argument('--budget', type=int, default=1024)
+    parser.add_argument('--repeat', type=float, default=0.3, help='share of requests asking a popular question')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--vllm-url', help='real vLLM base URL instead of the stand-in')
+    parser.add_argument('--block-size', type=int, default=16, help="stand-in KV block size in tokens, vLLM's default")
+    parser.add_argument('--vllm-latency', type=float, default=0.0)
+    parser.add_argument('--prefill-per-1k-tokens', type=float, default=0.15)
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == '__main__':
+    main()
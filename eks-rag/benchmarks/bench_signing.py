@@ -0,0 +1,78 @@
+"""Per-request SigV4 signing overhead for OpenSearch requests.
+
+Compares the previous RefreshingAWS4AuthConnection behaviour (a new boto3
+Session, credential chain resolution and AWS4Auth with a freshly derived
+signing key on every request) with CachedAWS4Auth over a
+CachedCredentialProvider. Credentials come from dummy environment variables,
+so no AWS access is needed.
+
+    python benchmarks/bench_signing.py --requests 2000
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'AKIDEXAMPLE')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'wJalrXUtnFEMI/K7MDENG+bPxRfiCYEXAMPLEKEY')
+os.environ.setdefault('AWS_SESSION_TOKEN', 'example-session-token')
+os.environ.setdefault('AWS_EC2_METADATA_DISABLED', 'true')
+
+import boto3
+import requests
+from requests_aws4auth import AWS4Auth
+
+from aws_auth import CachedCredentialProvider, CachedAWS4Auth
+from rag_common import AWS_REGION, INDEX_NAME, build_knn_query
+from fakes import fake_embedding
+
+URL = f"https://example.{AWS_REGION}.aoss.amazonaws.com:443/{INDEX_NAME}/_search"
+
+
+def prepared_request():
+    body = json.dumps(build_knn_query(fake_embedding("engine misfire on cold start"), 5))
+    return requests.Request('POST', URL, data=body, headers={'Content-Type': 'application/json'}).prepare()
+
+
+def sign_uncached(request):
+    credentials = boto3.Session().get_credentials()
+    auth = AWS4Auth(credentials.access_key, credentials.secret_key, AWS_REGION, 'aoss',
+                    session_token=credentials.token)
+    return auth(request)
+
+
+def measure(sign, requests_count):
+    template = prepared_request()
+    samples = []
+    for _ in range(requests_count):
+        request = template.copy()
+        started = time.perf_counter()
+        sign(request)
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    return {
+        "requests": requests_count,
+        "mean_us": round(sum(samples) / len(samples) * 1e6, 1),
+        "p50_us": round(samples[len(samples) // 2] * 1e6, 1),
+        "p99_us": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1e6, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    print(json.dumps({"mode": "session_per_request", **measure(sign_uncached, args.requests)}))
+
+    auth = CachedAWS4Auth(CachedCredentialProvider(), AWS_REGION, 'aoss')
+    result = measure(auth, args.requests)
+    print(json.dumps({"mode": "cached", **result, "signers_built": auth.signers_built,
+                      "credentials": auth.provider.stats()}))
+
+
+if __name__ == '__main__':
+    main()
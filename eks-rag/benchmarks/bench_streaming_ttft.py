@@ -0,0 +1,75 @@
+"""Time to first token for JSON and SSE responses from /submit_query.
+
+Serves async_service on a local port against in-process stand-ins whose vLLM
+emits one token every --token-interval seconds, then compares when a client
+sees the first answer text in JSON mode (the whole completion) and in SSE mode.
+
+    python benchmarks/bench_streaming_ttft.py --requests 20
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('EMBEDDING_CACHE_ENTRIES', '0')
+os.environ.setdefault('SEMANTIC_CACHE_ENTRIES', '0')
+
+import requests
+import uvicorn
+
+import async_service
+from vllm_client import AsyncVLLMClient
+from fakes import FakeBedrockRuntime, FakeAsyncOpenSearch, fake_vllm_transport, load_corpus
+
+QUERY = "Show me any vehicles with battery voltage below 11.5V that are currently in MOVING state."
+
+
+def measure(url, stream):
+    headers = {"Accept": "text/event-stream"} if stream else {}
+    started = time.perf_counter()
+    first_token = None
+    with requests.post(url, json={"query": QUERY}, headers=headers, stream=True) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if first_token is None and b'llm_response' in line:
+                first_token = time.perf_counter() - started
+    return first_token, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--port', type=int, default=18080)
+    parser.add_argument('--prefill-latency', type=float, default=0.3)
+    parser.add_argument('--token-interval', type=float, default=0.05)
+    args = parser.parse_args()
+
+    async_service.bedrock_runtime = FakeBedrockRuntime(latency=0.02)
+    async_service.opensearch_client = FakeAsyncOpenSearch(load_corpus(limit=500), latency=0.02)
+    async_service.vllm_client = AsyncVLLMClient(
+        ['http://vllm.local'],
+        transport=fake_vllm_transport(latency=args.prefill_latency, token_interval=args.token_interval))
+
+    server = uvicorn.Server(uvicorn.Config(async_service.app, port=args.port, log_level='warning'))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+
+    url = f"http://127.0.0.1:{args.port}/submit_query"
+    for stream in (False, True):
+        samples = [measure(url, stream) for _ in range(args.requests)]
+        print(json.dumps({
+            "mode": "sse" if stream else "json",
+            "requests": args.requests,
+            "ttft_p50_ms": round(statistics.median(s[0] for s in samples) * 1000, 1),
+            "total_p50_ms": round(statistics.median(s[1] for s in samples) * 1000, 1),
+        }))
+    server.should_exit = True
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,458 @@
+import io
+import os
+import re
+import json
+import time
+import math
+import asyncio
+import hashlib
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+import httpx
+import requests
+
+EMBEDDING_DIMENSION = 1024
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), '..', '..', 'opensearch-setup', 'error_logs.json')
+
+
+def fake_embedding(text, dimension=EMBEDDING_DIMENSION):
+    """Deterministic hashed bag-of-words embedding, L2 normalized"""
+    vector = [0.0] * dimension
+    for token in text.lower().split():
+        digest = hashlib.md5(token.encode('utf-8')).digest()
+        index = int.from_bytes(digest[:4], 'little') % dimension
+        vector[index] += 1.0 if digest[4] & 1 else -1.0
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+def load_corpus(path=CORPUS_PATH, limit=None, recent=False):
+    """Load the generated error logs used by the local stand-ins.
+
+    With ``recent`` the timestamps are shifted so the newest log is from
+    now, which makes relative time windows ("last hour") match.
+    """
+    with open(path, 'r') as f:
+        logs = json.load(f)
+    logs = logs[:limit] if limit else logs
+    if recent and logs:
+        parse = lambda ts: datetime.fromisoformat(ts.replace('Z', '+00:00'))
+        shift = datetime.now(timezone.utc) - max(parse(log['timestamp']) for log in logs)
+        for log in logs:
+            log['timestamp'] = (parse(log['timestamp']) + shift).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+    return logs
+
+
+class FakeBedrockRuntime:
+    """Stand-in for the boto3 bedrock-runtime client with a fixed latency"""
+
+    def __init__(self, latency=0.05):
+        self.latency = latency
+        self.calls = 0
+        self.texts = 0
+
+    def invoke_model(self, modelId, contentType, accept, body):
+        texts = json.loads(body)['texts']
+        self.calls += 1
+        self.texts += len(texts)
+        time.sleep(self.latency)
+        payload = {"embeddings": [fake_embedding(text) for text in texts]}
+        return {'body': io.BytesIO(json.dumps(payload).encode('utf-8'))}
+
+
+def _tokens(text):
+    return re.findall(r'\w+', text.lower())
+
+
+def _field(doc, path):
+    for part in path.split('.'):
+        doc = doc.get(part, {}) if isinstance(doc, dict) else {}
+    return doc
+
+
+def _date_math(value):
+    # Just the forms query_filters emits: now-<n><unit> and now/d
+    now = datetime.now(timezone.utc)
+    if value == 'now/d':
+        return now.replace(hour=0, minute=0, second=0, microsecond=0)
+    match = re.fullmatch(r'now-(\d+)([mhdw])', value)
+    if match:
+        unit = {'m': 'minutes', 'h': 'hours', 'd': 'days', 'w': 'weeks'}[match.group(2)]
+        return now - timedelta(**{unit: int(match.group(1))})
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def matches_filters(doc, filter_clauses):
+    """Evaluate range and terms filter clauses against a document"""
+    for clause in filter_clauses:
+        if 'terms' in clause:
+            field, values = next(iter(clause['terms'].items()))
+            value = _field(doc, field)
+            if not set(value if isinstance(value, list) else [value]) & set(values):
+                return False
+        elif 'range' in clause:
+            field, bounds = next(iter(clause['range'].items()))
+            value = _field(doc, field)
+            if value == {}:
+                return False
+            if field == 'timestamp':
+                value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+                bounds = {op: _date_math(bound) for op, bound in bounds.items()}
+            for op, bound in bounds.items():
+                if not {'gt': value > bound, 'gte': value >= bound, 'lt': value < bound, 'lte': value <= bound}[op]:
+                    return False
+    return True
+
+
+def matches_query(doc, query):
+    """Evaluate a bool / range / terms / match_all query against a document"""
+    if 'bool' not in query:
+        return 'match_all' in query or matches_filters(doc, [query])
+    clauses = query['bool']
+    if not all(matches_query(doc, q) for q in clauses.get('filter', []) + clauses.get('must', [])):
+        return False
+    should = clauses.get('should', [])
+    required = clauses.get('minimum_should_match', 0 if 'filter' in clauses or 'must' in clauses else 1)
+    return not should or sum(1 for q in should if matches_query(doc, q)) >= required
+
+
+def _truncate(moment, interval):
+    if interval == 'minute':
+        return moment.replace(second=0, microsecond=0)
+    if interval == 'hour':
+        return moment.replace(minute=0, second=0, microsecond=0)
+    moment = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    return moment - timedelta(days=moment.weekday()) if interval == 'week' else moment
+
+
+class _InMemoryIndex:
+    def __init__(self, corpus):
+        self.corpus = corpus
+        # Messages come from a small set of templates, so score each once
+        self.by_message = {}
+        for doc_id, doc in enumerate(corpus):
+            self.by_message.setdefault(doc['message'], []).append((str(doc_id), doc))
+        self.message_vectors = {message: fake_embedding(message) for message in self.by_message}
+        self._message_tokens = None
+        self._keyword_indexes = {}
+
+    def knn(self, vector, k, filter_clauses=()):
+        scored = sorted(
+            ((sum(a * b for a, b in zip(vector, message_vector)), message)
+             for message, message_vector in self.message_vectors.items()),
+            reverse=True
+        )
+        hits = []
+        for score, message in scored:
+            for doc_id, doc in self.by_message[message]:
+                if not matches_filters(doc, filter_clauses):
+                    continue
+                hits.append({"_id": doc_id, "_score": score, "_source": doc})
+                if len(hits) == k:
+                    return hits
+        return hits
+
+    def _message_scores(self, text):
+        # BM25 over the message templates, weighted by how many docs use each
+        if self._message_tokens is None:
+            self._message_tokens = {message: _tokens(message) for message in self.by_message}
+            self._avg_length = sum(len(t) for t in self._message_tokens.values()) / len(self._message_tokens)
+            self._doc_freq = {}
+            for message, tokens in self._message_tokens.items():
+                for token in set(tokens):
+                    self._doc_freq[token] = self._doc_freq.get(token, 0) + len(self.by_message[message])
+        total = len(self.corpus)
+        scores = {}
+        for message, tokens in self._message_tokens.items():
+            score = 0.0
+            for token in set(_tokens(text)):
+                tf = tokens.count(token)
+                if tf:
+                    df = self._doc_freq[token]
+                    idf = math.log(1 + (total - df + 0.5) / (df + 0.5))
+                    score += idf * tf * 2.2 / (tf + 1.2 * (0.25 + 0.75 * len(tokens) / self._avg_length))
+            scores[message] = score
+        return scores
+
+    def lexical(self, query, size):
+        """BM25 on the message, optionally restricted to identifier matches, as built by hybrid_search"""
+        message_scores = self._message_scores(query['bool']['should'][0]['match']['message']['query'])
+        candidates = range(len(self.corpus))
+        for clause in query['bool'].get('must', []):
+            matching = set()
+            for terms in clause['bool']['should']:
+                field, values = next(iter(terms['terms'].items()))
+                for value in values:
+                    matching.update(self._keyword_index(field).get(value, ()))
+            candidates = sorted(matching)
+        hits = []
+        for doc_id in candidates:
+            doc = self.corpus[doc_id]
+            if not matches_filters(doc, query['bool'].get('filter', ())):
+                continue
+            score = message_scores.get(doc['message'], 0.0)
+            if score > 0 or 'must' in query['bool']:
+                hits.append({"_id": str(doc_id), "_score": score, "_source": doc})
+        hits.sort(key=lambda hit: -hit['_score'])
+        return hits[:size]
+
+    def _keyword_index(self, field):
+        if field not in self._keyword_indexes:
+            index = {}
+            for doc_id, doc in enumerate(self.corpus):
+                value = _field(doc, field)
+                for v in value if isinstance(value, list) else [value]:
+                    index.setdefault(v, []).append(doc_id)
+            self._keyword_indexes[field] = index
+        return self._keyword_indexes[field]
+
+    def search(self, body):
+        # took is the engine time, as OpenSearch reports it
+        started = time.perf_counter()
+        response = self._search(body)
+        response["took"] = int((time.perf_counter() - started) * 1000)
+        return response
+
+    def _search(self, body):
+        query = body.get('query', {})
+        if 'knn' in query:
+            knn = query['knn']['message_embedding']
+            filter_clauses = knn.get('filter', {}).get('bool', {}).get('filter', ())
+            hits = self.knn(knn['vector'], knn['k'], filter_clauses)
+        elif any('match' in clause for clause in query.get('bool', {}).get('should', [])):
+            hits = self.lexical(query, body.get('size', 10))
+        else:
+            # Filter-only queries: cache freshness checks and analytics
+            return self.aggregate(body)
+        return {"hits": {"total": {"value": len(hits)}, "hits": hits}}
+
+    def aggregate(self, body):
+        """size-0 search with terms, cardinality, stats, range and date_histogram aggregations"""
+        docs = [doc for doc in self.corpus if matches_query(doc, body.get('query', {"match_all": {}}))]
+        aggregations = {}
+        for name, agg in body.get('aggs', {}).items():
+            kind, spec = next(iter(agg.items()))
+            values = []
+            for doc in docs:
+                value = _field(doc, spec['field'])
+                values.extend(value if isinstance(value, list) else [] if value == {} else [value])
+            if kind == 'terms':
+                counts = {}
+                for value in values:
+                    counts[value] = counts.get(value, 0) + 1
+                top = sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:spec.get('size', 10)]
+                aggregations[name] = {"buckets": [{"key": key, "doc_count": count} for key, count in top]}
+            elif kind == 'cardinality':
+                aggregations[name] = {"value": len(set(values))}
+            elif kind == 'stats':
+                aggregations[name] = {
+                    "count": len(values),
+                    "min": min(values) if values else None,
+                    "max": max(values) if values else None,
+                    "avg": sum(values) / len(values) if values else None,
+                    "sum": sum(values),
+                }
+            elif kind == 'range':
+                buckets = []
+                for bucket in spec['ranges']:
+                    low, high = bucket.get('from', -math.inf), bucket.get('to', math.inf)
+                    key = f"{bucket.get('from', '*')}-{bucket.get('to', '*')}"
+                    buckets.append({"key": key, "doc_count": sum(1 for v in values if low <= v < high)})
+                aggregations[name] = {"buckets": buckets}
+            elif kind == 'date_histogram':
+                counts = {}
+                for value in values:
+                    key = _truncate(datetime.fromisoformat(value.replace('Z', '+00:00')), spec['calendar_interval'])
+                    counts[key] = counts.get(key, 0) + 1
+                aggregations[name] = {"buckets": [
+                    {"key_as_string": key.strftime('%Y-%m-%dT%H:%M:%SZ'), "key": int(key.timestamp() * 1000),
+                     "doc_count": count}
+                    for key, count in sorted(counts.items()) if count >= spec.get('min_doc_count', 0)
+                ]}
+        return {"hits": {"total": {"value": len(docs)}, "hits": []}, "aggregations": aggregations}
+
+    def msearch(self, body):
+        responses = [_InMemoryIndex.search(self, search) for search in body[1::2]]
+        return {"took": max((r["took"] for r in responses), default=0), "responses": responses}
+
+
+class FakeOpenSearch(_InMemoryIndex):
+    """Synchronous in-memory stand-in for the OpenSearch client"""
+
+    def __init__(self, corpus, latency=0.03):
+        super().__init__(corpus)
+        self.latency = latency
+
+    def search(self, index, body, **kwargs):
+        time.sleep(self.latency)
+        return super().search(body)
+
+    def msearch(self, body, **kwargs):
+        # One round trip; the sub-searches run in parallel on the cluster
+        time.sleep(self.latency)
+        return super().msearch(body)
+
+
+class FakeAsyncOpenSearch(_InMemoryIndex):
+    """Asynchronous in-memory stand-in for AsyncOpenSearch"""
+
+    def __init__(self, corpus, latency=0.03):
+        super().__init__(corpus)
+        self.latency = latency
+
+    async def search(self, index, body, **kwargs):
+        await asyncio.sleep(self.latency)
+        return _InMemoryIndex.search(self, body)
+
+    async def msearch(self, body, **kwargs):
+        await asyncio.sleep(self.latency)
+        return _InMemoryIndex.msearch(self, body)
+
+    async def close(self):
+        pass
+
+
+def chat_completion(content):
+    return {
+        "object": "chat.completion",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}]
+    }
+
+
+FAKE_ANSWER = "Fake answer from the local vLLM stand-in."
+
+
+def chat_completion_chunks(content):
+    """OpenAI-compatible streaming chunks, one per whitespace-separated token"""
+    words = content.split(' ')
+    for i, word in enumerate(words):
+        token = word if i == 0 else ' ' + word
+        yield {"object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {"content": token}}]}
+
+
+def estimate_tokens(text):
+    """Rough Llama 3 token count: about four characters per token"""
+    return max(1, len(text) // 4)
+
+
+def render_chat_template(messages):
+    """Prompt text the way the Llama 3 chat template lays out the messages"""
+    parts = ["<|begin_of_text|>"]
+    for message in messages:
+        parts.append(f"<|start_header_id|>{message['role']}<|end_header_id|>\n\n{message['content']}<|eot_id|>")
+    parts.append("<|start_header_id|>assistant<|end_header_id|>\n\n")
+    return "".join(parts)
+
+
+class FakePrefixCache:
+    """vLLM automatic prefix caching over estimated tokens.
+
+    The prompt is cut into blocks of ``block_size`` tokens and each full
+    block is keyed by a hash chained over every block before it, so a block
+    is only reused when the whole prefix up to it is identical. Blocks are
+    evicted least recently used beyond ``capacity`` blocks.
+    """
+
+    def __init__(self, block_size=16, capacity=4096):
+        self.block_chars = block_size * 4
+        self.block_size = block_size
+        self.capacity = capacity
+        self.blocks = OrderedDict()
+        self.queries = 0
+        self.hits = 0
+
+    def prefill(self, text):
+        """Count the prompt's tokens and cached tokens and return the uncached ones"""
+        tokens = estimate_tokens(text)
+        cached = 0
+        matching = True
+        key = b""
+        for start in range(0, len(text) - self.block_chars + 1, self.block_chars):
+            key = hashlib.sha1(key + text[start:start + self.block_chars].encode('utf-8')).digest()
+            if matching and key in self.blocks:
+                cached += self.block_size
+                self.blocks.move_to_end(key)
+            else:
+                matching = False
+                self.blocks[key] = True
+        while len(self.blocks) > self.capacity:
+            self.blocks.popitem(last=False)
+        self.queries += tokens
+        self.hits += cached
+        return tokens - cached
+
+    def metrics(self):
+        """Prometheus exposition of the prefix cache counters, as vLLM names them"""
+        return (
+            "# TYPE vllm:gpu_prefix_cache_queries_total counter\n"
+            f'vllm:gpu_prefix_cache_queries_total{{model_name="fake"}} {float(self.queries)}\n'
+            "# TYPE vllm:gpu_prefix_cache_hits_total counter\n"
+            f'vllm:gpu_prefix_cache_hits_total{{model_name="fake"}} {float(self.hits)}\n'
+        )
+
+
+def fake_vllm_transport(latency=0.5, token_interval=0.0, prefill_per_1k_tokens=0.0, prompt_tokens=None,
+                        prefix_cache=None):
+    """httpx transport answering OpenAI-compatible chat completions.
+
+    The first token is ready after ``latency`` seconds plus the prompt's
+    prefill time and one more every ``token_interval`` seconds;
+    non-streaming requests get the whole answer once the last token is
+    generated. Estimated prompt sizes are appended to ``prompt_tokens``.
+    With a ``prefix_cache``, only uncached tokens are charged prefill time
+    and GET /metrics reports the cache counters.
+    """
+    async def stream_body(prefill):
+        await asyncio.sleep(latency + prefill)
+        for chunk in chat_completion_chunks(FAKE_ANSWER):
+            yield f"data: {json.dumps(chunk)}\n\n".encode('utf-8')
+            await asyncio.sleep(token_interval)
+        yield b"data: [DONE]\n\n"
+
+    async def handler(request):
+        if request.method == 'GET' and request.url.path == '/metrics' and prefix_cache is not None:
+            return httpx.Response(200, text=prefix_cache.metrics())
+        payload = json.loads(request.content)
+        prompt = estimate_tokens("".join(message['content'] for message in payload['messages']))
+        if prompt_tokens is not None:
+            prompt_tokens.append(prompt)
+        if prefix_cache is not None:
+            prompt = prefix_cache.prefill(render_chat_template(payload['messages']))
+        prefill = prompt / 1000 * prefill_per_1k_tokens
+        if payload.get('stream'):
+            return httpx.Response(200, headers={'Content-Type': 'text/event-stream'}, content=stream_body(prefill))
+        tokens = len(list(chat_completion_chunks(FAKE_ANSWER)))
+        await asyncio.sleep(latency + prefill + tokens * token_interval)
+        return httpx.Response(200, json=chat_completion(FAKE_ANSWER))
+    return httpx.MockTransport(handler)
+
+
+class FakeVLLMAdapter(requests.adapters.BaseAdapter):
+    """requests adapter answering chat completions for the sync VLLMClient.
+
+    Mount it on ``VLLMClient.session``; every response arrives after
+    ``latency`` seconds.
+    """
+
+    def __init__(self, latency=0.0):
+        super().__init__()
+        self.latency = latency
+
+    def send(self, request, **kwargs):
+        time.sleep(self.latency)
+        payload = json.loads(request.body)
+        if payload.get('stream'):
+            body = b"".join(f"data: {json.dumps(chunk)}\n\n".encode('utf-8')
+                            for chunk in chat_completion_chunks(FAKE_ANSWER)) + b"data: [DONE]\n\n"
+        else:
+            body = json.dumps(chat_completion(FAKE_ANSWER)).encode('utf-8')
+        response = requests.Response()
+        response.status_code = 200
+        response.raw = io.BytesIO(body)
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
@@ -0,0 +1,176 @@
+"""Open-loop load generator for /submit_query with a JSON latency report.
+
+Replays the Gradio UI's example prompts at --qps for --duration seconds.
+Arrivals are evenly spaced, or exponentially distributed with --poisson, and
+a request is sent on schedule whether or not earlier ones have finished, so
+queueing in the service shows up in the latencies. The report has latency
+percentiles, throughput, error and status counts and, from the Server-Timing
+header, the same percentiles for each stage. --stream asks for server-sent
+events and also reports time to the first answer token, and --priority sends
+the requests as batch or canary traffic.
+
+    python benchmarks/load_test.py --url http://127.0.0.1:5000 --qps 20 --duration 60 --output report.json
+"""
+import os
+import ast
+import json
+import time
+import random
+import asyncio
+import argparse
+
+import httpx
+
+UI_APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'ui', 'app.py')
+
+
+def load_prompts(path=UI_APP_PATH):
+    """default_prompts from the UI, read without importing gradio"""
+    with open(path, 'r') as f:
+        tree = ast.parse(f.read())
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(getattr(t, 'id', None) == 'default_prompts' for t in node.targets):
+            return ast.literal_eval(node.value)
+    raise ValueError(f"No default_prompts in {path}")
+
+
+def parse_server_timing(header):
+    """{stage: seconds} from a Server-Timing header value"""
+    durations = {}
+    for entry in (header or '').split(','):
+        name, _, params = entry.strip().partition(';')
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'dur' and name:
+                durations[name] = float(value) / 1000
+    return durations
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def distribution(samples):
+    if not samples:
+        return None
+    return {
+        "p50_ms": round(percentile(samples, 50) * 1000, 1),
+        "p95_ms": round(percentile(samples, 95) * 1000, 1),
+        "p99_ms": round(percentile(samples, 99) * 1000, 1),
+        "mean_ms": round(sum(samples) / len(samples) * 1000, 1),
+        "max_ms": round(max(samples) * 1000, 1),
+    }
+
+
+async def send(client, prompt, stream, priority=None):
+    """One request: status, latency, time to first token and stage durations"""
+    started = time.perf_counter()
+    result = {"status": None, "ttft": None, "stages": {}}
+    headers = {'X-Request-Priority': priority} if priority else {}
+    try:
+        if stream:
+            headers['Accept'] = 'text/event-stream'
+            async with client.stream('POST', '/submit_query', json={"query": prompt}, headers=headers) as response:
+                result["status"] = response.status_code
+                result["stages"] = parse_server_timing(response.headers.get('Server-Timing'))
+                async for line in response.aiter_lines():
+                    if result["ttft"] is None and line.startswith('data:') and '"llm_response"' in line:
+                        result["ttft"] = time.perf_counter() - started
+        else:
+            response = await client.post('/submit_query', json={"query": prompt}, headers=headers)
+            result["status"] = response.status_code
+            result["stages"] = parse_server_timing(response.headers.get('Server-Timing'))
+    except httpx.HTTPError as e:
+        result["error"] = type(e).__name__
+    result["latency"] = time.perf_counter() - started
+    return result
+
+
+async def run(args):
+    prompts = load_prompts()
+    rng = random.Random(args.seed)
+    limits = httpx.Limits(max_connections=args.max_connections, max_keepalive_connections=args.max_connections)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        tasks = []
+        started = time.perf_counter()
+        next_at = 0.0
+        i = 0
+        while next_at < args.duration:
+            delay = started + next_at - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.ensure_future(send(client, prompts[i % len(prompts)], args.stream, args.priority)))
+            i += 1
+            next_at += rng.expovariate(args.qps) if args.poisson else 1 / args.qps
+        offered = time.perf_counter() - started
+        results = await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+    return report(args, results, offered, elapsed)
+
+
+def report(args, results, offered, elapsed):
+    ok = [r for r in results if r["status"] == 200]
+    status_counts = {}
+    errors = {}
+    for r in results:
+        if r["status"] is not None:
+            status_counts[str(r["status"])] = status_counts.get(str(r["status"]), 0) + 1
+        if "error" in r:
+            errors[r["error"]] = errors.get(r["error"], 0) + 1
+    stages = {}
+    for r in ok:
+        for stage, seconds in r["stages"].items():
+            stages.setdefault(stage, []).append(seconds)
+    result = {
+        "url": args.url,
+        "target_qps": args.qps,
+        "arrivals": "poisson" if args.poisson else "uniform",
+        "stream": args.stream,
+        "priority": args.priority or "interactive",
+        "duration_s": round(elapsed, 2),
+        "requests": len(results),
+        "succeeded": len(ok),
+        "error_rate": round(1 - len(ok) / len(results), 4) if results else None,
+        "status_counts": status_counts,
+        "errors": errors,
+        "offered_qps": round(len(results) / offered, 2) if offered else None,
+        "throughput_rps": round(len(ok) / elapsed, 2),
+        "latency": distribution([r["latency"] for r in ok]),
+        "stages": {stage: distribution(samples) for stage, samples in stages.items()},
+    }
+    if args.stream:
+        result["ttft"] = distribution([r["ttft"] for r in ok if r["ttft"] is not None])
+    return result
+
+
+def add_arguments(parser):
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--qps', type=float, default=10.0)
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds of arrivals')
+    parser.add_argument('--poisson', action='store_true', help='exponential inter-arrival times')
+    parser.add_argument('--stream', action='store_true', help='request server-sent events and report TTFT')
+    parser.add_argument('--priority', choices=['interactive', 'batch', 'canary'], help='X-Request-Priority to send')
+    parser.add_argument('--timeout', type=float, default=120.0)
+    parser.add_argument('--max-connections', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--output', help='also write the report to this file')
+
+
+def write_report(result, output=None):
+    text = json.dumps(result, indent=2)
+    print(text)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_arguments(parser)
+    args = parser.parse_args()
+    write_report(asyncio.run(run(args)), args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,273 @@
+"""HTTP stand-ins for Bedrock, OpenSearch and vLLM on one machine.
+
+Serves, each on its own port of 127.0.0.1:
+
+    bedrock     POST /model/{model_id}/invoke with fake hashed embeddings,
+                answering ThrottlingException past --bedrock-quota calls/s
+    opensearch  POST /{index}/_search and /_msearch over the generated
+                error logs, kNN and BM25 in memory; index creation,
+                POST /{index}/_doc and /_bulk keep the ids of the
+                documents written, GET /{index}/_count counts them
+    vllm        OpenAI-compatible POST /v1/chat/completions, streamed or
+                not, and GET /metrics with the prefix-cache counters
+
+Latencies are lognormal around a median (--*-sigma 0 makes them fixed) and
+vLLM generates --answer-tokens tokens at --tokens-per-s after its time to
+first token, with at most --vllm-max-seqs requests decoding at once. Point
+the services at them with
+
+    OPENSEARCH_URL=http://127.0.0.1:9200
+    BEDROCK_ENDPOINT_URL=http://127.0.0.1:9100
+    VLLM_ENDPOINTS=http://127.0.0.1:9300
+
+    python benchmarks/stand_ins.py --vllm-ttft 0.3 --tokens-per-s 40
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+
+from fakes import (FakePrefixCache, _InMemoryIndex, chat_completion, estimate_tokens, fake_embedding, load_corpus,
+                   render_chat_template)
+
+ANSWER_WORDS = ("The logs show repeated sensor faults on the affected vehicles so schedule a technician "
+                "check and tell drivers to pull over if the warning persists").split()
+
+
+class LatencyModel:
+    """Lognormal delay with the given median in seconds; sigma 0 is a fixed delay"""
+
+    def __init__(self, median, sigma=0.0):
+        self.median = median
+        self.sigma = sigma
+
+    def sample(self):
+        if self.median <= 0:
+            return 0.0
+        return self.median * math.exp(random.gauss(0, self.sigma)) if self.sigma else self.median
+
+    async def wait(self):
+        await asyncio.sleep(self.sample())
+
+
+def answer_text(tokens):
+    return " ".join(ANSWER_WORDS[i % len(ANSWER_WORDS)] for i in range(tokens)) + "."
+
+
+def bedrock_app(latency, quota=0.0):
+    app = FastAPI()
+    # Token bucket of the account's invocation quota, one second of burst
+    bucket = {"tokens": quota, "updated": time.monotonic()}
+
+    def over_quota():
+        if quota <= 0:
+            return False
+        now = time.monotonic()
+        bucket["tokens"] = min(quota, bucket["tokens"] + (now - bucket["updated"]) * quota)
+        bucket["updated"] = now
+        if bucket["tokens"] < 1:
+            return True
+        bucket["tokens"] -= 1
+        return False
+
+    @app.post('/model/{model_id}/invoke')
+    async def invoke(model_id: str, request: Request):
+        texts = (await request.json())['texts']
+        if over_quota():
+            return JSONResponse({"message": "Too many requests, please wait before trying again."},
+                                status_code=429, headers={"x-amzn-ErrorType": "ThrottlingException"})
+        await latency.wait()
+        return {"embeddings": [fake_embedding(text) for text in texts], "texts": texts}
+
+    return app
+
+
+def bulk_item(name, action, reject_rate):
+    op_type, meta = next(iter(action.items()))
+    if random.random() < reject_rate:
+        return {op_type: {"_index": meta.get('_index', name), "status": 429, "error": {
+            "type": "es_rejected_execution_exception", "reason": "rejected execution of bulk item, queue full"}}}
+    return {op_type: {"_index": meta.get('_index', name), "_id": meta.get('_id') or os.urandom(10).hex(),
+                      "result": "created", "status": 201}}
+
+
+def opensearch_app(index, latency, per_doc=0.0, reject_rate=0.0):
+    app = FastAPI()
+    # Ids of the documents indexed and mappings per index name; written
+    # documents are not searchable, and a document indexed again under
+    # the same id is counted once
+    documents = {}
+    mappings = {}
+
+    @app.get('/')
+    async def info():
+        return {"version": {"distribution": "opensearch", "number": "2.11.0"}, "tagline": "stand-in"}
+
+    @app.post('/{name}/_search')
+    async def search(name: str, request: Request):
+        body = await request.json()
+        await latency.wait()
+        return await asyncio.to_thread(index.search, body)
+
+    @app.post('/_msearch')
+    @app.post('/{name}/_msearch')
+    async def msearch(request: Request):
+        lines = [json.loads(line) for line in (await request.body()).splitlines() if line.strip()]
+        await latency.wait()
+        return await asyncio.to_thread(index.msearch, lines)
+
+    @app.head('/{name}')
+    async def exists(name: str):
+        return Response(status_code=200 if name in documents else 404)
+
+    @app.put('/{name}')
+    async def create(name: str, request: Request):
+        body = await request.body()
+        documents.setdefault(name, set())
+        mappings[name] = json.loads(body).get('mappings', {}) if body else {}
+        return {"acknowledged": True, "index": name}
+
+    @app.delete('/{name}')
+    async def delete(name: str):
+        documents.pop(name, None)
+        mappings.pop(name, None)
+        return {"acknowledged": True}
+
+    @app.get('/{name}/_count')
+    async def count(name: str):
+        return {"count": len(documents.get(name, ())), "_shards": {"total": 1, "successful": 1, "failed": 0}}
+
+    @app.get('/{name}/_mapping')
+    async def mapping(name: str):
+        if name not in mappings:
+            return JSONResponse({"error": {"type": "index_not_found_exception"}, "status": 404}, status_code=404)
+        return {name: {"mappings": mappings[name]}}
+
+    @app.post('/{name}/_doc')
+    async def index_document(name: str, request: Request):
+        await request.body()
+        await asyncio.sleep(latency.sample() + per_doc)
+        document_id = os.urandom(10).hex()
+        documents.setdefault(name, set()).add(document_id)
+        return JSONResponse({"_index": name, "_id": document_id, "result": "created"}, status_code=201)
+
+    @app.post('/_bulk')
+    @app.post('/{name}/_bulk')
+    async def bulk(request: Request, name: str = None):
+        # Action and source lines alternate; every action here is index or create
+        lines = [json.loads(line) for line in (await request.body()).splitlines() if line.strip()]
+        actions = lines[0::2]
+        await asyncio.sleep(latency.sample() + per_doc * len(actions))
+        items = [bulk_item(name, action, reject_rate) for action in actions]
+        for item in items:
+            info = next(iter(item.values()))
+            if info['status'] == 201:
+                documents.setdefault(info['_index'], set()).add(info['_id'])
+        return {"took": 0, "errors": any("error" in next(iter(item.values())) for item in items), "items": items}
+
+    return app
+
+
+def vllm_app(args, ttft, prefix_cache):
+    app = FastAPI()
+    # Requests past --vllm-max-seqs wait for a decoding slot, as in vLLM's scheduler
+    slots = asyncio.Semaphore(args.vllm_max_seqs)
+    token_interval = 1 / args.tokens_per_s if args.tokens_per_s > 0 else 0.0
+    content = answer_text(args.answer_tokens)
+
+    async def prefill(messages):
+        prompt = render_chat_template(messages)
+        prompt_tokens = prefix_cache.prefill(prompt) if prefix_cache is not None else estimate_tokens(prompt)
+        await asyncio.sleep(ttft.sample() + prompt_tokens / 1000 * args.prefill_per_1k_tokens)
+
+    async def stream(messages):
+        async with slots:
+            await prefill(messages)
+            for i, word in enumerate(content.split(' ')):
+                chunk = {"object": "chat.completion.chunk",
+                         "choices": [{"index": 0, "delta": {"content": word if i == 0 else ' ' + word}}]}
+                yield f"data: {json.dumps(chunk)}\n\n".encode('utf-8')
+                await asyncio.sleep(token_interval)
+            yield b"data: [DONE]\n\n"
+
+    @app.post('/v1/chat/completions')
+    async def chat_completions(request: Request):
+        payload = await request.json()
+        if payload.get('stream'):
+            return StreamingResponse(stream(payload['messages']), media_type='text/event-stream')
+        async with slots:
+            await prefill(payload['messages'])
+            await asyncio.sleep(args.answer_tokens * token_interval)
+        return JSONResponse(chat_completion(content))
+
+    @app.get('/v1/models')
+    async def models():
+        return {"object": "list", "data": [{"id": "meta-llama/Meta-Llama-3-8B-Instruct", "object": "model"}]}
+
+    @app.get('/metrics')
+    async def metrics():
+        return PlainTextResponse(prefix_cache.metrics() if prefix_cache is not None else "")
+
+    return app
+
+
+async def serve(args):
+    index = _InMemoryIndex(load_corpus(recent=True))
+    prefix_cache = FakePrefixCache() if args.prefix_cache else None
+    apps = [
+        (bedrock_app(LatencyModel(args.bedrock_latency, args.bedrock_sigma), args.bedrock_quota), args.bedrock_port),
+        (opensearch_app(index, LatencyModel(args.opensearch_latency, args.opensearch_sigma),
+                        args.opensearch_per_doc, args.opensearch_reject_rate), args.opensearch_port),
+        (vllm_app(args, LatencyModel(args.vllm_ttft, args.vllm_sigma), prefix_cache), args.vllm_port),
+    ]
+    servers = [uvicorn.Server(uvicorn.Config(app, host=args.host, port=port, log_level='warning',
+                                             backlog=4096, timeout_keep_alive=30))
+               for app, port in apps]
+    print(json.dumps({"bedrock": f"http://{args.host}:{args.bedrock_port}",
+                      "opensearch": f"http://{args.host}:{args.opensearch_port}",
+                      "vllm": f"http://{args.host}:{args.vllm_port}"}), flush=True)
+    await asyncio.gather(*(server.serve() for server in servers))
+
+
+def add_arguments(parser):
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--bedrock-port', type=int, default=9100)
+    parser.add_argument('--opensearch-port', type=int, default=9200)
+    parser.add_argument('--vllm-port', type=int, default=9300)
+    parser.add_argument('--bedrock-latency', type=float, default=0.05, help='median seconds per embedding call')
+    parser.add_argument('--bedrock-sigma', type=float, default=0.3)
+    parser.add_argument('--bedrock-quota', type=float, default=0.0,
+                        help='embedding calls per second before ThrottlingException; 0 is unlimited')
+    parser.add_argument('--opensearch-latency', type=float, default=0.03, help='median seconds per search')
+    parser.add_argument('--opensearch-sigma', type=float, default=0.3)
+    parser.add_argument('--opensearch-per-doc', type=float, default=0.0005,
+                        help='seconds added per document indexed')
+    parser.add_argument('--opensearch-reject-rate', type=float, default=0.0,
+                        help='share of bulk items rejected with 429')
+    parser.add_argument('--vllm-ttft', type=float, default=0.3, help='median seconds to the first token')
+    parser.add_argument('--vllm-sigma', type=float, default=0.3)
+    parser.add_argument('--tokens-per-s', type=float, default=40.0, help='decode rate of one request')
+    parser.add_argument('--answer-tokens', type=int, default=64)
+    parser.add_argument('--vllm-max-seqs', type=int, default=32, help='requests decoding at once')
+    parser.add_argument('--prefill-per-1k-tokens', type=float, default=0.0)
+    parser.add_argument('--prefix-cache', action='store_true', help='simulate automatic prefix caching')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_arguments(parser)
+    asyncio.run(serve(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
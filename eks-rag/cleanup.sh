@@ -5,6 +5,8 @@ echo "Starting cleanup process..."
 # Delete Kubernetes resources
 echo "Deleting Kubernetes service..."
 kubectl delete service eks-rag-service --ignore-not-found
+echo "Deleting Kubernetes autoscaler..."
+kubectl delete hpa eks-rag --ignore-not-found
 echo "Deleting Kubernetes deployment..."
 kubectl delete deployment eks-rag --ignore-not-found
 echo "Deleting Network Policy..."
@@ -0,0 +1,165 @@
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Llama 3 averages about 3.5 bytes per token on these logs: prose runs near
+# 4, the numeric readings and codes closer to 3. Over-estimating keeps the
+# budget a hard limit.
+BYTES_PER_TOKEN = 3.5
+
+SENSOR_COLUMNS = ["engine_temp", "battery_voltage", "fuel_pressure", "speed", "battery_level"]
+TABLE_HEADER = "vehicle|state|" + "|".join(SENSOR_COLUMNS) + "|dtc_codes|status|last_maintenance"
+
+
+class ByteEstimateTokenizer:
+    """Token count estimated from the UTF-8 length of the text"""
+
+    def __init__(self, bytes_per_token=BYTES_PER_TOKEN):
+        self.bytes_per_token = bytes_per_token
+
+    def __call__(self, text):
+        return -(-len(text.encode('utf-8')) // self.bytes_per_token)
+
+
+class HuggingFaceTokenizer:
+    """Exact token count with the served model's tokenizer"""
+
+    def __init__(self, name):
+        from transformers import AutoTokenizer
+        self.tokenizer = AutoTokenizer.from_pretrained(name)
+
+    def __call__(self, text):
+        return len(self.tokenizer.encode(text, add_special_tokens=False))
+
+
+def calibrate_bytes_per_token(count_tokens, samples):
+    """Bytes per token of a tokenizer over sample texts, for ByteEstimateTokenizer"""
+    total_bytes = sum(len(text.encode('utf-8')) for text in samples)
+    total_tokens = sum(count_tokens(text) for text in samples)
+    return total_bytes / total_tokens if total_tokens else BYTES_PER_TOKEN
+
+
+def tokenizer_from_env():
+    """CONTEXT_TOKENIZER names a Hugging Face tokenizer; otherwise estimate from bytes"""
+    name = os.environ.get('CONTEXT_TOKENIZER')
+    if name:
+        try:
+            return HuggingFaceTokenizer(name)
+        except Exception as e:
+            logger.error("Failed to load tokenizer %s, estimating from bytes: %s", name, e)
+    return ByteEstimateTokenizer(float(os.environ.get('CONTEXT_BYTES_PER_TOKEN', BYTES_PER_TOKEN)))
+
+
+def _number(value):
+    if isinstance(value, float):
+        return f"{value:g}"
+    return "" if value is None else str(value)
+
+
+def format_row(doc):
+    """One pipe-separated table row with a document's vehicle, readings and diagnostics"""
+    readings = doc.get("sensor_readings") or {}
+    diagnostics = doc.get("diagnostic_info") or {}
+    cells = [doc.get("vehicle_id", ""), doc.get("vehicle_state", "")]
+    cells.extend(_number(readings.get(column)) for column in SENSOR_COLUMNS)
+    cells.append(" ".join(diagnostics.get("dtc_codes") or []) or "-")
+    cells.append(diagnostics.get("system_status", ""))
+    cells.append((diagnostics.get("last_maintenance") or "")[:10])
+    return "|".join(cells)
+
+
+def format_group(group, max_vehicles=10):
+    """One line summarizing the duplicates a grouped document stands for"""
+    vehicles = group["vehicle_ids"]
+    listed = " ".join(vehicles[:max_vehicles]) + (f" +{len(vehicles) - max_vehicles} more" if len(vehicles) > max_vehicles else "")
+    parts = [f"{group['count']} logs from {len(vehicles)} vehicles ({listed})"]
+    if group.get("first_seen"):
+        parts.append(f"{group['first_seen'][:16]}..{group['last_seen'][:16]}")
+    parts.extend(f"{column} {_number(low)}-{_number(high)}" for column, (low, high) in group["sensor_ranges"].items())
+    return "  all: " + "; ".join(parts)
+
+
+def score_order(doc):
+    """Sort key for best score first.
+
+    Identical messages embed identically, so their scores tie and shards
+    return them in any order; the document id breaks the tie so the same
+    hits always pick the same documents.
+    """
+    return -doc.get("score", 0.0), str(doc.get("doc_id"))
+
+
+def order_documents(docs):
+    """Documents in a fixed order, by message then document id.
+
+    The same documents then render to the same bytes whatever their
+    scores, so requests that retrieve them share a prompt prefix.
+    """
+    return sorted(docs, key=lambda doc: (doc["error_code"], doc["service"], doc["message"], str(doc.get("doc_id"))))
+
+
+def render_context(docs):
+    """Group documents by message so each message is written once above its rows"""
+    groups = {}
+    for doc in docs:
+        groups.setdefault((doc["error_code"], doc["service"], doc["message"]), []).append(doc)
+    lines = [TABLE_HEADER]
+    for (error_code, service, message), rows in groups.items():
+        lines.append(f"[{error_code}] {service}: {message}")
+        for doc in rows:
+            lines.append(format_row(doc))
+            if doc.get("group", {}).get("count", 1) > 1:
+                lines.append(format_group(doc["group"]))
+    return "\n".join(lines)
+
+
+def truncate_context(context, budget, count_tokens):
+    """The longest prefix of ``context`` within ``budget`` tokens: whole lines, then part of the next one"""
+    lines = context.split("\n")
+    kept = 0
+    while kept < len(lines) and count_tokens("\n".join(lines[:kept + 1])) <= budget:
+        kept += 1
+    text = "\n".join(lines[:kept])
+    if kept == len(lines):
+        return text
+    prefix = text + "\n" if kept else ""
+    low, high = 0, len(lines[kept])
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens(prefix + lines[kept][:middle]) <= budget:
+            low = middle
+        else:
+            high = middle - 1
+    return prefix + lines[kept][:low] if low else text
+
+
+def pack_context(similar_docs, budget, count_tokens=None):
+    """Compact context of the best-scoring documents that fits ``budget`` tokens.
+
+    Documents are added in score order and the first one that would push
+    the rendering over budget ends the packing, so the lowest-scoring
+    documents are the ones dropped. The packed documents are rendered in
+    ``order_documents`` order. A best document too large for the budget on
+    its own is truncated to fit rather than leaving the context empty.
+    Returns the context and the documents it contains.
+    """
+    count_tokens = count_tokens or ByteEstimateTokenizer()
+    ranked = sorted(similar_docs, key=score_order)
+    packed = []
+    context = ""
+    for doc in ranked:
+        candidate = render_context(order_documents(packed + [doc]))
+        if count_tokens(candidate) > budget:
+            break
+        packed.append(doc)
+        context = candidate
+    if not ranked:
+        return "No matching error logs were found.", packed
+    if not packed:
+        logger.info("Context budget of %d tokens is too small for the best document, truncating it", budget)
+        packed.append(ranked[0])
+        context = truncate_context(render_context(packed), budget, count_tokens)
+    if len(packed) < len(ranked):
+        logger.info("Context budget of %d tokens fits %d of %d documents", budget, len(packed), len(ranked))
+    return context, packed
@@ -39,6 +39,7 @@ echo "Deploying to Kubernetes..."
 envsubst < deployment.yaml | kubectl apply -f - &>/dev/null && echo "Deployment applied"
 kubectl apply -f service.yaml &>/dev/null && echo "Service applied"
 kubectl apply -f network-policy.yaml &>/dev/null && echo "Network policy applied"
+kubectl apply -f hpa.yaml &>/dev/null && echo "Autoscaler applied"
 
 # Wait for deployment
 echo "Waiting for deployment..."
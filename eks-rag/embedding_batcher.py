@@ -0,0 +1,163 @@
+import time
+import asyncio
+import threading
+
+# Bedrock cohere.embed-english-v3 accepts at most 96 texts per invoke_model call
+MAX_EMBED_BATCH = 96
+
+
+class BatcherStats:
+    """Batch size and queueing delay counters shared by both batchers"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.texts = 0
+        self.max_batch_size = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.errors = 0
+
+    def record(self, batch_size, waits):
+        with self._lock:
+            self.batches += 1
+            self.texts += batch_size
+            self.max_batch_size = max(self.max_batch_size, batch_size)
+            self.total_wait += sum(waits)
+            self.max_wait = max([self.max_wait] + list(waits))
+
+    def record_error(self):
+        with self._lock:
+            self.errors += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "batches": self.batches,
+                "texts": self.texts,
+                "errors": self.errors,
+                "avg_batch_size": round(self.texts / self.batches, 2) if self.batches else 0.0,
+                "max_batch_size": self.max_batch_size,
+                "avg_wait_ms": round(self.total_wait / self.texts * 1000, 3) if self.texts else 0.0,
+                "max_wait_ms": round(self.max_wait * 1000, 3),
+            }
+
+
+class AsyncEmbeddingBatcher:
+    """Coalesces concurrent embed() calls into batched embedding requests.
+
+    The first text to arrive opens a window of ``max_wait`` seconds; the batch
+    is flushed when the window closes or ``max_batch_size`` texts are queued,
+    whichever comes first. ``embed_batch`` is an async callable mapping a list
+    of texts to a list of vectors in the same order.
+    """
+
+    def __init__(self, embed_batch, max_wait=0.005, max_batch_size=MAX_EMBED_BATCH):
+        self.embed_batch = embed_batch
+        self.max_wait = max_wait
+        self.max_batch_size = min(max_batch_size, MAX_EMBED_BATCH)
+        self.stats = BatcherStats()
+        self._pending = []
+        self._timer = None
+
+    async def embed(self, text):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((text, future, time.perf_counter()))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending[:self.max_batch_size], self._pending[self.max_batch_size:]
+        if self._pending:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._flush)
+        if batch:
+            asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch):
+        now = time.perf_counter()
+        self.stats.record(len(batch), [now - enqueued for _, _, enqueued in batch])
+        try:
+            vectors = await self.embed_batch([text for text, _, _ in batch])
+        except Exception as e:
+            self.stats.record_error()
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future, _), vector in zip(batch, vectors):
+            if not future.done():
+                future.set_result(vector)
+
+
+class EmbeddingBatcher:
+    """Thread-based equivalent of AsyncEmbeddingBatcher for threaded servers.
+
+    The thread that opens a batch becomes its leader: it waits for the window
+    to close (or the batch to fill), calls ``embed_batch`` once and hands each
+    waiting thread its vector.
+    """
+
+    def __init__(self, embed_batch, max_wait=0.005, max_batch_size=MAX_EMBED_BATCH):
+        self.embed_batch = embed_batch
+        self.max_wait = max_wait
+        self.max_batch_size = min(max_batch_size, MAX_EMBED_BATCH)
+        self.stats = BatcherStats()
+        self._lock = threading.Lock()
+        self._batch = None
+
+    def embed(self, text):
+        with self._lock:
+            batch = self._batch
+            if batch is None:
+                batch = self._batch = _ThreadBatch()
+                leader = True
+            else:
+                leader = False
+            index = len(batch.texts)
+            batch.texts.append(text)
+            batch.enqueued.append(time.perf_counter())
+            if len(batch.texts) >= self.max_batch_size:
+                self._batch = None
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(self.max_wait)
+            with self._lock:
+                if self._batch is batch:
+                    self._batch = None
+            self._run(batch)
+        else:
+            batch.done.wait()
+
+        if batch.error is not None:
+            raise batch.error
+        return batch.vectors[index]
+
+    def _run(self, batch):
+        now = time.perf_counter()
+        self.stats.record(len(batch.texts), [now - enqueued for enqueued in batch.enqueued])
+        try:
+            batch.vectors = self.embed_batch(batch.texts)
+        except Exception as e:
+            self.stats.record_error()
+            batch.error = e
+        finally:
+            batch.done.set()
+
+
+class _ThreadBatch:
+    def __init__(self):
+        self.texts = []
+        self.enqueued = []
+        self.vectors = None
+        self.error = None
+        self.full = threading.Event()
+        self.done = threading.Event()
@@ -0,0 +1,162 @@
+import os
+import time
+import fcntl
+import hashlib
+import threading
+
+import numpy as np
+
+MAGIC = 0x52414745434143  # "RAGECAC"
+VERSION = 1
+
+# Header words: magic, version, dimension, sets, ways, then the shared counters
+HEADER_WORDS = 16
+H_MAGIC, H_VERSION, H_DIMENSION, H_SETS, H_WAYS = range(5)
+H_HITS, H_MISSES, H_EVICTIONS, H_EXPIRATIONS, H_INSERTS = range(5, 10)
+
+# A 128-bit key split in two words; (0, 0) marks an empty slot
+SLOT_DTYPE = np.dtype([('k0', '<u8'), ('k1', '<u8'), ('created', '<f8'), ('last_used', '<f8')])
+
+
+def normalize_query(text):
+    """Case- and whitespace-insensitive form of a query used as cache key"""
+    return ' '.join(text.lower().split())
+
+
+class EmbeddingCache:
+    """Bounded LRU/TTL cache of query embeddings in a memory-mapped file.
+
+    Entries live in a set-associative table: a key hashes to one set of
+    ``ways`` slots and, when the set is full, its least recently used slot
+    is replaced. Vectors are stored as float32. The file can be shared by
+    several processes (gunicorn workers) and survives restarts when placed
+    on a persistent volume; hit, miss and eviction counters are kept in the
+    file header so they aggregate across processes.
+    """
+
+    def __init__(self, path, dimension=1024, max_entries=2048, ttl=86400, ways=8):
+        self.path = path
+        self.dimension = dimension
+        self.ways = ways
+        self.sets = max(1, -(-max_entries // ways))
+        self.ttl = ttl
+        self._thread_lock = threading.Lock()
+
+        slots = self.sets * self.ways
+        self._meta_offset = HEADER_WORDS * 8
+        self._vector_offset = self._meta_offset + slots * SLOT_DTYPE.itemsize
+        size = self._vector_offset + slots * dimension * 4
+
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            header = np.fromfile(path, dtype='<u8', count=HEADER_WORDS) if os.fstat(self._fd).st_size >= size else None
+            if header is None or list(header[:5]) != [MAGIC, VERSION, dimension, self.sets, ways]:
+                # Missing, truncated or created with another layout: start empty
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, size)
+                initialize = True
+            else:
+                initialize = False
+
+            self._header = np.memmap(path, dtype='<u8', mode='r+', shape=(HEADER_WORDS,))
+            self._meta = np.memmap(path, dtype=SLOT_DTYPE, mode='r+', offset=self._meta_offset, shape=(self.sets, ways))
+            self._vectors = np.memmap(path, dtype='<f4', mode='r+', offset=self._vector_offset,
+                                      shape=(self.sets, ways, dimension))
+            if initialize:
+                self._header[:5] = [MAGIC, VERSION, dimension, self.sets, ways]
+                self._header.flush()
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _locked(self):
+        return _FileLock(self._fd, self._thread_lock)
+
+    def _key(self, text, model_id):
+        digest = hashlib.blake2b(f"{model_id}\0{normalize_query(text)}".encode('utf-8'), digest_size=16).digest()
+        k0 = int.from_bytes(digest[:8], 'little')
+        k1 = int.from_bytes(digest[8:], 'little')
+        return k0, k1, k0 % self.sets
+
+    def _find(self, meta, k0, k1):
+        matches = np.flatnonzero((meta['k0'] == k0) & (meta['k1'] == k1))
+        return int(matches[0]) if len(matches) else None
+
+    def get(self, text, model_id):
+        """Return the cached vector as a list of floats, or None"""
+        k0, k1, index = self._key(text, model_id)
+        now = time.time()
+        with self._locked():
+            meta = self._meta[index]
+            way = self._find(meta, k0, k1)
+            if way is not None:
+                if now - meta['created'][way] <= self.ttl:
+                    meta['last_used'][way] = now
+                    self._header[H_HITS] += 1
+                    return self._vectors[index, way].tolist()
+                meta[way] = (0, 0, 0.0, 0.0)
+                self._header[H_EXPIRATIONS] += 1
+            self._header[H_MISSES] += 1
+            return None
+
+    def put(self, text, model_id, vector):
+        """Store a vector, replacing the least recently used entry of its set"""
+        k0, k1, index = self._key(text, model_id)
+        now = time.time()
+        with self._locked():
+            meta = self._meta[index]
+            way = self._find(meta, k0, k1)
+            if way is None:
+                way = self._find(meta, 0, 0)
+            if way is None:
+                way = int(np.argmin(meta['last_used']))
+                if now - meta['created'][way] > self.ttl:
+                    self._header[H_EXPIRATIONS] += 1
+                else:
+                    self._header[H_EVICTIONS] += 1
+            self._vectors[index, way] = np.asarray(vector, dtype=np.float32)
+            meta[way] = (k0, k1, now, now)
+            self._header[H_INSERTS] += 1
+
+    def stats(self):
+        header = self._header
+        hits, misses = int(header[H_HITS]), int(header[H_MISSES])
+        return {
+            "entries": int(np.count_nonzero(self._meta['created'] > 0)),
+            "capacity": self.sets * self.ways,
+            "hits": hits,
+            "misses": misses,
+            "evictions": int(header[H_EVICTIONS]),
+            "expirations": int(header[H_EXPIRATIONS]),
+            "inserts": int(header[H_INSERTS]),
+            "hit_rate": round(hits / (hits + misses), 4) if hits + misses else 0.0,
+        }
+
+
+class _FileLock:
+    """Exclusive lock across threads (threading.Lock) and processes (flock)"""
+
+    def __init__(self, fd, thread_lock):
+        self.fd = fd
+        self.thread_lock = thread_lock
+
+    def __enter__(self):
+        self.thread_lock.acquire()
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        self.thread_lock.release()
+
+
+def cache_from_env(dimension=1024):
+    """Build the shared cache from EMBEDDING_CACHE_* settings, or None if disabled"""
+    max_entries = int(os.environ.get('EMBEDDING_CACHE_ENTRIES', '2048'))
+    if max_entries <= 0:
+        return None
+    return EmbeddingCache(
+        os.environ.get('EMBEDDING_CACHE_PATH', '/dev/shm/rag-embedding-cache.bin'),
+        dimension=dimension,
+        max_entries=max_entries,
+        ttl=float(os.environ.get('EMBEDDING_CACHE_TTL', '86400'))
+    )
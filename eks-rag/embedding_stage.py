@@ -0,0 +1,261 @@
+import os
+import math
+import time
+import random
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from embedding_batcher import MAX_EMBED_BATCH
+
+# Error codes Bedrock answers with when the account's request rate or
+# concurrent invocations are over quota
+THROTTLE_CODES = {"ThrottlingException", "TooManyRequestsException", "ServiceQuotaExceededException"}
+
+
+def is_throttle(error):
+    """True for a botocore ClientError telling us to slow down"""
+    code = getattr(error, 'response', {}).get('Error', {}).get('Code')
+    return code in THROTTLE_CODES
+
+
+class TokenBucket:
+    """Limits calls to ``rate`` per second, adapting to throttling.
+
+    ``acquire`` blocks until a token is available; up to ``burst`` tokens
+    accumulate while idle. A throttled call halves the rate (down to
+    ``min_rate``) and each successful call adds ``increase`` calls per second
+    back, up to the configured rate, so the stage settles just under the
+    account's quota.
+    """
+
+    def __init__(self, rate, burst=None, min_rate=0.2, increase=0.05):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self.min_rate = min(min_rate, rate)
+        self.increase = increase
+        self._lock = threading.Lock()
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                self._refill(time.monotonic())
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+
+    def throttled(self):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            # Calls already admitted at the old rate do not get to burst again
+            self._tokens = min(self._tokens, 0.0)
+
+    def succeeded(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+
+class EmbeddingStage:
+    """Embeds texts in batched, concurrent, rate-limited Bedrock calls.
+
+    Texts are sent ``batch_size`` at a time (at most MAX_EMBED_BATCH) with
+    up to ``concurrency`` calls in flight, each waiting for a TokenBucket
+    token. A throttled call is retried after a jittered exponential backoff,
+    up to ``max_retries`` times. ``embed_batch`` maps a list of texts to
+    their vectors in the same order; results always come back in input order.
+    With an EmbeddingStore, embed_items looks every text up before sending
+    it and stores what Bedrock returns.
+    """
+
+    def __init__(self, embed_batch, batch_size=MAX_EMBED_BATCH, concurrency=4, rate=10.0,
+                 max_retries=8, initial_backoff=0.5, max_backoff=20.0, store=None):
+        self.embed_batch = embed_batch
+        self.batch_size = max(1, min(batch_size, MAX_EMBED_BATCH))
+        self.concurrency = max(1, concurrency)
+        self.store = store
+        # Items held waiting for their batches before the oldest one is waited for
+        self.window_items = 2 * self.concurrency * self.batch_size
+        self._pending = 0
+        self.limiter = TokenBucket(rate)
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='embed')
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.texts = 0
+        self.throttles = 0
+        self.errors = 0
+        self.last_error = None
+        self.requested = 0
+        self.store_hits = 0
+        self.deduplicated = 0
+
+    def _call(self, texts):
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire()
+            try:
+                vectors = self.embed_batch(texts)
+            except Exception as e:
+                if not is_throttle(e) or attempt == self.max_retries:
+                    with self._lock:
+                        self.errors += 1
+                        self.last_error = f"{type(e).__name__}: {e}"
+                    raise
+                self.limiter.throttled()
+                with self._lock:
+                    self.throttles += 1
+                delay = min(self.max_backoff, self.initial_backoff * 2 ** attempt)
+                time.sleep(delay * random.uniform(0.5, 1.0))
+                continue
+            self.limiter.succeeded()
+            with self._lock:
+                self.calls += 1
+                self.texts += len(texts)
+            return vectors
+
+    def embed(self, texts):
+        """Vectors of ``texts`` in order; raises the first failed call's error"""
+        with self._lock:
+            self.requested += len(texts)
+        chunks = [texts[start:start + self.batch_size] for start in range(0, len(texts), self.batch_size)]
+        if len(chunks) == 1:
+            return self._call(chunks[0])
+        vectors = []
+        for result in self._executor.map(self._call, chunks):
+            vectors.extend(result)
+        return vectors
+
+    def embed_items(self, items, texts_of):
+        """(item, vectors) for each item, in input order, as the batches complete.
+
+        ``texts_of(item)`` lists the item's texts. A text found in the store,
+        or already sent for an earlier item, is not sent again; the texts of
+        one call can belong to several items. At most about twice
+        ``concurrency`` batches are held at once, so ``items`` can be an
+        unbounded generator. Items with a text whose call failed come back
+        with None vectors.
+        """
+        window = deque()
+        # Texts sent to Bedrock but not in the store yet, with their batch and position
+        inflight = {}
+        batch = _Batch()
+        for item in items:
+            sources = []
+            for text in texts_of(item):
+                self.requested += 1
+                vector = self.store.get(text) if self.store is not None else None
+                if vector is not None:
+                    self.store_hits += 1
+                    sources.append(vector)
+                    continue
+                source = inflight.get(text)
+                if source is None:
+                    if len(batch.texts) >= self.batch_size:
+                        self._submit(batch)
+                        batch = _Batch()
+                    source = inflight[text] = (batch, len(batch.texts))
+                    batch.texts.append(text)
+                else:
+                    self.deduplicated += 1
+                sources.append(source)
+            window.append((item, sources))
+            while window:
+                waiting = [source[0] for source in window[0][1] if isinstance(source, tuple)]
+                if not all(b.future is not None and b.future.done() for b in waiting):
+                    if len(window) <= self.window_items and self._pending <= 2 * self.concurrency:
+                        break
+                    if batch in waiting:
+                        self._submit(batch)
+                        batch = _Batch()
+                yield self._resolve(*window.popleft(), inflight)
+        if batch.texts:
+            self._submit(batch)
+        while window:
+            yield self._resolve(*window.popleft(), inflight)
+
+    def _submit(self, batch):
+        batch.future = self._executor.submit(self._call, batch.texts)
+        self._pending += 1
+
+    def _collect(self, batch, inflight):
+        """Wait for a batch once, keep its vectors and hand its texts over to the store"""
+        if batch.collected:
+            return
+        batch.collected = True
+        self._pending -= 1
+        try:
+            batch.vectors = batch.future.result()
+        except Exception:
+            batch.vectors = None
+        if batch.vectors is not None and self.store is not None:
+            self.store.put_many(batch.texts, batch.vectors)
+        for text in batch.texts:
+            if inflight.get(text, (None,))[0] is batch:
+                del inflight[text]
+
+    def _resolve(self, item, sources, inflight):
+        vectors = []
+        failed = False
+        for source in sources:
+            if isinstance(source, tuple):
+                batch, position = source
+                self._collect(batch, inflight)
+                if batch.vectors is None:
+                    failed = True
+                    continue
+                source = batch.vectors[position]
+            vectors.append(source)
+        return item, None if failed else vectors
+
+    def stats(self):
+        with self._lock:
+            reused = self.store_hits + self.deduplicated
+            return {
+                "calls": self.calls,
+                "texts": self.texts,
+                "requested": self.requested,
+                "store_hits": self.store_hits,
+                "deduplicated": self.deduplicated,
+                # Share of the texts asked for that did not go to Bedrock, and the
+                # calls the same texts would have taken without the store and dedupe
+                "dedupe_ratio": round(reused / self.requested, 4) if self.requested else 0.0,
+                "calls_saved": max(0, math.ceil(self.requested / self.batch_size) - self.calls),
+                "throttles": self.throttles,
+                "errors": self.errors,
+                "rate_limit": round(self.limiter.rate, 3),
+                "avg_batch_size": round(self.texts / self.calls, 2) if self.calls else 0.0,
+                "last_error": self.last_error,
+            }
+
+    def close(self):
+        """Stop the calling threads; batches not started yet are dropped"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class _Batch:
+    def __init__(self):
+        self.texts = []
+        self.future = None
+        self.vectors = None
+        self.collected = False
+
+
+def embedding_stage_from_env(embed_batch):
+    """EmbeddingStage from EMBED_STAGE_* settings"""
+    return EmbeddingStage(
+        embed_batch,
+        batch_size=int(os.environ.get('EMBED_STAGE_BATCH_SIZE', MAX_EMBED_BATCH)),
+        concurrency=int(os.environ.get('EMBED_STAGE_CONCURRENCY', '4')),
+        rate=float(os.environ.get('EMBED_STAGE_RATE', '10')),
+        max_retries=int(os.environ.get('EMBED_STAGE_MAX_RETRIES', '8'))
+    )
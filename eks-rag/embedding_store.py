@@ -0,0 +1,127 @@
+import os
+import fcntl
+import hashlib
+import threading
+
+import numpy as np
+
+MAGIC = 0x52414745535452  # "RAGESTR"
+VERSION = 1
+
+# Header words: magic, version, dimension
+HEADER_WORDS = 4
+H_MAGIC, H_VERSION, H_DIMENSION = range(3)
+HEADER_BYTES = HEADER_WORDS * 8
+
+
+def content_key(text, model_id):
+    """sha256 of the model and the exact text; documents are not normalized"""
+    return hashlib.sha256(f"{model_id}\0{text}".encode('utf-8')).digest()
+
+
+class EmbeddingStore:
+    """Append-only, content-addressed store of document embeddings on disk.
+
+    Each record is the 32-byte content_key of (text, model) followed by the
+    float32 vector, so a text embedded once is never sent to Bedrock again,
+    in this run or the next. Records are read through a memory map; the keys
+    are indexed in memory when the store is opened. Unlike EmbeddingCache it
+    never evicts, and appends are flock'ed so several ingestion processes
+    can share a file, each seeing the records present when it opened it and
+    its own.
+    """
+
+    def __init__(self, path, model_id, dimension=1024):
+        self.path = path
+        self.model_id = model_id
+        self.dimension = dimension
+        self.record_dtype = np.dtype([('key', 'V32'), ('vector', '<f4', (dimension,))])
+        self._lock = threading.Lock()
+        self._index = {}
+        self._map = None
+        self.hits = 0
+        self.misses = 0
+        self.inserts = 0
+
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            size = os.fstat(self._fd).st_size
+            header = np.fromfile(path, dtype='<u8', count=HEADER_WORDS) if size >= HEADER_BYTES else None
+            if header is None or list(header[:3]) != [MAGIC, VERSION, dimension]:
+                # Missing, truncated or another dimension: start empty
+                os.ftruncate(self._fd, 0)
+                header = np.zeros(HEADER_WORDS, dtype='<u8')
+                header[:3] = [MAGIC, VERSION, dimension]
+                os.pwrite(self._fd, header.tobytes(), 0)
+                size = HEADER_BYTES
+            # Drop a record torn by a crash mid-append
+            records = (size - HEADER_BYTES) // self.record_dtype.itemsize
+            os.ftruncate(self._fd, HEADER_BYTES + records * self.record_dtype.itemsize)
+            self._remap(records)
+            if records:
+                for row, key in enumerate(self._map['key']):
+                    self._index[key.tobytes()] = row
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _remap(self, records):
+        self._records = records
+        self._map = np.memmap(self.path, dtype=self.record_dtype, mode='r', offset=HEADER_BYTES,
+                              shape=(records,)) if records else None
+
+    def __len__(self):
+        return len(self._index)
+
+    def get(self, text):
+        """Stored vector of the text as a list of floats, or None"""
+        key = content_key(text, self.model_id)
+        with self._lock:
+            row = self._index.get(key)
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if row >= self._records:
+                self._remap((os.fstat(self._fd).st_size - HEADER_BYTES) // self.record_dtype.itemsize)
+            return self._map['vector'][row].tolist()
+
+    def put_many(self, texts, vectors):
+        """Append the vectors of texts not stored yet"""
+        with self._lock:
+            records = np.zeros(len(texts), dtype=self.record_dtype)
+            count = 0
+            keys = set()
+            for text, vector in zip(texts, vectors):
+                key = content_key(text, self.model_id)
+                if key in self._index or key in keys:
+                    continue
+                keys.add(key)
+                records[count] = (key, np.asarray(vector, dtype=np.float32))
+                count += 1
+            if not count:
+                return
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                end = os.lseek(self._fd, 0, os.SEEK_END)
+                os.pwrite(self._fd, records[:count].tobytes(), end)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            first = (end - HEADER_BYTES) // self.record_dtype.itemsize
+            for offset, key in enumerate(records['key'][:count]):
+                self._index[key.tobytes()] = first + offset
+            self.inserts += count
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._index),
+                "hits": self.hits,
+                "misses": self.misses,
+                "inserts": self.inserts,
+            }
+
+    def close(self):
+        with self._lock:
+            self._map = None
+            os.close(self._fd)
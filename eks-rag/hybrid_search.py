@@ -0,0 +1,97 @@
+import re
+
+import numpy as np
+
+from rag_common import SOURCE_FIELDS, build_knn_query
+
+# Identifiers in the log schema: error codes (SENSOR_002), OBD-II DTCs (P0700)
+# and vehicle ids (VIN-4811). Exact matches on these beat any embedding.
+IDENTIFIER_PATTERN = re.compile(r'\b(?:[A-Z]+_\d{3}|P\d{4}|VIN-\d{4})\b', re.IGNORECASE)
+IDENTIFIER_FIELDS = ["error_code", "diagnostic_info.dtc_codes", "vehicle_id"]
+
+# Standard RRF constant; damps the advantage of the very top ranks
+RRF_RANK_CONSTANT = 60
+
+
+def extract_identifiers(text):
+    """Error codes, DTCs and vehicle ids mentioned in a query, upper-cased"""
+    return sorted({match.upper() for match in IDENTIFIER_PATTERN.findall(text)})
+
+
+def build_lexical_query(text, k=5, filter_clauses=None):
+    """BM25 search over the message text.
+
+    When the query names identifiers, only logs carrying one of them match
+    and the message text just orders them.
+    """
+    query = {"bool": {"should": [{"match": {"message": {"query": text}}}]}}
+    if filter_clauses:
+        query["bool"]["filter"] = filter_clauses
+    identifiers = extract_identifiers(text)
+    if identifiers:
+        query["bool"]["must"] = [{
+            "bool": {
+                "should": [{"terms": {field: identifiers}} for field in IDENTIFIER_FIELDS],
+                "minimum_should_match": 1
+            }
+        }]
+    else:
+        # A filter alone would otherwise make the message match optional
+        query["bool"]["minimum_should_match"] = 1
+    return {"size": k, "_source": SOURCE_FIELDS, "query": query}
+
+
+def build_hybrid_msearch(index, text, embedding, candidates=20, filter_clauses=None):
+    """msearch body running the lexical and kNN searches in one round trip"""
+    return [
+        {"index": index}, build_lexical_query(text, candidates, filter_clauses),
+        {"index": index}, build_knn_query(embedding, candidates, filter_clauses)
+    ]
+
+
+def reciprocal_rank_fusion(ranked_ids, weights, rank_constant=RRF_RANK_CONSTANT):
+    """Fuse ranked lists of document ids; returns (ids, scores), best first.
+
+    A document scores sum(weight / (rank_constant + rank)) over the lists it
+    appears in, with 1-based ranks; a document repeated within a list counts
+    once, at its best rank. Ties keep the ids in sorted order.
+    """
+    lists = [np.asarray(ids, dtype=str) for ids in ranked_ids]
+    ranks = []
+    for position, ids in enumerate(lists):
+        _, first = np.unique(ids, return_index=True)
+        first.sort()
+        lists[position] = ids[first]
+        ranks.append(first + 1)
+    lengths = [len(ids) for ids in lists]
+    if not sum(lengths):
+        return np.array([], dtype=str), np.array([], dtype=np.float64)
+    ids = np.concatenate(lists)
+    ranks = np.concatenate(ranks)
+    list_weights = np.repeat(np.asarray(weights, dtype=np.float64), lengths)
+    unique, inverse = np.unique(ids, return_inverse=True)
+    scores = np.bincount(inverse.ravel(), weights=list_weights / (rank_constant + ranks), minlength=len(unique))
+    order = np.argsort(-scores, kind='stable')
+    return unique[order], scores[order]
+
+
+def fuse_msearch_response(response, k=5, lexical_weight=0.6):
+    """Fuse a hybrid msearch response into one search response of ``k`` hits.
+
+    A failed sub-search contributes no hits, so the other one still answers.
+    """
+    hits_by_id = {}
+    ranked_ids = []
+    for result in response['responses']:
+        hits = result.get('hits', {}).get('hits', []) if 'error' not in result else []
+        ranked_ids.append([hit['_id'] for hit in hits])
+        for hit in hits:
+            hits_by_id.setdefault(hit['_id'], hit)
+    ids, scores = reciprocal_rank_fusion(ranked_ids, [lexical_weight, 1.0 - lexical_weight])
+    fused = [dict(hits_by_id[doc_id], _score=float(score)) for doc_id, score in zip(ids[:k], scores[:k])]
+    return {"hits": {"total": {"value": len(ids)}, "hits": fused}}
+
+
+def failed_searches(response):
+    """Error reasons of the failed sub-searches in an msearch response"""
+    return [result['error'] for result in response['responses'] if 'error' in result]
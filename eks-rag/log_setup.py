@@ -0,0 +1,127 @@
+import os
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+
+# Attributes every LogRecord has; anything else came in through extra=
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_listener = None
+payload_sample_rate = 0.0
+redact_payloads = True
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line with the level, logger, message and any extra= fields"""
+
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread.
+
+    The stock handler formats in prepare(), on the request thread; an
+    in-process queue can carry the record itself, so the message, its
+    lazy arguments and the handler's I/O all run on the listener. The
+    arguments are rendered when the listener gets to them, so pass values
+    that are not modified after the call.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class Redacted:
+    """Lazily rendered JSON of a payload with vectors and long strings cut short"""
+
+    def __init__(self, payload, max_floats=4, max_string=256):
+        self.payload = payload
+        self.max_floats = max_floats
+        self.max_string = max_string
+
+    def _shorten(self, value):
+        if isinstance(value, dict):
+            return {key: self._shorten(item) for key, item in value.items()}
+        if isinstance(value, list):
+            if len(value) > self.max_floats and all(isinstance(item, float) for item in value[:self.max_floats]):
+                head = ", ".join(f"{item:.4g}" for item in value[:self.max_floats])
+                return f"<{len(value)} floats: {head}, ...>"
+            return [self._shorten(item) for item in value]
+        if isinstance(value, str) and len(value) > self.max_string:
+            return value[:self.max_string] + f"...<{len(value)} chars>"
+        return value
+
+    def __str__(self):
+        return json.dumps(self._shorten(self.payload) if redact_payloads else self.payload, default=str)
+
+
+def log_payload(logger, message, payload):
+    """Log a request or response body at DEBUG for a LOG_PAYLOAD_SAMPLE_RATE share of calls"""
+    if payload_sample_rate > 0 and logger.isEnabledFor(logging.DEBUG) and random.random() < payload_sample_rate:
+        logger.debug("%s: %s", message, Redacted(payload))
+
+
+def configure_logging(level=None, fmt=None, async_handler=None, library_level=None, stream=None):
+    """Set up the root logger from LOG_* settings, replacing any previous setup.
+
+    LOG_FORMAT is text or json, LOG_ASYNC moves formatting and I/O to a
+    listener thread, LOG_PAYLOAD_SAMPLE_RATE and LOG_REDACT control the
+    DEBUG payload logs, and LOG_LIBRARY_LEVEL quiets the per-request
+    INFO lines of the HTTP, AWS and OpenSearch client libraries.
+    """
+    global _listener, payload_sample_rate, redact_payloads
+    level = level or os.environ.get('LOG_LEVEL', 'INFO').upper()
+    fmt = fmt or os.environ.get('LOG_FORMAT', 'text')
+    if async_handler is None:
+        async_handler = os.environ.get('LOG_ASYNC', 'true').lower() == 'true'
+    library_level = library_level or os.environ.get('LOG_LIBRARY_LEVEL', 'WARNING').upper()
+    payload_sample_rate = float(os.environ.get('LOG_PAYLOAD_SAMPLE_RATE', '0.01'))
+    redact_payloads = os.environ.get('LOG_REDACT', 'true').lower() == 'true'
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    if fmt == 'json':
+        output.setFormatter(JSONFormatter())
+    else:
+        output.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+
+    handler = output
+    if async_handler:
+        records = queue.SimpleQueue()
+        _listener = logging.handlers.QueueListener(records, output)
+        _listener.start()
+        handler = DeferredQueueHandler(records)
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+    for name in ('opensearch', 'httpx', 'httpcore', 'urllib3', 'botocore', 'boto3'):
+        logging.getLogger(name).setLevel(library_level)
+    return _listener
+
+
+@atexit.register
+def _flush():
+    if _listener is not None:
+        _listener.stop()
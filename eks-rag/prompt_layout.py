@@ -0,0 +1,28 @@
+from context_packer import TABLE_HEADER
+
+# vLLM's automatic prefix caching reuses KV blocks only for a byte-identical
+# leading prefix. Everything that is the same for every request goes first,
+# in the system message; the retrieved context follows in a deterministic
+# order and the query comes last.
+SYSTEM_PROMPT = (
+    "You are a helpful assistant for a connected-vehicle fleet operations team. Each request gives you "
+    "context retrieved from the fleet's error logs, followed by a query. Answer the query from that context, "
+    "name the vehicles and error codes your answer relies on, and say so when the context does not answer it.\n"
+    "\n"
+    "Error logs are given as a table. A line of the form [ERROR_CODE] service: message introduces the logs "
+    "with that message, and each row below it is one log with the pipe-separated columns\n"
+    f"{TABLE_HEADER}\n"
+    "engine_temp is in °C and battery_voltage in V; an empty cell is a missing reading. A line starting with "
+    "'all:' summarizes every log with the same message: log and vehicle counts, the time range and min-max "
+    "sensor ranges.\n"
+    "Logs may instead be given one block per log, separated by ---.\n"
+    "Aggregated statistics are given one per line as name: value, with breakdowns as key=count pairs."
+)
+
+
+def build_messages(prompt, context):
+    """Chat messages with the invariant instructions first and the query last"""
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": f"Context:\n{context}\n\nQuery: {prompt}"}
+    ]
@@ -0,0 +1,132 @@
+import re
+
+# Hard constraints stated in a question, turned into OpenSearch filter
+# clauses. Rule-based and deterministic so it needs no model at query time.
+
+TIME_UNITS = {"minute": "m", "min": "m", "hour": "h", "day": "d", "week": "w"}
+TIME_WINDOW_PATTERN = re.compile(
+    r'\b(?:in|during|over|within|for)?\s*(?:the\s+)?(?:last|past)\s+(?:(\d+)\s+)?(minute|min|hour|day|week)s?\b',
+    re.IGNORECASE
+)
+TODAY_PATTERN = re.compile(r'\btoday\b', re.IGNORECASE)
+
+# Sensor fields of sensor_readings and the phrases that name them, most specific first
+SENSOR_PHRASES = [
+    ("battery_voltage", r'battery\s+voltages?|voltages?'),
+    ("battery_level", r'battery\s+(?:levels?|charge)|charge\s+levels?|state\s+of\s+charge'),
+    ("engine_temp", r'(?:engine|coolant)\s+temp(?:erature)?s?|temp(?:erature)?s?'),
+    ("fuel_pressure", r'fuel\s+pressures?|pressures?'),
+    ("speed", r'speeds?'),
+]
+COMPARATORS = [
+    ("gte", r'>=|at\s+least|no\s+less\s+than'),
+    ("lte", r'<=|at\s+most|no\s+more\s+than'),
+    ("gt", r'>|above|over|exceed(?:s|ing)?|greater\s+than|more\s+than|higher\s+than'),
+    ("lt", r'<|below|under|less\s+than|lower\s+than'),
+]
+COMPARISON = rf'({"|".join(comparator for _, comparator in COMPARATORS)})\s*(-?\d+(?:\.\d+)?)'
+THRESHOLD_PATTERNS = [
+    (field, re.compile(
+        rf'\b(?:{phrase})\s+(?:(?:readings?|values?|levels?|is|are|was|were|of)\s+)*{COMPARISON}',
+        re.IGNORECASE
+    ))
+    for field, phrase in SENSOR_PHRASES
+]
+# A further bound of the same reading, as in "below 80 or above 115"
+FURTHER_THRESHOLD_PATTERN = re.compile(rf'\s*,?\s*(?:(?:and|or|but)\s+)?{COMPARISON}', re.IGNORECASE)
+DISJUNCTION_PATTERN = re.compile(r'\bor\b', re.IGNORECASE)
+LOWER_BOUNDS = ("gt", "gte")
+
+VEHICLE_STATES = ["MOVING", "IDLE", "STOPPED", "CHARGING", "MAINTENANCE"]
+VEHICLE_STATE_PATTERNS = [
+    # Upper case as in the logs ("in MOVING state"), or a state after a verb ("are idle")
+    re.compile(rf'\b({"|".join(VEHICLE_STATES)})\b'),
+    re.compile(rf'\b(?:is|are|currently|in)\s+({"|".join(VEHICLE_STATES)})\b', re.IGNORECASE),
+]
+
+ERROR_CODE_PATTERN = re.compile(r'\b(?:SENSOR|DIAG|CONN|GPS)_\d{3}\b', re.IGNORECASE)
+DTC_PATTERN = re.compile(r'\b[PBCU]\d{4}\b', re.IGNORECASE)
+VEHICLE_ID_PATTERN = re.compile(r'\bVIN-\d{4}\b', re.IGNORECASE)
+
+
+def extract_query_filters(text):
+    """Constraints found in a question, keyed by the field they restrict.
+
+    Range constraints map to {op: value} (timestamps as date math such as
+    ``now-1h``), keyword constraints to a sorted list of allowed values.
+    """
+    filters = {}
+
+    window = TIME_WINDOW_PATTERN.search(text)
+    if window:
+        count, unit = window.group(1) or '1', TIME_UNITS[window.group(2).lower()]
+        filters["timestamp"] = {"gte": f"now-{count}{unit}"}
+    elif TODAY_PATTERN.search(text):
+        filters["timestamp"] = {"gte": "now/d"}
+
+    for field, pattern in THRESHOLD_PATTERNS:
+        constraint = threshold_range(text, find_thresholds(text, pattern))
+        if constraint:
+            filters[f"sensor_readings.{field}"] = constraint
+
+    states = {m.upper() for pattern in VEHICLE_STATE_PATTERNS for m in pattern.findall(text)}
+    keywords = {
+        "vehicle_state": states,
+        "error_code": {m.upper() for m in ERROR_CODE_PATTERN.findall(text)},
+        "diagnostic_info.dtc_codes": {m.upper() for m in DTC_PATTERN.findall(text)},
+        "vehicle_id": {m.upper() for m in VEHICLE_ID_PATTERN.findall(text)},
+    }
+    for field, values in keywords.items():
+        if values:
+            filters[field] = sorted(values)
+    return filters
+
+
+def comparator_op(comparator):
+    """Range operator of a comparator phrase, "gte" for at least"""
+    for op, phrase in COMPARATORS:
+        if re.fullmatch(phrase, comparator, re.IGNORECASE):
+            return op
+
+
+def find_thresholds(text, pattern):
+    """(start, end, op, value) of each comparison of one reading, in order of appearance"""
+    thresholds = []
+    for match in pattern.finditer(text):
+        while match:
+            thresholds.append((match.start(), match.end(), comparator_op(match.group(1)), float(match.group(2))))
+            match = FURTHER_THRESHOLD_PATTERN.match(text, match.end())
+    return thresholds
+
+
+def threshold_range(text, thresholds):
+    """Range constraint of one reading, or None to leave the reading unfiltered.
+
+    Two comparisons give both bounds of a range ("above 80 and below 115")
+    unless they do not describe one, as in "below 80 or above 115".
+    """
+    if len(thresholds) == 1:
+        _, _, op, value = thresholds[0]
+        return {op: value}
+    if len(thresholds) != 2:
+        return None
+    (_, first_end, first_op, first_value), (second_start, _, second_op, second_value) = thresholds
+    if DISJUNCTION_PATTERN.search(text, first_end, second_start):
+        return None
+    bounds = {first_op: first_value, second_op: second_value}
+    lower = [value for op, value in bounds.items() if op in LOWER_BOUNDS]
+    upper = [value for op, value in bounds.items() if op not in LOWER_BOUNDS]
+    if len(lower) != 1 or len(upper) != 1 or lower[0] >= upper[0]:
+        return None
+    return bounds
+
+
+def build_filter_clauses(filters):
+    """OpenSearch filter clauses for constraints from extract_query_filters"""
+    clauses = []
+    for field, constraint in filters.items():
+        if isinstance(constraint, dict):
+            clauses.append({"range": {field: constraint}})
+        else:
+            clauses.append({"terms": {field: constraint}})
+    return clauses
@@ -0,0 +1,203 @@
+import json
+import time
+
+from context_packer import order_documents
+from prompt_layout import build_messages
+
+AWS_REGION = 'us-west-2'
+COLLECTION_NAME = 'error-logs-mock'
+INDEX_NAME = 'error-logs-mock'
+EMBEDDING_MODEL_ID = "cohere.embed-english-v3"
+VLLM_MODEL = "NousResearch/Meta-Llama-3-8B-Instruct"
+
+SOURCE_FIELDS = [
+    "timestamp",
+    "message",
+    "service",
+    "error_code",
+    "vehicle_id",
+    "vehicle_state",
+    "sensor_readings",
+    "diagnostic_info"
+]
+
+
+class QueryError(Exception):
+    """A /submit_query stage failed; the message and status go to the client"""
+
+    def __init__(self, message, status=500):
+        super().__init__(message)
+        self.status = status
+
+
+def get_collection_endpoint(os_serverless, collection_name=COLLECTION_NAME):
+    """Look up the OpenSearch Serverless collection endpoint, without the scheme"""
+    collections = os_serverless.list_collections(
+        collectionFilters={'name': collection_name}
+    )['collectionSummaries']
+
+    if not collections:
+        return None
+
+    collection_id = collections[0]['id']
+    collection_details = os_serverless.batch_get_collection(ids=[collection_id])
+    endpoint = collection_details['collectionDetails'][0]['collectionEndpoint']
+    return endpoint.replace('https://', '')
+
+
+def build_embedding_body(texts):
+    """Build the Bedrock invoke_model body for a list of query texts"""
+    return json.dumps({
+        "texts": texts,
+        "input_type": "search_query"
+    })
+
+
+def embed_texts(bedrock_runtime, texts):
+    """Embed a batch of query texts with a single Bedrock call"""
+    response = bedrock_runtime.invoke_model(
+        modelId=EMBEDDING_MODEL_ID,
+        contentType="application/json",
+        accept="application/json",
+        body=build_embedding_body(texts)
+    )
+    return json.loads(response['body'].read())['embeddings']
+
+
+def build_knn_query(embedding, k=5, filter_clauses=None):
+    """Build the kNN search body over message embeddings.
+
+    Filter clauses go inside the knn clause, so the engine only scores
+    vectors of matching documents and still returns up to k hits.
+    """
+    knn = {
+        "vector": embedding,
+        "k": k
+    }
+    if filter_clauses:
+        knn["filter"] = {"bool": {"filter": filter_clauses}}
+    return {
+        "size": k,
+        "_source": SOURCE_FIELDS,
+        "query": {
+            "knn": {
+                "message_embedding": knn
+            }
+        }
+    }
+
+
+def parse_search_hits(response):
+    """Flatten OpenSearch hits into the documents returned to clients"""
+    results = []
+    for hit in response['hits']['hits']:
+        results.append({
+            "doc_id": hit.get("_id"),
+            "score": hit["_score"],
+            "timestamp": hit["_source"].get("timestamp"),
+            "message": hit["_source"]["message"],
+            "service": hit["_source"]["service"],
+            "error_code": hit["_source"]["error_code"],
+            "vehicle_id": hit["_source"].get("vehicle_id", "N/A"),
+            "vehicle_state": hit["_source"].get("vehicle_state", "N/A"),
+            "sensor_readings": hit["_source"].get("sensor_readings", {}),
+            "diagnostic_info": hit["_source"].get("diagnostic_info", {})
+        })
+    return results
+
+
+def build_context(similar_docs):
+    """Prepare context for the LLM with detailed information per document"""
+    if not similar_docs:
+        return "No matching error logs were found."
+    context_entries = []
+    for doc in order_documents(similar_docs):
+        context_entry = (
+            f"Error: {doc['message']}\n"
+            f"Service: {doc['service']}\n"
+            f"Error Code: {doc['error_code']}\n"
+            f"Vehicle: {doc['vehicle_id']} (State: {doc['vehicle_state']})\n"
+            f"Sensor Readings: {json.dumps(doc['sensor_readings'], indent=2, sort_keys=True)}\n"
+            f"Diagnostic Info: {json.dumps(doc['diagnostic_info'], indent=2, sort_keys=True)}\n"
+            "---"
+        )
+        context_entries.append(context_entry)
+
+    return "\n".join(context_entries)
+
+
+def build_vllm_payload(prompt, context, stream=False):
+    """Build the OpenAI-compatible chat completions request for vLLM"""
+    payload = {
+        "model": VLLM_MODEL,
+        "messages": build_messages(prompt, context)
+    }
+    if stream:
+        payload["stream"] = True
+    return payload
+
+
+def parse_vllm_stream_line(line):
+    """Parse one line of a vLLM completion stream into (done, token)"""
+    if isinstance(line, bytes):
+        line = line.decode('utf-8')
+    if not line.startswith('data:'):
+        return False, None
+    data = line[5:].strip()
+    if data == '[DONE]':
+        return True, None
+    choices = json.loads(data).get('choices') or [{}]
+    return False, choices[0].get('delta', {}).get('content')
+
+
+def wants_event_stream(accept, data):
+    """Whether a /submit_query client asked for server-sent events"""
+    return bool(data.get('stream')) or 'text/event-stream' in (accept or '')
+
+
+def format_sse(payload):
+    """Encode one server-sent event carrying a JSON payload"""
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+def build_stream_start(query, similar_docs, cache_hit=False, filters=None, analytics=None, degraded=False,
+                       relaxed_filters=None):
+    """First event of a streamed answer: the retrieved documents"""
+    event = {
+        "query": query,
+        "route": "retrieval" if analytics is None else "analytics",
+        "similar_documents": similar_docs[:3],
+        "applied_filters": filters or {},
+        "relaxed_filters": relaxed_filters or {},
+        "semantic_cache_hit": cache_hit,
+        "degraded": degraded
+    }
+    if analytics is not None:
+        event["aggregations"] = analytics
+    return event
+
+
+def build_stream_end(start_time):
+    """Last event of a streamed answer"""
+    return {"done": True, "processing_time": time.time() - start_time}
+
+
+def build_query_response(query, llm_response, similar_docs, start_time, cache_hit=False, filters=None,
+                         analytics=None, degraded=False, relaxed_filters=None):
+    """Build the /submit_query response body"""
+    response = {
+        "query": query,
+        "route": "retrieval" if analytics is None else "analytics",
+        "llm_response": llm_response,
+        "similar_documents": similar_docs[:3],  # Include top 3 similar documents
+        "applied_filters": filters or {},
+        # Filters of the question that matched no logs, so retrieval ran without them
+        "relaxed_filters": relaxed_filters or {},
+        "semantic_cache_hit": cache_hit,
+        # True when the deadline left no time for vLLM and llm_response is templated
+        "degraded": degraded,
+        "processing_time": time.time() - start_time
+    }
+    if analytics is not None:
+        response["aggregations"] = analytics
+    return response
@@ -0,0 +1,720 @@
+import os
+import time
+import logging
+
+from query_filters import extract_query_filters, build_filter_clauses
+from hybrid_search import build_hybrid_msearch, fuse_msearch_response, failed_searches
+from context_packer import pack_context
+from result_grouping import group_duplicates, document_ids
+from semantic_cache import build_freshness_query, stale_keys
+from analytics_router import is_analytical, build_analytics_query, summarize_aggregations, render_table, direct_answer
+from log_setup import log_payload
+from request_deadline import Deadline, deadline_from_request, degraded_answer
+from singleflight import FlightTimeout, flight_key
+from admission import DEFAULT_PRIORITY, Overloaded, request_priority
+from batch_queries import (
+    BATCH_PRIORITY,
+    parse_batch,
+    batch_parallelism,
+    retrieval_searches,
+    split_msearch,
+    format_ndjson,
+    batch_summary
+)
+from stage_timing import StageTimer, record_opensearch_took
+from rag_common import (
+    INDEX_NAME,
+    EMBEDDING_MODEL_ID,
+    QueryError,
+    build_knn_query,
+    parse_search_hits,
+    build_context,
+    build_vllm_payload,
+    build_query_response,
+    parse_vllm_stream_line,
+    wants_event_stream,
+    format_sse,
+    build_stream_start,
+    build_stream_end
+)
+
+# The request pipeline of both services: filters, route, cache, retrieve,
+# pack, generate and respond. vector_search_service.py (Flask) and
+# async_service.py (FastAPI) only adapt HTTP requests and responses and
+# supply the backend the pipeline does its I/O through.
+logger = logging.getLogger(__name__)
+
+# knn (default) or hybrid: BM25 on the message plus exact error code, DTC and
+# vehicle id matches, fused with the kNN results
+RETRIEVAL_MODE = os.environ.get('RETRIEVAL_MODE', 'knn')
+HYBRID_LEXICAL_WEIGHT = float(os.environ.get('HYBRID_LEXICAL_WEIGHT', '0.6'))
+HYBRID_CANDIDATES = int(os.environ.get('HYBRID_CANDIDATES', '20'))
+# Restrict retrieval to the time window, sensor thresholds, states and codes named in the query
+QUERY_FILTERS = os.environ.get('QUERY_FILTERS', 'true').lower() == 'true'
+# Retry without filters when nothing matches them, instead of answering from no logs
+QUERY_FILTER_FALLBACK = os.environ.get('QUERY_FILTER_FALLBACK', 'true').lower() == 'true'
+# Route counting/trend questions to OpenSearch aggregations; answer them
+# directly or let vLLM phrase the aggregate table (llm)
+ANALYTICS_ROUTER = os.environ.get('ANALYTICS_ROUTER', 'true').lower() == 'true'
+ANALYTICS_ANSWER = os.environ.get('ANALYTICS_ANSWER', 'llm')
+# compact: token-budgeted table of the hits; verbose: one pretty-printed block per hit
+CONTEXT_FORMAT = os.environ.get('CONTEXT_FORMAT', 'compact')
+# Collapse hits repeating the same templated message into one document with
+# group statistics, over-fetching RETRIEVAL_OVERFETCH x RETRIEVAL_K candidates
+RETRIEVAL_K = int(os.environ.get('RETRIEVAL_K', '5'))
+GROUP_DUPLICATES = os.environ.get('GROUP_DUPLICATES', 'true').lower() == 'true'
+RETRIEVAL_OVERFETCH = int(os.environ.get('RETRIEVAL_OVERFETCH', '4'))
+CONTEXT_TOKEN_BUDGET = int(os.environ.get('CONTEXT_TOKEN_BUDGET', '1024'))
+
+STREAM_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+
+class Reply:
+    """What a request is answered with, for the adapter to turn into a response.
+
+    Either a JSON ``body`` with a status, after which the adapter finishes
+    the timer under ``route``, or ``events``, an async iterator of SSE or
+    NDJSON lines that finishes the timer itself.
+    """
+
+    def __init__(self, route=None, body=None, status=200, headers=None, events=None, media_type=None):
+        self.route = route
+        self.body = body
+        self.status = status
+        self.headers = dict(headers or {})
+        self.events = events
+        self.media_type = media_type
+
+
+def error_reply(message, status=500):
+    return Reply("error", {"error": message}, status)
+
+
+def deadline_exceeded():
+    return error_reply("Request deadline exceeded", 504)
+
+
+def overloaded(error):
+    """429 telling the client when the vLLM queue should have room again"""
+    logger.warning("Shedding query: %s", error)
+    return Reply("overloaded", {"error": str(error), "retry_after": error.retry_after}, 429,
+                 headers={'Retry-After': str(error.retry_after)})
+
+
+def event_stream(events, media_type='text/event-stream'):
+    """Lines streamed as they come; proxies must not buffer them"""
+    return Reply(events=events, media_type=media_type, headers=STREAM_HEADERS)
+
+
+async def sent(*events):
+    """Events that are all known already, as a stream"""
+    for event in events:
+        yield event
+
+
+class RagPipeline:
+    """/submit_query and /submit_queries over the backend of one service.
+
+    The pipeline is written once as coroutines. ``backend`` does the I/O:
+
+    - ``search(body, timeout)`` and ``msearch(body, timeout)``: OpenSearch responses
+    - ``embed(text, timeout)`` and ``embed_many(texts, timeout)``: Bedrock vectors
+    - ``chat(payload, timeout)``: a vLLM response; ``stream_chat(payload, timeout)``: its lines
+    - ``slot(priority, timeout)``: async context manager holding a vLLM slot
+    - ``coalesce(key, fn, timeout)``: (``await fn()`` or an identical in-flight
+      request's result, whether it was shared); ``coalesce_stream`` likewise
+      for an async iterator
+    - ``map_completed(fn, items, parallelism)``: ``await fn(item)`` for every
+      item, at most ``parallelism`` at once, yielded as they complete
+
+    FastAPI's backend awaits its clients. Flask's calls blocking clients
+    from coroutines that never suspend, and runs the pipeline with
+    ``run_blocking``.
+    """
+
+    def __init__(self, backend, embedding_cache=None, semantic_cache=None, context_tokenizer=None, admission=None):
+        self.backend = backend
+        self.embedding_cache = embedding_cache
+        self.semantic_cache = semantic_cache
+        self.context_tokenizer = context_tokenizer
+        self.admission = admission
+
+    async def generate_embedding(self, text, timeout=None):
+        """Embedding of a query, from the cache or Bedrock; None if Bedrock failed"""
+        try:
+            if self.embedding_cache is not None:
+                embedding = self.embedding_cache.get(text, EMBEDDING_MODEL_ID)
+                if embedding is not None:
+                    return embedding
+
+            embedding = await self.backend.embed(text, timeout)
+
+            if self.embedding_cache is not None:
+                self.embedding_cache.put(text, EMBEDDING_MODEL_ID, embedding)
+            logger.debug("Generated embedding with dimension %d", len(embedding))
+            return embedding
+        except QueryError:
+            raise
+        except Exception as e:
+            logger.error("Error generating embedding: %s", e)
+            return None
+
+    async def generate_embeddings(self, texts, timeout=None):
+        """Embeddings of many texts: cached ones, the rest through the embedding stage"""
+        embeddings = {}
+        missing = []
+        for text in dict.fromkeys(texts):
+            embedding = self.embedding_cache.get(text, EMBEDDING_MODEL_ID) if self.embedding_cache is not None else None
+            if embedding is None:
+                missing.append(text)
+            else:
+                embeddings[text] = embedding
+        if missing:
+            for text, embedding in zip(missing, await self.backend.embed_many(missing, timeout)):
+                embeddings[text] = embedding
+                if self.embedding_cache is not None:
+                    self.embedding_cache.put(text, EMBEDDING_MODEL_ID, embedding)
+        return [embeddings[text] for text in texts]
+
+    async def vector_search(self, embedding, k=5, query=None, filters=None, timeout=None):
+        """Search for similar vectors in OpenSearch, fused with BM25 in hybrid mode"""
+        try:
+            filter_clauses = build_filter_clauses(filters or {})
+            if RETRIEVAL_MODE == 'hybrid' and query:
+                return await self.hybrid_search(query, embedding, k, filter_clauses, timeout=timeout)
+
+            search_query = build_knn_query(embedding, k, filter_clauses)
+            log_payload(logger, "Executing vector search with query", search_query)
+            response = await self.backend.search(search_query, timeout)
+            record_opensearch_took(response)
+            return parse_search_hits(response)
+        except Exception as e:
+            logger.error("Error in vector search: %s", e)
+            return None
+
+    async def hybrid_search(self, query, embedding, k=5, filter_clauses=None, timeout=None):
+        """BM25 and kNN in one msearch round trip, fused with reciprocal rank fusion"""
+        response = await self.backend.msearch(
+            build_hybrid_msearch(INDEX_NAME, query, embedding, max(k, HYBRID_CANDIDATES), filter_clauses), timeout
+        )
+        record_opensearch_took(response)
+        for error in failed_searches(response):
+            logger.error("Hybrid sub-search failed: %s", error)
+        return parse_search_hits(fuse_msearch_response(response, k, lexical_weight=HYBRID_LEXICAL_WEIGHT))
+
+    async def retrieve_documents(self, embedding, query, filters, timeout=None):
+        """Top RETRIEVAL_K documents, with duplicates of a message grouped together"""
+        if not GROUP_DUPLICATES:
+            return await self.vector_search(embedding, RETRIEVAL_K, query=query, filters=filters, timeout=timeout)
+        candidates = await self.vector_search(embedding, RETRIEVAL_K * RETRIEVAL_OVERFETCH, query=query,
+                                              filters=filters, timeout=timeout)
+        return None if candidates is None else group_duplicates(candidates, RETRIEVAL_K)
+
+    async def embed_and_retrieve(self, query, filters, deadline, timer):
+        """Embedding, documents, the filters they were found with and those dropped; QueryError if a stage fails"""
+        with timer.stage("embed"):
+            embedding = await self.generate_embedding(query, timeout=deadline.timeout('embed'))
+        if deadline.expired():
+            raise QueryError("Request deadline exceeded", 504)
+        if embedding is None:
+            raise QueryError("Failed to generate embedding")
+
+        with timer.stage("search"):
+            similar_docs = await self.retrieve_documents(embedding, query, filters, timeout=deadline.timeout('search'))
+            relaxed = {}
+            if similar_docs is not None and not similar_docs and filters and QUERY_FILTER_FALLBACK:
+                logger.info("No logs match filters %s, searching without them", filters)
+                filters, relaxed = {}, filters
+                similar_docs = await self.retrieve_documents(embedding, query, filters,
+                                                             timeout=deadline.timeout('search'))
+        if similar_docs is None:
+            if deadline.expired():
+                raise QueryError("Request deadline exceeded", 504)
+            raise QueryError("Failed to perform vector search")
+        return embedding, similar_docs, filters, relaxed
+
+    async def batch_search(self, items, timeout=None):
+        """Retrieve for many questions in one msearch, setting each item's "docs" or "summary"
+
+        Analytical questions get their aggregations in the same round trip. A
+        question whose search failed gets None.
+        """
+        k = RETRIEVAL_K * RETRIEVAL_OVERFETCH if GROUP_DUPLICATES else RETRIEVAL_K
+        body, counts = [], []
+        for item in items:
+            if item["analytical"]:
+                searches = [{"index": INDEX_NAME}, build_analytics_query(item["query"], item["filters"])]
+            else:
+                searches = retrieval_searches(INDEX_NAME, item["query"], item["embedding"], k,
+                                              build_filter_clauses(item["filters"]),
+                                              hybrid=RETRIEVAL_MODE == 'hybrid', candidates=HYBRID_CANDIDATES)
+            body.extend(searches)
+            counts.append(len(searches) // 2)
+        response = await self.backend.msearch(body, timeout)
+        record_opensearch_took(response)
+        for error in failed_searches(response):
+            logger.error("Batch sub-search failed: %s", error)
+
+        for item, results in zip(items, split_msearch(response, counts)):
+            if all('error' in result for result in results):
+                item["docs"] = item["summary"] = None
+            elif item["analytical"]:
+                item["summary"] = summarize_aggregations(results[0])
+            else:
+                if len(results) > 1:
+                    hits = parse_search_hits(fuse_msearch_response({"responses": results}, k,
+                                                                   lexical_weight=HYBRID_LEXICAL_WEIGHT))
+                else:
+                    hits = parse_search_hits(results[0])
+                item["docs"] = group_duplicates(hits, RETRIEVAL_K) if GROUP_DUPLICATES else hits
+
+    async def batch_retrieve(self, items, timeout=None):
+        """batch_search, then again without filters for questions nothing matched, if QUERY_FILTER_FALLBACK"""
+        await self.batch_search(items, timeout=timeout)
+        if QUERY_FILTER_FALLBACK:
+            unmatched = [item for item in items if not item["analytical"] and item["docs"] == [] and item["filters"]]
+            for item in unmatched:
+                item["filters"], item["relaxed_filters"] = {}, item["filters"]
+            if unmatched:
+                logger.info("No logs match the filters of %d batch queries, searching without them", len(unmatched))
+                await self.batch_search(unmatched, timeout=timeout)
+
+    def prepare_context(self, similar_docs):
+        """LLM context for the retrieved documents"""
+        if CONTEXT_FORMAT == 'verbose':
+            return build_context(similar_docs)
+        context, _ = pack_context(similar_docs, CONTEXT_TOKEN_BUDGET, self.context_tokenizer)
+        return context
+
+    async def lookup_cached_answer(self, embedding, similar_docs, timeout=None):
+        """Return a cached answer for an equivalent query if no newer logs affect it"""
+        if self.semantic_cache is None:
+            return None
+        entry = self.semantic_cache.lookup(embedding, document_ids(similar_docs))
+        if entry is None:
+            return None
+        try:
+            response = await self.backend.search(build_freshness_query(entry), timeout)
+        except Exception as e:
+            logger.error("Error checking semantic cache freshness: %s", e)
+            return None
+        vehicle_ids, error_codes = stale_keys(response)
+        if vehicle_ids or error_codes:
+            self.semantic_cache.invalidate(vehicle_ids, error_codes)
+            return None
+        return entry['llm_response']
+
+    async def coalesced(self, kind, query, params, fn, timeout):
+        """await fn() once for identical in-flight requests: (result, whether it was shared)"""
+        return await self.backend.coalesce(flight_key(kind, query, *params), fn, timeout)
+
+    async def query_vllm(self, prompt, context, timeout=None):
+        """Query the vLLM model"""
+        try:
+            result = await self.backend.chat(build_vllm_payload(prompt, context), timeout)
+            log_payload(logger, "vLLM response", result)
+            return result['choices'][0]['message']['content']
+        except Exception as e:
+            logger.error("Error querying vLLM: %s", e)
+            return None
+
+    async def admitted_answer(self, prompt, context, deadline, priority):
+        """query_vllm once a vLLM slot is free; Overloaded if none frees up in time"""
+        async with self.backend.slot(priority, deadline.spare()):
+            return await self.query_vllm(prompt, context, timeout=deadline.timeout())
+
+    async def generate_answer(self, prompt, context, deadline, priority=DEFAULT_PRIORITY):
+        """vLLM answer shared by identical in-flight prompts: (answer or None, whether it was shared)"""
+        try:
+            return await self.coalesced("generate", prompt, [context],
+                                        lambda: self.admitted_answer(prompt, context, deadline, priority),
+                                        deadline.timeout())
+        except FlightTimeout:
+            return None, True
+
+    async def stream_vllm(self, prompt, context, deadline, priority=DEFAULT_PRIORITY):
+        """Yield answer tokens from the vLLM model as they are generated"""
+        payload = build_vllm_payload(prompt, context, stream=True)
+        async with self.backend.slot(priority, deadline.spare()):
+            lines = self.backend.stream_chat(payload, deadline.timeout())
+            try:
+                async for line in lines:
+                    done, token = parse_vllm_stream_line(line)
+                    if done:
+                        break
+                    if token:
+                        yield token
+            finally:
+                await lines.aclose()
+
+    async def stream_answer(self, query, embedding, similar_docs, context, start_time, cached_answer=None,
+                            filters=None, analytics=None, timer=None, deadline=None, priority=DEFAULT_PRIORITY,
+                            relaxed_filters=None):
+        """Server-sent events: documents first, then answer tokens, then a done event"""
+        timer = timer or StageTimer()
+        deadline = deadline or Deadline()
+        route = "retrieval" if analytics is None else "analytics"
+        yield format_sse(build_stream_start(query, similar_docs, cache_hit=cached_answer is not None,
+                                            filters=filters, analytics=analytics, relaxed_filters=relaxed_filters))
+
+        if cached_answer is not None:
+            yield format_sse({"llm_response": cached_answer})
+            yield format_sse(build_stream_end(start_time))
+            timer.finish("semantic_cache")
+            return
+
+        tokens = []
+        shared = False
+        source = None
+        llm_started = time.perf_counter()
+        try:
+            # Followers replay the tokens of an identical in-flight stream
+            source, shared = self.backend.coalesce_stream(flight_key("stream", query, context),
+                                                          lambda: self.stream_vllm(query, context, deadline, priority),
+                                                          deadline.timeout())
+            async for token in source:
+                if not tokens:
+                    timer.record("llm_ttft", time.perf_counter() - llm_started)
+                tokens.append(token)
+                yield format_sse({"llm_response": token})
+        except Overloaded as e:
+            logger.warning("Shedding streamed query: %s", e)
+            yield format_sse({"error": str(e), "retry_after": e.retry_after})
+            timer.finish("overloaded")
+            return
+        except Exception as e:
+            logger.error("Error streaming from vLLM: %s", e)
+            yield format_sse({"error": "Failed to get response from vLLM"})
+            timer.finish("error")
+            return
+        finally:
+            # A client that disconnects closes the stream, and with it vLLM's
+            if source is not None:
+                await source.aclose()
+        timer.record("llm_total", time.perf_counter() - llm_started)
+
+        if self.semantic_cache is not None and analytics is None and not shared:
+            self.semantic_cache.insert(query, embedding, similar_docs, "".join(tokens))
+        yield format_sse(build_stream_end(start_time))
+        timer.finish(route)
+
+    def degraded_reply(self, query, llm_response, similar_docs, start_time, filters, stream, timer, analytics=None,
+                       relaxed_filters=None):
+        """Retrieval results with a templated answer, for requests with no time left for vLLM"""
+        logger.warning("Request deadline leaves no time for generation, answering without vLLM")
+        if stream:
+            timer.finish("degraded")
+            return event_stream(sent(
+                format_sse(build_stream_start(query, similar_docs, filters=filters, analytics=analytics,
+                                              degraded=True, relaxed_filters=relaxed_filters)),
+                format_sse({"llm_response": llm_response}),
+                format_sse(build_stream_end(start_time))
+            ))
+        response = build_query_response(query, llm_response, similar_docs, start_time, filters=filters,
+                                        analytics=analytics, degraded=True, relaxed_filters=relaxed_filters)
+        return Reply("degraded", response)
+
+    async def run_analytics(self, query, filters, timeout=None):
+        """Aggregate the logs an analytical question asks about with a size-0 search"""
+        try:
+            response = await self.backend.search(build_analytics_query(query, filters), timeout)
+            record_opensearch_took(response)
+            return summarize_aggregations(response)
+        except Exception as e:
+            logger.error("Error running analytics query: %s", e)
+            return None
+
+    async def answer_analytics(self, query, filters, stream, start_time, timer, deadline, priority=DEFAULT_PRIORITY):
+        """Answer from aggregates: directly, or phrased by vLLM from the compact table"""
+        with timer.stage("search"):
+            summary, _ = await self.coalesced("analytics", query, [filters],
+                                              lambda: self.run_analytics(query, filters,
+                                                                         timeout=deadline.timeout('search')),
+                                              deadline.remaining())
+        if summary is None:
+            if deadline.expired():
+                return deadline_exceeded()
+            return error_reply("Failed to aggregate logs")
+
+        if ANALYTICS_ANSWER != 'direct' and not deadline.allows_generation():
+            return self.degraded_reply(query, direct_answer(summary, filters), [], start_time, filters, stream, timer,
+                                       analytics=summary)
+
+        if ANALYTICS_ANSWER == 'direct':
+            llm_response = direct_answer(summary, filters)
+            if stream:
+                timer.finish("analytics")
+                return event_stream(sent(
+                    format_sse(build_stream_start(query, [], filters=filters, analytics=summary)),
+                    format_sse({"llm_response": llm_response}),
+                    format_sse(build_stream_end(start_time))
+                ))
+        else:
+            context = f"Aggregated error log statistics:\n{render_table(summary)}"
+            if stream:
+                return event_stream(self.stream_answer(query, None, [], context, start_time, filters=filters,
+                                                       analytics=summary, timer=timer, deadline=deadline,
+                                                       priority=priority))
+            with timer.stage("llm_total"):
+                llm_response, _ = await self.generate_answer(query, context, deadline, priority)
+            if llm_response is None and deadline.expired():
+                return self.degraded_reply(query, direct_answer(summary, filters), [], start_time, filters, stream,
+                                           timer, analytics=summary)
+            if llm_response is None:
+                return error_reply("Failed to get response from vLLM")
+
+        return Reply("analytics", build_query_response(query, llm_response, [], start_time, filters=filters,
+                                                       analytics=summary))
+
+    async def submit_query(self, data, headers, timer):
+        """Reply to one /submit_query request body"""
+        start_time = time.time()
+        try:
+            if not isinstance(data, dict) or 'query' not in data:
+                return error_reply("Missing query parameter", 400)
+
+            query = data['query']
+            stream = wants_event_stream(headers.get('Accept'), data)
+            # Split across the stages and passed down as per-call timeouts
+            deadline = deadline_from_request(headers, data)
+            priority = request_priority(headers, data)
+            logger.info("Processing query: %.50s...", query)
+            filters = extract_query_filters(query) if QUERY_FILTERS else {}
+            analytical = ANALYTICS_ROUTER and is_analytical(query)
+
+            # Counts, extremes and trends come from aggregations, not from k documents
+            if analytical:
+                # Turn the query away before the aggregation if vLLM's queue cannot take it in time
+                if ANALYTICS_ANSWER != 'direct':
+                    self.admission.check(priority, deadline.spare())
+                return await self.answer_analytics(query, filters, stream, start_time, timer, deadline, priority)
+
+            # Embed and search, or wait for an identical request doing so
+            waited = time.perf_counter()
+            try:
+                (embedding, similar_docs, filters, relaxed), shared = await self.coalesced(
+                    "retrieve", query, [filters], lambda: self.embed_and_retrieve(query, filters, deadline, timer),
+                    deadline.remaining()
+                )
+            except QueryError as e:
+                return error_reply(str(e), e.status)
+            if shared:
+                timer.record("coalesced", time.perf_counter() - waited)
+
+            # Reuse the answer of a paraphrased question over the same logs
+            with timer.stage("cache_check"):
+                llm_response = await self.lookup_cached_answer(embedding, similar_docs,
+                                                               timeout=deadline.timeout('cache_check'))
+            if llm_response is not None and not stream:
+                response = build_query_response(query, llm_response, similar_docs, start_time, cache_hit=True,
+                                                filters=filters, relaxed_filters=relaxed)
+                return Reply("semantic_cache", response)
+
+            # Too little time left to generate: return what was retrieved
+            if llm_response is None and not deadline.allows_generation():
+                return self.degraded_reply(query, degraded_answer(similar_docs), similar_docs, start_time, filters,
+                                           stream, timer, relaxed_filters=relaxed)
+
+            # Only a cache miss needs vLLM: turn it away now if vLLM's queue cannot take it in time
+            if llm_response is None:
+                self.admission.check(priority, deadline.spare())
+
+            with timer.stage("pack"):
+                context = self.prepare_context(similar_docs)
+
+            # Stream tokens to the client as vLLM generates them
+            if stream:
+                return event_stream(self.stream_answer(query, embedding, similar_docs, context, start_time,
+                                                       cached_answer=llm_response, filters=filters, timer=timer,
+                                                       deadline=deadline, priority=priority, relaxed_filters=relaxed))
+
+            with timer.stage("llm_total"):
+                llm_response, shared = await self.generate_answer(query, context, deadline, priority)
+            if llm_response is None and deadline.expired():
+                return self.degraded_reply(query, degraded_answer(similar_docs), similar_docs, start_time, filters,
+                                           stream, timer, relaxed_filters=relaxed)
+            if llm_response is None:
+                return error_reply("Failed to get response from vLLM")
+
+            if self.semantic_cache is not None and not shared:
+                self.semantic_cache.insert(query, embedding, similar_docs, llm_response)
+
+            return Reply("retrieval", build_query_response(query, llm_response, similar_docs, start_time,
+                                                           filters=filters, relaxed_filters=relaxed))
+
+        except FlightTimeout:
+            return deadline_exceeded()
+        except Overloaded as e:
+            return overloaded(e)
+        except Exception as e:
+            logger.error("Error processing query: %s", e)
+            return error_reply(str(e))
+
+    async def answer_batch_item(self, item, seconds, priority, timer):
+        """Result line of one /submit_queries question, answered as /submit_query would"""
+        start_time = time.time()
+        # Each question gets the full budget from when its generation starts
+        deadline = Deadline(seconds)
+        query, filters, relaxed = item["query"], item["filters"], item["relaxed_filters"]
+        result = {"index": item["index"], "id": item["id"]}
+        try:
+            if item["analytical"]:
+                summary = item["summary"]
+                if ANALYTICS_ANSWER == 'direct':
+                    llm_response = direct_answer(summary, filters)
+                else:
+                    context = f"Aggregated error log statistics:\n{render_table(summary)}"
+                    with timer.stage("llm_total"):
+                        llm_response, _ = await self.generate_answer(query, context, deadline, priority)
+                if llm_response is None and deadline.expired():
+                    return dict(result, **build_query_response(query, direct_answer(summary, filters), [], start_time,
+                                                               filters=filters, analytics=summary, degraded=True))
+                if llm_response is None:
+                    return dict(result, error="Failed to get response from vLLM", status=500)
+                return dict(result, **build_query_response(query, llm_response, [], start_time, filters=filters,
+                                                           analytics=summary))
+
+            similar_docs = item["docs"]
+            llm_response = await self.lookup_cached_answer(item["embedding"], similar_docs,
+                                                           timeout=deadline.timeout('cache_check'))
+            if llm_response is not None:
+                return dict(result, **build_query_response(query, llm_response, similar_docs, start_time,
+                                                           cache_hit=True, filters=filters, relaxed_filters=relaxed))
+            with timer.stage("llm_total"):
+                llm_response, shared = await self.generate_answer(query, self.prepare_context(similar_docs), deadline,
+                                                                  priority)
+            if llm_response is None and deadline.expired():
+                return dict(result, **build_query_response(query, degraded_answer(similar_docs), similar_docs,
+                                                           start_time, filters=filters, degraded=True,
+                                                           relaxed_filters=relaxed))
+            if llm_response is None:
+                return dict(result, error="Failed to get response from vLLM", status=500)
+            if self.semantic_cache is not None and not shared:
+                self.semantic_cache.insert(query, item["embedding"], similar_docs, llm_response)
+            return dict(result, **build_query_response(query, llm_response, similar_docs, start_time, filters=filters,
+                                                       relaxed_filters=relaxed))
+        except Overloaded as e:
+            return dict(result, error=str(e), status=429, retry_after=e.retry_after)
+        except FlightTimeout:
+            return dict(result, error="Request deadline exceeded", status=504)
+        except Exception as e:
+            logger.error("Error answering batch query %d: %s", item["index"], e)
+            return dict(result, error=str(e), status=500)
+
+    async def answer_batch(self, items, seconds, priority, parallelism, start_time, timer):
+        """NDJSON lines: failed retrievals first, then answers as they complete, then a summary"""
+        results = []
+        answerable = []
+        for item in items:
+            if item["summary" if item["analytical"] else "docs"] is None:
+                results.append({"index": item["index"], "id": item["id"], "error": "Failed to perform vector search",
+                                "status": 500})
+                yield format_ndjson(results[-1])
+            else:
+                answerable.append(item)
+        # One timer per question: the sync backend answers them on several threads
+        timers = {item["index"]: StageTimer() for item in answerable}
+        answers = self.backend.map_completed(
+            lambda item: self.answer_batch_item(item, seconds, priority, timers[item["index"]]), answerable, parallelism
+        )
+        try:
+            async for result in answers:
+                timer.merge(timers[result["index"]])
+                results.append(result)
+                yield format_ndjson(result)
+        finally:
+            # A client that disconnects cancels the questions not answered yet
+            await answers.aclose()
+        yield format_ndjson(batch_summary(results, start_time))
+        timer.finish("batch")
+
+    async def submit_queries(self, data, headers, timer):
+        """Reply to one /submit_queries request body: answers as NDJSON in completion order"""
+        start_time = time.time()
+        try:
+            items = parse_batch(data)
+            # Budget of each question's generation, and of the batch's embedding and search
+            seconds = deadline_from_request(headers, data).seconds
+            priority = request_priority(headers, data, default=BATCH_PRIORITY)
+            logger.info("Processing %d queries", len(items))
+            for item in items:
+                item["filters"] = extract_query_filters(item["query"]) if QUERY_FILTERS else {}
+                item["relaxed_filters"] = {}
+                item["analytical"] = bool(ANALYTICS_ROUTER and is_analytical(item["query"]))
+
+            retrieval = [item for item in items if not item["analytical"]]
+            with timer.stage("embed"):
+                try:
+                    embeddings = await self.generate_embeddings([item["query"] for item in retrieval],
+                                                                timeout=seconds)
+                except Exception as e:
+                    logger.error("Error generating embeddings: %s", e)
+                    raise QueryError("Failed to generate embeddings")
+            for item, embedding in zip(retrieval, embeddings):
+                item["embedding"] = embedding
+
+            with timer.stage("search"):
+                try:
+                    await self.batch_retrieve(items, timeout=seconds)
+                except Exception as e:
+                    logger.error("Error in batch search: %s", e)
+                    raise QueryError("Failed to perform vector search")
+
+            lines = self.answer_batch(items, seconds, priority, batch_parallelism(data), start_time, timer)
+            return event_stream(lines, media_type='application/x-ndjson')
+
+        except QueryError as e:
+            return error_reply(str(e), e.status)
+        except Exception as e:
+            logger.error("Error processing queries: %s", e)
+            return error_reply(str(e))
+
+
+def run_blocking(awaitable):
+    """Result of a coroutine whose awaits all complete at once, as over Flask's blocking backend"""
+    steps = awaitable.__await__()
+    try:
+        steps.send(None)
+    except StopIteration as done:
+        return done.value
+    steps.close()
+    raise RuntimeError("A blocking pipeline step tried to suspend")
+
+
+def iterate_blocking(events):
+    """An async iterator over a blocking backend as a plain generator; closing it closes the iterator"""
+    try:
+        while True:
+            try:
+                event = run_blocking(events.__anext__())
+            except StopAsyncIteration:
+                return
+            yield event
+    finally:
+        if hasattr(events, 'aclose'):
+            run_blocking(events.aclose())
+
+
+async def blocking_iterator(iterable):
+    """A plain iterable as an async iterator; closing it closes the iterable's generator"""
+    iterator = iter(iterable)
+    try:
+        for item in iterator:
+            yield item
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            close()
+
+
+class BlockingContext:
+    """A plain context manager used with ``async with``"""
+
+    def __init__(self, manager):
+        self.manager = manager
+
+    async def __aenter__(self):
+        return self.manager.__enter__()
+
+    async def __aexit__(self, *exc):
+        return self.manager.__exit__(*exc)
@@ -0,0 +1,82 @@
+import os
+import time
+
+# Overall budget of a /submit_query request; a client may ask for less with a
+# "timeout" field in the body or an X-Request-Timeout header (seconds)
+REQUEST_DEADLINE = float(os.environ.get('REQUEST_DEADLINE', '60'))
+DEADLINE_HEADER = 'X-Request-Timeout'
+# Below this many seconds left, skip generation and answer from the retrieved logs
+MIN_GENERATION_SECONDS = float(os.environ.get('DEADLINE_MIN_GENERATION', '5'))
+# Most of the budget each retrieval stage may use, so a slow backend cannot
+# take the time generation needs; whatever is left goes to vLLM
+STAGE_SHARES = {
+    "embed": float(os.environ.get('DEADLINE_EMBED_SHARE', '0.1')),
+    "search": float(os.environ.get('DEADLINE_SEARCH_SHARE', '0.15')),
+    "cache_check": float(os.environ.get('DEADLINE_CACHE_CHECK_SHARE', '0.05')),
+}
+
+DEGRADED_NOTICE = "The answer was not generated within the request deadline. The most relevant error logs are:"
+
+
+class Deadline:
+    """Point in time by which a request must be answered"""
+
+    def __init__(self, seconds=REQUEST_DEADLINE):
+        self.seconds = seconds
+        self.expires = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires - time.monotonic())
+
+    def expired(self):
+        return time.monotonic() >= self.expires
+
+    def timeout(self, stage=None):
+        """Per-call timeout for a stage: its share of the budget, at most what is left"""
+        if stage is None:
+            return self.remaining()
+        return min(STAGE_SHARES[stage] * self.seconds, self.remaining())
+
+    def allows_generation(self):
+        return self.remaining() >= MIN_GENERATION_SECONDS
+
+    def spare(self):
+        """Time that may pass, e.g. queueing for vLLM, before generation has to start"""
+        return max(0.0, self.remaining() - MIN_GENERATION_SECONDS)
+
+
+def search_options(timeout):
+    """opensearch-py per-call keyword arguments for a timeout; it must be positive"""
+    return {} if timeout is None else {"request_timeout": max(timeout, 0.01)}
+
+
+def stage_budget(stage, seconds=REQUEST_DEADLINE):
+    """A stage's share of a full budget, for client timeouts set at startup"""
+    return STAGE_SHARES[stage] * seconds
+
+
+def deadline_from_request(headers, data):
+    """Deadline of the configured length, or shorter if the client asked for it"""
+    seconds = REQUEST_DEADLINE
+    for value in (data.get('timeout'), headers.get(DEADLINE_HEADER)):
+        try:
+            if value is not None and float(value) > 0:
+                seconds = min(seconds, float(value))
+        except (TypeError, ValueError):
+            pass
+    return Deadline(seconds)
+
+
+def degraded_answer(similar_docs):
+    """Templated summary of the retrieved logs, returned when vLLM is skipped"""
+    if not similar_docs:
+        return "The answer was not generated within the request deadline, and no matching error logs were found."
+    lines = [DEGRADED_NOTICE]
+    for doc in similar_docs:
+        group = doc.get("group") or {}
+        vehicles = group.get("vehicle_ids") or [doc["vehicle_id"]]
+        shown = ", ".join(vehicles[:5]) + (f" and {len(vehicles) - 5} more" if len(vehicles) > 5 else "")
+        latest = group.get("last_seen") or doc.get("timestamp")
+        line = f"- [{doc['error_code']}] {doc['service']}: {doc['message']} ({group.get('count', 1)} logs; vehicles {shown}"
+        lines.append(line + (f"; latest {latest})" if latest else ")"))
+    return "\n".join(lines)
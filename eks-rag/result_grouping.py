@@ -0,0 +1,56 @@
+from context_packer import SENSOR_COLUMNS, score_order
+
+# Log messages come from a dozen templates, so the top hits are often the
+# same sentence for different vehicles. Collapsing them leaves room for
+# more distinct incidents in the same number of slots and prompt tokens.
+
+
+def group_key(doc):
+    return doc["error_code"], doc["message"]
+
+
+def summarize_group(docs):
+    """Counts, vehicles, time range and sensor ranges of one group of hits"""
+    timestamps = sorted(doc["timestamp"] for doc in docs if doc.get("timestamp"))
+    sensor_ranges = {}
+    for column in SENSOR_COLUMNS:
+        values = [doc["sensor_readings"][column] for doc in docs
+                  if isinstance(doc.get("sensor_readings", {}).get(column), (int, float))]
+        if values:
+            sensor_ranges[column] = [min(values), max(values)]
+    return {
+        "count": len(docs),
+        "doc_ids": [doc.get("doc_id") for doc in docs],
+        "vehicle_ids": sorted({doc["vehicle_id"] for doc in docs}),
+        "first_seen": timestamps[0] if timestamps else None,
+        "last_seen": timestamps[-1] if timestamps else None,
+        "sensor_ranges": sensor_ranges,
+    }
+
+
+def group_duplicates(similar_docs, k=5):
+    """Best-scoring hit of each (error code, message) group, with group statistics.
+
+    Expects hits over-fetched in score order and returns at most ``k``
+    representatives, each carrying a ``group`` summary of all hits it
+    stands for.
+    """
+    groups = {}
+    for doc in similar_docs:
+        groups.setdefault(group_key(doc), []).append(doc)
+    representatives = []
+    for docs in groups.values():
+        best = min(docs, key=score_order)
+        representatives.append(dict(best, group=summarize_group(docs)))
+    representatives.sort(key=score_order)
+    return representatives[:k]
+
+
+def document_ids(similar_docs):
+    """Ids of every hit behind the documents, including grouped duplicates"""
+    return [doc_id for doc in similar_docs for doc_id in doc.get("group", {}).get("doc_ids", [doc.get("doc_id")])]
+
+
+def vehicle_ids(similar_docs):
+    """Vehicles behind the documents, including grouped duplicates"""
+    return [vehicle for doc in similar_docs for vehicle in doc.get("group", {}).get("vehicle_ids", [doc["vehicle_id"]])]
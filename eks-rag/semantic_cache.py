@@ -0,0 +1,166 @@
+import os
+import time
+import threading
+from datetime import datetime, timezone
+
+import numpy as np
+
+from result_grouping import document_ids, vehicle_ids
+
+
+class SemanticCache:
+    """Cache of LLM answers looked up by query-embedding similarity.
+
+    A cached answer is reused when the new query embedding lies within
+    ``max_distance`` (cosine distance) of a cached query and the documents
+    retrieved for both queries overlap by at least ``min_doc_overlap``
+    (Jaccard). Cached query vectors are kept L2-normalized in one float32
+    matrix, so a lookup is a single matrix-vector product.
+    """
+
+    def __init__(self, dimension=1024, max_entries=512, max_distance=0.1, min_doc_overlap=0.6, ttl=900):
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.min_doc_overlap = min_doc_overlap
+        self.ttl = ttl
+        self._vectors = np.zeros((max_entries, dimension), dtype=np.float32)
+        self._valid = np.zeros(max_entries, dtype=bool)
+        self._last_used = np.zeros(max_entries, dtype=np.float64)
+        self._entries = [None] * max_entries
+        self._lock = threading.Lock()
+        self._stats = dict.fromkeys(["lookups", "hits", "misses", "inserts", "evictions", "invalidations"], 0)
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    @staticmethod
+    def _overlap(a, b):
+        if not a and not b:
+            return 1.0
+        return len(a & b) / len(a | b)
+
+    def lookup(self, embedding, doc_ids):
+        """Return the closest matching cache entry, or None"""
+        query = self._normalize(embedding)
+        doc_ids = frozenset(doc_ids)
+        now = time.time()
+        with self._lock:
+            self._stats["lookups"] += 1
+            slots = np.flatnonzero(self._valid)
+            if len(slots):
+                distances = 1.0 - self._vectors[slots] @ query
+                for order in np.argsort(distances):
+                    if distances[order] > self.max_distance:
+                        break
+                    slot = int(slots[order])
+                    entry = self._entries[slot]
+                    if now - entry["created"] > self.ttl:
+                        self._drop(slot)
+                        continue
+                    if self._overlap(doc_ids, entry["doc_ids"]) >= self.min_doc_overlap:
+                        self._last_used[slot] = now
+                        self._stats["hits"] += 1
+                        return entry
+            self._stats["misses"] += 1
+            return None
+
+    def insert(self, query, embedding, similar_docs, llm_response):
+        """Cache an answer together with the documents it was generated from"""
+        now = time.time()
+        entry = {
+            "query": query,
+            "llm_response": llm_response,
+            "doc_ids": frozenset(document_ids(similar_docs)),
+            "vehicle_ids": frozenset(vehicle_ids(similar_docs)),
+            "error_codes": frozenset(doc["error_code"] for doc in similar_docs),
+            "created": now,
+        }
+        with self._lock:
+            free = np.flatnonzero(~self._valid)
+            if len(free):
+                slot = int(free[0])
+            else:
+                slot = int(np.argmin(self._last_used))
+                self._stats["evictions"] += 1
+            self._vectors[slot] = self._normalize(embedding)
+            self._entries[slot] = entry
+            self._valid[slot] = True
+            self._last_used[slot] = now
+            self._stats["inserts"] += 1
+        return entry
+
+    def _drop(self, slot):
+        self._valid[slot] = False
+        self._entries[slot] = None
+        self._last_used[slot] = 0.0
+
+    def invalidate(self, vehicle_ids=(), error_codes=()):
+        """Drop entries built from logs of any of the given vehicles or error codes"""
+        vehicle_ids, error_codes = set(vehicle_ids), set(error_codes)
+        dropped = 0
+        with self._lock:
+            for slot in np.flatnonzero(self._valid):
+                entry = self._entries[slot]
+                if entry["vehicle_ids"] & vehicle_ids or entry["error_codes"] & error_codes:
+                    self._drop(slot)
+                    dropped += 1
+            self._stats["invalidations"] += dropped
+        return dropped
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = int(self._valid.sum())
+        stats["hit_rate"] = round(stats["hits"] / stats["lookups"], 4) if stats["lookups"] else 0.0
+        return stats
+
+
+def build_freshness_query(entry):
+    """Find logs for the entry's vehicles or error codes newer than the entry.
+
+    Any hit means logs were ingested since the answer was generated; the
+    aggregations name the vehicles and error codes whose answers are stale.
+    """
+    created = datetime.fromtimestamp(entry["created"], tz=timezone.utc).isoformat()
+    return {
+        "size": 0,
+        "aggs": {
+            "vehicle_ids": {"terms": {"field": "vehicle_id", "size": 500}},
+            "error_codes": {"terms": {"field": "error_code", "size": 100}}
+        },
+        "query": {
+            "bool": {
+                "filter": [{"range": {"timestamp": {"gt": created}}}],
+                "should": [
+                    {"terms": {"vehicle_id": sorted(entry["vehicle_ids"])}},
+                    {"terms": {"error_code": sorted(entry["error_codes"])}}
+                ],
+                "minimum_should_match": 1
+            }
+        }
+    }
+
+
+def stale_keys(response):
+    """Vehicles and error codes with newer logs, from a freshness query response"""
+    aggregations = response.get("aggregations", {})
+    vehicle_ids = [b["key"] for b in aggregations.get("vehicle_ids", {}).get("buckets", [])]
+    error_codes = [b["key"] for b in aggregations.get("error_codes", {}).get("buckets", [])]
+    return vehicle_ids, error_codes
+
+
+def semantic_cache_from_env(dimension=1024):
+    """Build the answer cache from SEMANTIC_CACHE_* settings, or None if disabled"""
+    max_entries = int(os.environ.get('SEMANTIC_CACHE_ENTRIES', '512'))
+    if max_entries <= 0:
+        return None
+    return SemanticCache(
+        dimension=dimension,
+        max_entries=max_entries,
+        max_distance=float(os.environ.get('SEMANTIC_CACHE_MAX_DISTANCE', '0.1')),
+        min_doc_overlap=float(os.environ.get('SEMANTIC_CACHE_MIN_DOC_OVERLAP', '0.6')),
+        ttl=float(os.environ.get('SEMANTIC_CACHE_TTL', '900'))
+    )
@@ -0,0 +1,435 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import threading
+import uuid
+
+from embedding_cache import normalize_query
+
+
+class FlightTimeout(TimeoutError):
+    """A follower's own deadline expired while it waited for the leader"""
+
+
+class FlightAbandoned(Exception):
+    """The leader stopped before finishing, e.g. its client disconnected"""
+
+
+def flight_key(kind, query, *params):
+    """Key of a computation: its kind, the normalized query and any parameters"""
+    material = json.dumps([kind, normalize_query(query), *params], sort_keys=True, default=str)
+    return hashlib.blake2b(material.encode('utf-8'), digest_size=16).hexdigest()
+
+
+class FlightStats:
+    """Leader and follower counters shared by both implementations"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+        self.coalesced_remote = 0
+        self.abandoned = 0
+
+    def record(self, field):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def snapshot(self, in_flight):
+        with self._lock:
+            return {
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+                "coalesced_remote": self.coalesced_remote,
+                "abandoned": self.abandoned,
+                "in_flight": in_flight,
+            }
+
+
+class FileFlightStore:
+    """Leader election and result hand-off between processes through a directory.
+
+    The first process to create ``<key>.lock`` leads: it writes its flight
+    id into the lock, computes the result and publishes it as ``<key>.json``
+    under that id before removing the lock. The others poll for a result
+    with the id they saw in the lock. A lock older than ``ttl`` seconds is
+    taken to belong to a dead leader. Any directory the processes share
+    works: ``/dev/shm`` for the gunicorn workers of a pod, a shared volume
+    across pods. Results must be JSON serializable.
+    """
+
+    def __init__(self, directory, ttl=120.0, poll_interval=0.02):
+        self.directory = directory
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key, suffix):
+        return os.path.join(self.directory, key + suffix)
+
+    def claim(self, key):
+        """A new flight id if this process now leads ``key``, else None"""
+        lock = self._path(key, '.lock')
+        try:
+            if time.time() - os.path.getmtime(lock) > self.ttl:
+                os.unlink(lock)
+        except FileNotFoundError:
+            pass
+        try:
+            fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return None
+        flight = f"{os.getpid()}-{uuid.uuid4().hex}"
+        with os.fdopen(fd, 'w') as f:
+            f.write(flight)
+        return flight
+
+    def leader(self, key):
+        """Flight id of the current leader of ``key``, if any"""
+        try:
+            with open(self._path(key, '.lock'), 'r') as f:
+                return f.read() or None
+        except FileNotFoundError:
+            return None
+
+    def poll(self, key, flight):
+        """(True, result) once ``flight`` has published, else (False, None)"""
+        try:
+            with open(self._path(key, '.json'), 'r') as f:
+                published = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return False, None
+        if published.get("flight") != flight:
+            return False, None
+        return True, published["result"]
+
+    def publish(self, key, flight, result):
+        tmp = self._path(key, f'.{flight}.tmp')
+        with open(tmp, 'w') as f:
+            json.dump({"flight": flight, "result": result}, f)
+        os.replace(tmp, self._path(key, '.json'))
+        self._sweep()
+
+    def release(self, key, flight):
+        if self.leader(key) == flight:
+            try:
+                os.unlink(self._path(key, '.lock'))
+            except FileNotFoundError:
+                pass
+
+    def _sweep(self):
+        """Drop results no follower can still be waiting for"""
+        cutoff = time.time() - self.ttl
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.name.endswith('.json') and entry.stat().st_mtime < cutoff:
+                    os.unlink(entry.path)
+            except FileNotFoundError:
+                pass
+
+
+class _Flight:
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.items = []
+        self.done = False
+        self.result = None
+        self.error = None
+
+    def append(self, item):
+        with self.cond:
+            self.items.append(item)
+            self.cond.notify_all()
+
+    def finish(self, result=None, error=None):
+        with self.cond:
+            self.result, self.error, self.done = result, error, True
+            self.cond.notify_all()
+
+    def wait(self, deadline, index=None):
+        """Block until the flight is done, or has more than ``index`` items"""
+        with self.cond:
+            while not self.done and (index is None or len(self.items) <= index):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise FlightTimeout("Gave up waiting for an identical in-flight request")
+                self.cond.wait(remaining)
+
+
+def _deadline(timeout):
+    return None if timeout is None else time.monotonic() + timeout
+
+
+class SingleFlight:
+    """Runs a computation once for concurrent callers with the same key.
+
+    The first caller (the leader) runs it; callers arriving while it is in
+    flight wait and get its result or exception. With a ``store``, leaders
+    are also elected across processes for ``do``; ``stream`` coalesces
+    within the process only.
+    """
+
+    def __init__(self, store=None):
+        self.store = store
+        self.stats = FlightStats()
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def _join(self, key):
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                return flight, False
+            flight = self._flights[key] = _Flight()
+            return flight, True
+
+    def _land(self, key, flight, result=None, error=None):
+        with self._lock:
+            del self._flights[key]
+        flight.finish(result, error)
+
+    def do(self, key, fn, timeout=None):
+        """(fn() or the leader's result, whether it was coalesced)"""
+        deadline = _deadline(timeout)
+        while True:
+            flight, leader = self._join(key)
+            if not leader:
+                flight.wait(deadline)
+                if isinstance(flight.error, FlightAbandoned):
+                    continue
+                self.stats.record('coalesced')
+                if flight.error is not None:
+                    raise flight.error
+                return flight.result, True
+            try:
+                result, remote = self._run(key, fn, deadline)
+            except BaseException as e:
+                self._land(key, flight, error=e if isinstance(e, Exception) else FlightAbandoned(repr(e)))
+                raise
+            self._land(key, flight, result=result)
+            return result, remote
+
+    def _elect(self, key, watched):
+        """One round of election across processes: ('lead', flight id), ('done', result) or ('wait', flight id)"""
+        flight = self.store.claim(key)
+        if watched is not None:
+            # A leader publishes before it unlocks, so a claim won just now may follow its result
+            published, result = self.store.poll(key, watched)
+            if published:
+                if flight is not None:
+                    self.store.release(key, flight)
+                return 'done', result
+        if flight is not None:
+            return 'lead', flight
+        # A leader that failed unlocks without a result, and the next claim wins
+        return 'wait', self.store.leader(key) or watched
+
+    def _run(self, key, fn, deadline):
+        """fn() here, or the result of a leader in another process"""
+        flight = watched = None
+        while self.store is not None:
+            action, value = self._elect(key, watched)
+            if action == 'done':
+                self.stats.record('coalesced_remote')
+                return value, True
+            if action == 'lead':
+                flight = value
+                break
+            watched = value
+            if deadline is not None and time.monotonic() >= deadline:
+                raise FlightTimeout("Gave up waiting for an identical request in another process")
+            time.sleep(self.store.poll_interval)
+        self.stats.record('leaders')
+        if flight is None:
+            return fn(), False
+        try:
+            result = fn()
+            self.store.publish(key, flight, result)
+            return result, False
+        finally:
+            self.store.release(key, flight)
+
+    def stream(self, key, fn, timeout=None):
+        """(iterator over fn()'s items or a replay of the leader's, whether it was coalesced)"""
+        flight, leader = self._join(key)
+        if not leader:
+            self.stats.record('coalesced')
+            return self._follow(flight, _deadline(timeout)), True
+        self.stats.record('leaders')
+        return self._lead(key, flight, fn), False
+
+    def _lead(self, key, flight, fn):
+        try:
+            for item in fn():
+                flight.append(item)
+                yield item
+        except Exception as e:
+            self._land(key, flight, error=e)
+            raise
+        except BaseException:
+            # Closed by a disconnected client: the followers cannot be served
+            self.stats.record('abandoned')
+            self._land(key, flight, error=FlightAbandoned("The leading request stopped streaming"))
+            raise
+        self._land(key, flight)
+
+    def _follow(self, flight, deadline):
+        index = 0
+        while True:
+            flight.wait(deadline, index)
+            items = flight.items[index:]
+            index += len(items)
+            yield from items
+            if flight.done and index == len(flight.items):
+                if flight.error is not None:
+                    raise flight.error
+                return
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._flights)
+
+    def snapshot(self):
+        return self.stats.snapshot(self.in_flight())
+
+
+class _AsyncFlight:
+    def __init__(self):
+        self.changed = asyncio.Event()
+        self.items = []
+        self.done = False
+        self.result = None
+        self.error = None
+
+    def _notify(self):
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    def append(self, item):
+        self.items.append(item)
+        self._notify()
+
+    def finish(self, result=None, error=None):
+        self.result, self.error, self.done = result, error, True
+        self._notify()
+
+    async def wait(self, deadline, index=None):
+        while not self.done and (index is None or len(self.items) <= index):
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                raise FlightTimeout("Gave up waiting for an identical in-flight request")
+            try:
+                await asyncio.wait_for(self.changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+
+class AsyncSingleFlight(SingleFlight):
+    """asyncio counterpart of SingleFlight; ``fn`` is a coroutine function or async generator function"""
+
+    def _join(self, key):
+        flight = self._flights.get(key)
+        if flight is not None:
+            return flight, False
+        flight = self._flights[key] = _AsyncFlight()
+        return flight, True
+
+    def _land(self, key, flight, result=None, error=None):
+        del self._flights[key]
+        flight.finish(result, error)
+
+    async def do(self, key, fn, timeout=None):
+        deadline = _deadline(timeout)
+        while True:
+            flight, leader = self._join(key)
+            if not leader:
+                await flight.wait(deadline)
+                if isinstance(flight.error, FlightAbandoned):
+                    continue
+                self.stats.record('coalesced')
+                if flight.error is not None:
+                    raise flight.error
+                return flight.result, True
+            try:
+                result, remote = await self._run(key, fn, deadline)
+            except BaseException as e:
+                # A cancelled leader hands the computation to the next follower
+                self._land(key, flight, error=e if isinstance(e, Exception) else FlightAbandoned(repr(e)))
+                raise
+            self._land(key, flight, result=result)
+            return result, remote
+
+    async def _run(self, key, fn, deadline):
+        flight = watched = None
+        while self.store is not None:
+            action, value = self._elect(key, watched)
+            if action == 'done':
+                self.stats.record('coalesced_remote')
+                return value, True
+            if action == 'lead':
+                flight = value
+                break
+            watched = value
+            if deadline is not None and time.monotonic() >= deadline:
+                raise FlightTimeout("Gave up waiting for an identical request in another process")
+            await asyncio.sleep(self.store.poll_interval)
+        self.stats.record('leaders')
+        if flight is None:
+            return await fn(), False
+        try:
+            result = await fn()
+            self.store.publish(key, flight, result)
+            return result, False
+        finally:
+            self.store.release(key, flight)
+
+    def stream(self, key, fn, timeout=None):
+        flight, leader = self._join(key)
+        if not leader:
+            self.stats.record('coalesced')
+            return self._follow(flight, _deadline(timeout)), True
+        self.stats.record('leaders')
+        return self._lead(key, flight, fn), False
+
+    async def _lead(self, key, flight, fn):
+        try:
+            async for item in fn():
+                flight.append(item)
+                yield item
+        except Exception as e:
+            self._land(key, flight, error=e)
+            raise
+        except BaseException:
+            self.stats.record('abandoned')
+            self._land(key, flight, error=FlightAbandoned("The leading request stopped streaming"))
+            raise
+        self._land(key, flight)
+
+    async def _follow(self, flight, deadline):
+        index = 0
+        while True:
+            await flight.wait(deadline, index)
+            items = flight.items[index:]
+            index += len(items)
+            for item in items:
+                yield item
+            if flight.done and index == len(flight.items):
+                if flight.error is not None:
+                    raise flight.error
+                return
+
+    def in_flight(self):
+        return len(self._flights)
+
+
+def singleflight_from_env(asynchronous=False):
+    """SingleFlight (or AsyncSingleFlight) from SINGLEFLIGHT* settings, or None if disabled"""
+    if os.environ.get('SINGLEFLIGHT', 'true').lower() != 'true':
+        return None
+    store = None
+    directory = os.environ.get('SINGLEFLIGHT_DIR')
+    if directory:
+        store = FileFlightStore(directory, ttl=float(os.environ.get('SINGLEFLIGHT_TTL', '120')))
+    return AsyncSingleFlight(store) if asynchronous else SingleFlight(store)
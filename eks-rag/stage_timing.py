@@ -0,0 +1,166 @@
+import os
+import re
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+from opensearchpy.metrics import MetricsEvents
+
+# Stages of /submit_query. opensearch_service is the HTTP round trip of the
+# OpenSearch calls made during the request and opensearch_took the time the
+# engine reports spending on them; the difference is network and queueing,
+# and search minus opensearch_service is client-side work. coalesced is the
+# wait of a request that shared an identical in-flight request's retrieval.
+STAGES = ["embed", "search", "opensearch_service", "opensearch_took", "coalesced", "cache_check", "pack", "llm_ttft",
+          "llm_total", "serialize"]
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+STAGE_SECONDS = Histogram(
+    'rag_stage_duration_seconds', 'Time spent in one stage of a query', ['stage'], buckets=BUCKETS
+)
+REQUEST_SECONDS = Histogram(
+    'rag_request_duration_seconds', 'Time to answer a query, by route', ['route'], buckets=BUCKETS
+)
+
+# The timer of the request being served, for hooks that cannot be handed one
+current_timer = contextvars.ContextVar('current_timer', default=None)
+
+
+class StageTimer:
+    """Durations of the stages of one request, also observed in the histograms"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.durations = {}
+
+    def record(self, stage, seconds):
+        self.durations[stage] = self.durations.get(stage, 0.0) + seconds
+        STAGE_SECONDS.labels(stage).observe(seconds)
+
+    def merge(self, other):
+        """Add the durations of another request's timer, already observed in the histograms"""
+        for stage, seconds in other.durations.items():
+            self.durations[stage] = self.durations.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def server_timing(self):
+        """Server-Timing header value with the stages recorded so far"""
+        entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in self.durations.items()]
+        entries.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.1f}")
+        return ", ".join(entries)
+
+    def finish(self, route):
+        REQUEST_SECONDS.labels(route).observe(time.perf_counter() - self.started)
+
+
+def record_opensearch_time(seconds):
+    timer = current_timer.get()
+    if timer is not None:
+        timer.record('opensearch_service', seconds)
+
+
+def record_opensearch_took(response):
+    """Engine time an OpenSearch search or msearch response reports"""
+    timer = current_timer.get()
+    if timer is not None and isinstance(response, dict) and 'took' in response:
+        timer.record('opensearch_took', response['took'] / 1000)
+
+
+class OpenSearchMetrics(MetricsEvents):
+    """opensearch-py MetricsEvents adding each round trip to the current request's timer.
+
+    The client shares one metrics object across threads, so the start time
+    is kept per thread.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        super().__init__()
+
+    @property
+    def start_time(self):
+        return getattr(self._local, 'start_time', None)
+
+    @property
+    def end_time(self):
+        return getattr(self._local, 'end_time', None)
+
+    @property
+    def service_time(self):
+        return getattr(self._local, 'service_time', None)
+
+    def _on_request_start(self):
+        self._local.start_time = time.perf_counter()
+        self._local.end_time = self._local.service_time = None
+
+    def _on_request_end(self):
+        self._local.end_time = time.perf_counter()
+        if self.start_time is not None:
+            self._local.service_time = self._local.end_time - self.start_time
+            record_opensearch_time(self._local.service_time)
+
+
+def _metric_name(*parts):
+    return re.sub(r'[^a-zA-Z0-9_]', '_', "_".join(parts))
+
+
+class StatsCollector:
+    """Numeric fields of the services' JSON stats as gauges, e.g. rag_semantic_cache_hits.
+
+    Keys that are not identifiers, such as vLLM endpoint URLs, become a
+    label named after their parent key.
+    """
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def collect(self):
+        families = {}
+
+        def walk(name, value, labels):
+            if isinstance(value, dict):
+                for key, item in value.items():
+                    if key.isidentifier():
+                        walk(_metric_name(name, key), item, labels)
+                    else:
+                        label = name.rsplit('_', 1)[-1].rstrip('s')
+                        walk(name, item, labels + ((label, key),))
+            elif isinstance(value, (int, float)):
+                family = families.get(name)
+                if family is None:
+                    family = families[name] = GaugeMetricFamily(name, name, labels=[k for k, _ in labels])
+                family.add_metric([v for _, v in labels], float(value))
+
+        walk('rag', self.stats(), ())
+        return families.values()
+
+
+def metrics_exposition(stats):
+    """Prometheus text for the histograms and the JSON stats, and its content type.
+
+    With PROMETHEUS_MULTIPROC_DIR set the histograms are merged across the
+    gunicorn workers; the stats are always those of the worker scraped.
+    """
+    registry = REGISTRY
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    stats_registry = CollectorRegistry()
+    stats_registry.register(StatsCollector(stats))
+    return generate_latest(registry) + generate_latest(stats_registry), CONTENT_TYPE_LATEST
+
+
+def wants_json(accept, args):
+    """Whether a /metrics client asked for the JSON stats"""
+    return args.get('format') == 'json' or 'application/json' in (accept or '')
@@ -1,76 +1,82 @@
 import os
-import requests
-from flask import Flask, jsonify, request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import Flask, Response, jsonify, request, stream_with_context
 import boto3
-import json
-import time
-import logging
 from botocore.config import Config
 from opensearchpy import OpenSearch, RequestsHttpConnection
-from requests_aws4auth import AWS4Auth
+from aws_auth import CachedCredentialProvider, CachedAWS4Auth
+from embedding_batcher import EmbeddingBatcher, MAX_EMBED_BATCH
+from embedding_stage import embedding_stage_from_env
+from embedding_cache import cache_from_env
+from vllm_client import VLLMClient, client_settings_from_env
+from semantic_cache import semantic_cache_from_env
+from context_packer import tokenizer_from_env
+from log_setup import configure_logging
+from request_deadline import search_options, stage_budget
+from singleflight import singleflight_from_env
+from admission import admission_from_env
+from batch_queries import BATCH_PARALLELISM
+from stage_timing import StageTimer, OpenSearchMetrics, current_timer, metrics_exposition, wants_json
+from rag_common import AWS_REGION, INDEX_NAME, get_collection_endpoint, embed_texts
+from rag_pipeline import RagPipeline, BlockingContext, run_blocking, iterate_blocking, blocking_iterator
 
 app = Flask(__name__)
-logging.basicConfig(level=logging.INFO)
+configure_logging()
 logger = app.logger
 
-# Configure boto3 with timeouts and retries
+# Configure boto3 with timeouts and retries. boto3 takes no per-call timeout,
+# so a Bedrock call is bounded by the embed stage's share of the request deadline
 boto3_config = Config(
-    connect_timeout=5,
-    read_timeout=30,
+    connect_timeout=min(5, stage_budget('embed')),
+    read_timeout=min(30, stage_budget('embed')),
     retries={'max_attempts': 2}
 )
 
-# Custom connection class that refreshes AWS credentials before each request
+# Credentials are resolved once and refreshed in the background before they expire
+aws_credentials = CachedCredentialProvider(
+    refresh_margin=float(os.environ.get('AWS_CREDENTIALS_REFRESH_MARGIN', '300'))
+)
+
+# Custom connection class that signs each request with current AWS credentials
 class RefreshingAWS4AuthConnection(RequestsHttpConnection):
     def __init__(self, region, service="aoss", **kwargs):
         self.region = region
         self.service = service
         super().__init__(**kwargs)
-    
-    def perform_request(self, method, url, params=None, body=None, timeout=None, ignore=(), headers=None):
-        # Get fresh credentials for each request
-        credentials = boto3.Session().get_credentials()
-        auth = AWS4Auth(
-            credentials.access_key,
-            credentials.secret_key,
-            self.region,
-            self.service,
-            session_token=credentials.token
-        )
-        
-        # Update session auth with fresh credentials
-        self.session.auth = auth
-        
-        # Proceed with the request
-        return super().perform_request(method, url, params, body, timeout, ignore, headers)
+        # Reuses the SigV4 signing key until the credentials rotate or the date changes
+        self.session.auth = CachedAWS4Auth(aws_credentials, region, service)
+
+# Local or self-managed backends instead of the AWS ones, e.g. the stand-ins
+# in benchmarks/stand_ins.py: an unsigned OpenSearch URL and a Bedrock endpoint
+OPENSEARCH_URL = os.environ.get('OPENSEARCH_URL')
+BEDROCK_ENDPOINT_URL = os.environ.get('BEDROCK_ENDPOINT_URL')
 
 # Initialize Bedrock client
 bedrock_runtime = None
 try:
     bedrock_runtime = boto3.client(
         service_name='bedrock-runtime',
-        region_name='us-west-2',
+        region_name=AWS_REGION,
+        endpoint_url=BEDROCK_ENDPOINT_URL,
         config=boto3_config
     )
     logger.info("Bedrock client initialized successfully")
 except Exception as e:
-    logger.error(f"Failed to initialize Bedrock client: {e}")
+    logger.error("Failed to initialize Bedrock client: %s", e)
 
 # Initialize OpenSearch client
 opensearch_client = None
 try:
-    # Get collection endpoint
-    os_serverless = boto3.client('opensearchserverless')
-    collections = os_serverless.list_collections(
-        collectionFilters={'name': 'error-logs-mock'}
-    )['collectionSummaries']
-    
-    if collections:
-        collection_id = collections[0]['id']
-        collection_details = os_serverless.batch_get_collection(ids=[collection_id])
-        endpoint = collection_details['collectionDetails'][0]['collectionEndpoint']
-        endpoint = endpoint.replace('https://', '')
-        
+    if OPENSEARCH_URL:
+        opensearch_client = OpenSearch(hosts=[OPENSEARCH_URL], timeout=30, metrics=OpenSearchMetrics())
+        logger.info("OpenSearch client initialized for %s", OPENSEARCH_URL)
+        endpoint = None
+    else:
+        # Get collection endpoint
+        os_serverless = boto3.client('opensearchserverless')
+        endpoint = get_collection_endpoint(os_serverless)
+
+    if endpoint:
         # Create OpenSearch client with the custom connection class
         # No need to create AWS4Auth here as it's handled by the connection class
         opensearch_client = OpenSearch(
@@ -78,177 +84,192 @@ try:
             use_ssl=True,
             verify_certs=True,
             timeout=30,
-            retry_on_timeout=True,
+            # Searches get the request's remaining budget as their timeout; a
+            # timed-out search is not retried past it
+            retry_on_timeout=False,
             max_retries=3,
+            # Reports each request's round trip to the stage timer of the query
+            metrics=OpenSearchMetrics(),
             connection_class=lambda **kwargs: RefreshingAWS4AuthConnection(
-                region='us-west-2', 
+                region=AWS_REGION,
                 service='aoss',
                 **kwargs
             )
         )
         logger.info("OpenSearch client initialized successfully")
 except Exception as e:
-    logger.error(f"Failed to initialize OpenSearch client: {e}")
+    logger.error("Failed to initialize OpenSearch client: %s", e)
 
-def generate_embedding(text):
-    """Generate embeddings using Bedrock"""
-    try:
-        response = bedrock_runtime.invoke_model(
-            modelId="cohere.embed-english-v3",
-            contentType="application/json",
-            accept="application/json",
-            body=json.dumps({
-                "texts": [text],
-                "input_type": "search_query"
-            })
-        )
-        embedding = json.loads(response['body'].read())['embeddings'][0]
-        logger.info(f"Generated embedding with dimension: {len(embedding)}")
-        logger.info(f"Generated embedding type: {type(embedding)}")
-        logger.info(f"First few values of embedding: {embedding[:5]}")
-        return embedding
-    except Exception as e:
-        logger.error(f"Error generating embedding: {e}")
-        return None
-
-def vector_search(embedding, k=5):
-    """Search for similar vectors in OpenSearch"""
-    try:
-        search_query = {
-            "size": k,
-            "_source": [
-                "message", 
-                "service", 
-                "error_code",
-                "vehicle_id",
-                "vehicle_state",
-                "sensor_readings",
-                "diagnostic_info"
-            ],
-            "query": {
-                "knn": {
-                    "message_embedding": {
-                        "vector": embedding,
-                        "k": k
-                    }
-                }
-            }
-        }
-        
-        logger.info(f"Executing vector search with query: {json.dumps(search_query, indent=2)}")
-        
-        response = opensearch_client.search(
-            index='error-logs-mock',
-            body=search_query
-        )
-        
-        results = []
-        for hit in response['hits']['hits']:
-            results.append({
-                "score": hit["_score"],
-                "message": hit["_source"]["message"],
-                "service": hit["_source"]["service"],
-                "error_code": hit["_source"]["error_code"],
-                "vehicle_id": hit["_source"].get("vehicle_id", "N/A"),
-                "vehicle_state": hit["_source"].get("vehicle_state", "N/A"),
-                "sensor_readings": hit["_source"].get("sensor_readings", {}),
-                "diagnostic_info": hit["_source"].get("diagnostic_info", {})
-            })
-        
-        return results
-    except Exception as e:
-        logger.error(f"Error in vector search: {e}")
-        return None
-
-        
-        
-def query_vllm(prompt, context):
-    """Query the vLLM model"""
-    try:
-        # Use the full Kubernetes DNS name for the service
-        vllm_host = os.environ.get('VLLM_HOST', 'vllm-llama3-inf2-serve-svc.vllm.svc.cluster.local')
-        vllm_port = os.environ.get('VLLM_PORT', '8000')
-        vllm_url = f"http://{vllm_host}:{vllm_port}/v1/chat/completions"
-        
-        headers = {'Content-Type': 'application/json'}
-        data = {
-            "model": "NousResearch/Meta-Llama-3-8B-Instruct",
-            "messages": [
-                {"role": "system", "content": "You are a helpful assistant."},
-                {"role": "user", "content": f"Context: {context}\n\nQuery: {prompt}"}
-            ]
-        }
-        
-        response = requests.post(vllm_url, headers=headers, json=data)
-        response.raise_for_status()
-        
-        result = response.json()
-        logger.info(f"vLLM response: {json.dumps(result, indent=2)}")  
-        return result['choices'][0]['message']['content']
-    except Exception as e:
-        logger.error(f"Error querying vLLM: {e}")
-        logger.error(f"Error details: {str(e)}") 
-        return None
+# Coalesce concurrent query embeddings into one Bedrock call. Sync gunicorn
+# workers serve one request at a time, so this only pays off with --threads
+EMBED_BATCH_WINDOW_MS = float(os.environ.get('EMBED_BATCH_WINDOW_MS', '0'))
+embedding_batcher = None
+if EMBED_BATCH_WINDOW_MS > 0:
+    embedding_batcher = EmbeddingBatcher(
+        lambda texts: embed_texts(bedrock_runtime, texts),
+        max_wait=EMBED_BATCH_WINDOW_MS / 1000,
+        max_batch_size=int(os.environ.get('EMBED_BATCH_MAX_TEXTS', MAX_EMBED_BATCH))
+    )
+
+# Batch embeddings go out in concurrent, rate-limited Bedrock calls that back off on throttling
+embedding_stage = embedding_stage_from_env(lambda texts: embed_texts(bedrock_runtime, texts))
+
+# Query embeddings shared by all gunicorn workers through a memory-mapped file
+embedding_cache = None
+try:
+    embedding_cache = cache_from_env()
+except Exception as e:
+    logger.error("Failed to initialize embedding cache: %s", e)
+
+# Answers of recent queries, reused for paraphrases that retrieve the same logs
+semantic_cache = None
+try:
+    semantic_cache = semantic_cache_from_env()
+except Exception as e:
+    logger.error("Failed to initialize semantic cache: %s", e)
+
+# Identical questions in flight at the same time share one retrieval and one generation
+flights = None
+try:
+    flights = singleflight_from_env()
+except Exception as e:
+    logger.error("Failed to initialize request coalescing: %s", e)
+
+# Keep-alive connections to the vLLM replicas, with connect/read/total deadlines;
+# enough for a /submit_queries batch to generate BATCH_PARALLELISM answers at once
+vllm_client = VLLMClient(
+    pool_size=int(os.environ.get('VLLM_POOL_SIZE', max(4, BATCH_PARALLELISM))),
+    **client_settings_from_env()
+)
+
+# Outstanding vLLM requests of this worker, queued by priority past ADMISSION_MAX_OUTSTANDING
+admission = admission_from_env()
+
+
+class BlockingBackend:
+    """The pipeline's I/O through the blocking clients above, read when called so they can be replaced.
+
+    Its coroutines never suspend, so run_blocking drives the pipeline to
+    completion on the request's thread.
+    """
+
+    async def search(self, body, timeout):
+        return opensearch_client.search(index=INDEX_NAME, body=body, **search_options(timeout))
+
+    async def msearch(self, body, timeout):
+        return opensearch_client.msearch(body=body, **search_options(timeout))
+
+    async def embed(self, text, timeout):
+        # Bounded by the boto3 client's timeouts rather than the embed budget
+        if embedding_batcher is not None:
+            return embedding_batcher.embed(text)
+        return embed_texts(bedrock_runtime, [text])[0]
+
+    async def embed_many(self, texts, timeout):
+        return embedding_stage.embed(texts)
+
+    async def chat(self, payload, timeout):
+        return vllm_client.chat(payload, timeout=timeout)
+
+    def stream_chat(self, payload, timeout):
+        return blocking_iterator(vllm_client.stream_chat(payload, timeout=timeout))
+
+    def slot(self, priority, timeout):
+        return BlockingContext(admission.slot(priority, timeout))
+
+    async def coalesce(self, key, fn, timeout):
+        if flights is None:
+            return await fn(), False
+        return flights.do(key, lambda: run_blocking(fn()), timeout=timeout)
+
+    def coalesce_stream(self, key, fn, timeout):
+        if flights is None:
+            return fn(), False
+        source, shared = flights.stream(key, lambda: iterate_blocking(fn()), timeout=timeout)
+        return blocking_iterator(source), shared
+
+    async def map_completed(self, fn, items, parallelism):
+        executor = ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix='batch')
+        try:
+            futures = [executor.submit(lambda item: run_blocking(fn(item)), item) for item in items]
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            # A client that disconnects cancels the questions not started yet
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+pipeline = RagPipeline(BlockingBackend(), embedding_cache=embedding_cache, semantic_cache=semantic_cache,
+                       context_tokenizer=tokenizer_from_env(), admission=admission)
+
+
+def timed_response(timer, route, body, status=200):
+    """JSON response with the request's stage durations in a Server-Timing header"""
+    with timer.stage("serialize"):
+        response = jsonify(body)
+    response.status_code = status
+    response.headers['Server-Timing'] = timer.server_timing()
+    timer.finish(route)
+    return response
+
+
+def respond(timer, reply):
+    """Flask response of a pipeline Reply; streamed lines are generated as the client reads them"""
+    if reply.events is None:
+        response = timed_response(timer, reply.route, reply.body, reply.status)
+    else:
+        # Only the stages before the first line; the rest go to the histograms
+        response = Response(stream_with_context(iterate_blocking(reply.events)), mimetype=reply.media_type,
+                            headers={'Server-Timing': timer.server_timing()})
+    response.headers.update(reply.headers)
+    return response
 
 
 @app.route('/submit_query', methods=['POST'])
 def submit_query():
-    start_time = time.time()
+    timer = StageTimer()
+    timer_token = current_timer.set(timer)
     logger.info("Received submit_query request")
-    
     try:
-        # Get query
-        data = request.json
-        if not data or 'query' not in data:
-            return jsonify({"error": "Missing query parameter"}), 400
-
-        query = data['query']
-        logger.info(f"Processing query: {query[:50]}...")
-        
-        # Generate embeddings
-        embedding = generate_embedding(query)
-        if embedding is None:
-            return jsonify({"error": "Failed to generate embedding"}), 500
-        
-        # Perform vector search
-        similar_docs = vector_search(embedding)
-        if similar_docs is None:
-            return jsonify({"error": "Failed to perform vector search"}), 500
-
-        # Prepare context for LLM with more detailed information
-        context_entries = []
-        for doc in similar_docs:
-            context_entry = (
-                f"Error: {doc['message']}\n"
-                f"Service: {doc['service']}\n"
-                f"Error Code: {doc['error_code']}\n"
-                f"Vehicle: {doc['vehicle_id']} (State: {doc['vehicle_state']})\n"
-                f"Sensor Readings: {json.dumps(doc['sensor_readings'], indent=2)}\n"
-                f"Diagnostic Info: {json.dumps(doc['diagnostic_info'], indent=2)}\n"
-                "---"
-            )
-            context_entries.append(context_entry)
-        
-        context = "\n".join(context_entries)
-
-        # Query vLLM
-        llm_response = query_vllm(query, context)
-        if llm_response is None:
-            return jsonify({"error": "Failed to get response from vLLM"}), 500
-
-        # Prepare the response
-        response = {
-            "query": query,
-            "llm_response": llm_response,
-            "similar_documents": similar_docs[:3],  # Include top 3 similar documents
-            "processing_time": time.time() - start_time
-        }
-
-        return jsonify(response), 200
-
-    except Exception as e:
-        logger.error(f"Error processing query: {e}")
-        return jsonify({"error": str(e)}), 500
+        return respond(timer, run_blocking(pipeline.submit_query(request.get_json(silent=True), request.headers,
+                                                                 timer)))
+    finally:
+        current_timer.reset(timer_token)
+
+
+@app.route('/submit_queries', methods=['POST'])
+def submit_queries():
+    """Many questions in one request: batched embedding and search, answers as NDJSON in completion order"""
+    timer = StageTimer()
+    timer_token = current_timer.set(timer)
+    logger.info("Received submit_queries request")
+    try:
+        return respond(timer, run_blocking(pipeline.submit_queries(request.get_json(silent=True), request.headers,
+                                                                   timer)))
+    finally:
+        current_timer.reset(timer_token)
+
+
+def service_stats():
+    return {
+        "embedding_batcher": embedding_batcher.stats.snapshot() if embedding_batcher else None,
+        "embedding_cache": embedding_cache.stats() if embedding_cache else None,
+        "embedding_stage": embedding_stage.stats(),
+        "semantic_cache": semantic_cache.stats() if semantic_cache else None,
+        "singleflight": flights.snapshot() if flights else None,
+        "vllm_client": vllm_client.stats(),
+        "admission": admission.stats(),
+        "aws_credentials": aws_credentials.stats()
+    }
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus histograms and stats; the JSON stats with ?format=json or Accept: application/json"""
+    if wants_json(request.headers.get('Accept'), request.args):
+        return jsonify(service_stats()), 200
+    body, content_type = metrics_exposition(service_stats)
+    return Response(body, content_type=content_type)
 
 
 @app.route('/health', methods=['GET'])
@@ -0,0 +1,299 @@
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import threading
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+CHAT_COMPLETIONS_PATH = "/v1/chat/completions"
+
+# Failures where vLLM cannot have started generating, so a retry is safe:
+# the connection was never established, or Ray Serve shed the request.
+RETRYABLE_STATUS = {503}
+
+
+def get_vllm_endpoints():
+    """vLLM base URLs from VLLM_ENDPOINTS, or the single VLLM_HOST/VLLM_PORT service"""
+    endpoints = [e.strip().rstrip('/') for e in os.environ.get('VLLM_ENDPOINTS', '').split(',') if e.strip()]
+    if endpoints:
+        return [e if '://' in e else f"http://{e}" for e in endpoints]
+    # Use the full Kubernetes DNS name for the service
+    vllm_host = os.environ.get('VLLM_HOST', 'vllm-llama3-inf2-serve-svc.vllm.svc.cluster.local')
+    vllm_port = os.environ.get('VLLM_PORT', '8000')
+    return [f"http://{vllm_host}:{vllm_port}"]
+
+
+def backoff_delay(attempt, base=0.1, cap=2.0):
+    """Full-jitter exponential backoff"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class VLLMTimeout(Exception):
+    """The total deadline for a vLLM request expired"""
+
+
+class EndpointBalancer:
+    """Least-outstanding-requests choice among vLLM replicas.
+
+    A replica that refused a connection sits out for ``cooldown`` seconds
+    unless every replica is cooling down.
+    """
+
+    def __init__(self, endpoints, cooldown=5.0):
+        self.endpoints = list(endpoints)
+        self.cooldown = cooldown
+        self._cooldown_until = dict.fromkeys(self.endpoints, 0.0)
+        self._lock = threading.Lock()
+        self._outstanding = dict.fromkeys(self.endpoints, 0)
+        self._requests = dict.fromkeys(self.endpoints, 0)
+        self._failures = dict.fromkeys(self.endpoints, 0)
+        self._retries = 0
+
+    def acquire(self, exclude=()):
+        with self._lock:
+            now = time.monotonic()
+            candidates = [e for e in self.endpoints if e not in exclude] or self.endpoints
+            candidates = [e for e in candidates if self._cooldown_until[e] <= now] or candidates
+            fewest = min(self._outstanding[e] for e in candidates)
+            endpoint = random.choice([e for e in candidates if self._outstanding[e] == fewest])
+            self._outstanding[endpoint] += 1
+            self._requests[endpoint] += 1
+            return endpoint
+
+    def release(self, endpoint, failed=False):
+        with self._lock:
+            self._outstanding[endpoint] -= 1
+            if failed:
+                self._failures[endpoint] += 1
+
+    def mark_unavailable(self, endpoint):
+        with self._lock:
+            self._cooldown_until[endpoint] = time.monotonic() + self.cooldown
+
+    def record_retry(self):
+        with self._lock:
+            self._retries += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "retries": self._retries,
+                "endpoints": {
+                    e: {
+                        "outstanding": self._outstanding[e],
+                        "requests": self._requests[e],
+                        "failures": self._failures[e],
+                    } for e in self.endpoints
+                }
+            }
+
+
+class VLLMClient:
+    """Pooled keep-alive client for the vLLM OpenAI-compatible API.
+
+    ``connect_timeout`` bounds connection setup, ``read_timeout`` the gap
+    between bytes, and ``total_timeout`` the whole request including retries
+    and, for streams, the full generation. A ``timeout`` passed with a
+    request shortens ``total_timeout`` for that request.
+    """
+
+    def __init__(self, endpoints=None, pool_size=4, connect_timeout=3.0, read_timeout=60.0,
+                 total_timeout=90.0, max_retries=2):
+        self.balancer = EndpointBalancer(endpoints or get_vllm_endpoints())
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.total_timeout = total_timeout
+        self.max_retries = max_retries
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(self.balancer.endpoints), pool_maxsize=pool_size,
+                              pool_block=True, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _send(self, payload, deadline):
+        tried = []
+        attempt = 0
+        while True:
+            endpoint = self.balancer.acquire(exclude=tried)
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    raise VLLMTimeout("vLLM deadline expired before the request was sent")
+                response = self.session.post(
+                    endpoint + CHAT_COMPLETIONS_PATH,
+                    json=payload,
+                    timeout=(min(self.connect_timeout, remaining), min(self.read_timeout, remaining)),
+                    stream=True
+                )
+                if response.status_code in RETRYABLE_STATUS:
+                    response.close()
+                    raise requests.exceptions.ConnectionError(f"{endpoint} returned {response.status_code}")
+                if response.status_code >= 400:
+                    response.close()
+                    response.raise_for_status()
+                return endpoint, response
+            except (requests.exceptions.ConnectTimeout, requests.exceptions.ConnectionError) as e:
+                self.balancer.release(endpoint, failed=True)
+                self.balancer.mark_unavailable(endpoint)
+                delay = backoff_delay(attempt)
+                if attempt >= self.max_retries or time.monotonic() + delay >= deadline:
+                    raise
+                logger.warning("Retrying vLLM request after %s", e)
+                self.balancer.record_retry()
+                tried.append(endpoint)
+                attempt += 1
+                time.sleep(delay)
+            except Exception:
+                self.balancer.release(endpoint, failed=True)
+                raise
+
+    def _deadline(self, timeout):
+        return time.monotonic() + (self.total_timeout if timeout is None else min(timeout, self.total_timeout))
+
+    def chat(self, payload, timeout=None):
+        """Return the decoded chat completion for a non-streaming request"""
+        deadline = self._deadline(timeout)
+        endpoint, response = self._send(payload, deadline)
+        failed = True
+        try:
+            body = bytearray()
+            for chunk in response.iter_content(chunk_size=65536):
+                body.extend(chunk)
+                if time.monotonic() > deadline:
+                    raise VLLMTimeout("vLLM response exceeded its deadline")
+            failed = False
+            return json.loads(bytes(body))
+        finally:
+            response.close()
+            self.balancer.release(endpoint, failed=failed)
+
+    def stream_chat(self, payload, timeout=None):
+        """Yield raw lines of a streaming chat completion"""
+        deadline = self._deadline(timeout)
+        endpoint, response = self._send(payload, deadline)
+        failed = True
+        try:
+            for line in response.iter_lines():
+                if time.monotonic() > deadline:
+                    raise VLLMTimeout("vLLM stream exceeded its deadline")
+                yield line
+            failed = False
+        finally:
+            response.close()
+            self.balancer.release(endpoint, failed=failed)
+
+    def stats(self):
+        return self.balancer.stats()
+
+
+class AsyncVLLMClient:
+    """asyncio counterpart of VLLMClient on a shared httpx connection pool"""
+
+    def __init__(self, endpoints=None, pool_size=256, connect_timeout=3.0, read_timeout=60.0,
+                 total_timeout=90.0, max_retries=2, transport=None):
+        self.balancer = EndpointBalancer(endpoints or get_vllm_endpoints())
+        self.total_timeout = total_timeout
+        self.max_retries = max_retries
+        self.http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout, pool=total_timeout),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            transport=transport
+        )
+
+    async def _send(self, payload, deadline):
+        tried = []
+        attempt = 0
+        while True:
+            endpoint = self.balancer.acquire(exclude=tried)
+            try:
+                request = self.http_client.build_request('POST', endpoint + CHAT_COMPLETIONS_PATH, json=payload)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise VLLMTimeout("vLLM deadline expired before the request was sent")
+                response = await asyncio.wait_for(self.http_client.send(request, stream=True), remaining)
+                if response.status_code in RETRYABLE_STATUS:
+                    await response.aclose()
+                    raise httpx.ConnectError(f"{endpoint} returned {response.status_code}")
+                if response.is_error:
+                    await response.aread()
+                    await response.aclose()
+                    response.raise_for_status()
+                return endpoint, response
+            except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                self.balancer.release(endpoint, failed=True)
+                self.balancer.mark_unavailable(endpoint)
+                delay = backoff_delay(attempt)
+                if attempt >= self.max_retries or time.monotonic() + delay >= deadline:
+                    raise
+                logger.warning("Retrying vLLM request after %s", e)
+                self.balancer.record_retry()
+                tried.append(endpoint)
+                attempt += 1
+                await asyncio.sleep(delay)
+            except asyncio.TimeoutError:
+                self.balancer.release(endpoint, failed=True)
+                raise VLLMTimeout("vLLM response exceeded its deadline")
+            except Exception:
+                self.balancer.release(endpoint, failed=True)
+                raise
+
+    def _deadline(self, timeout):
+        return time.monotonic() + (self.total_timeout if timeout is None else min(timeout, self.total_timeout))
+
+    async def chat(self, payload, timeout=None):
+        """Return the decoded chat completion for a non-streaming request"""
+        deadline = self._deadline(timeout)
+        endpoint, response = await self._send(payload, deadline)
+        failed = True
+        try:
+            await asyncio.wait_for(response.aread(), max(0.0, deadline - time.monotonic()))
+            failed = False
+            return response.json()
+        except asyncio.TimeoutError:
+            raise VLLMTimeout("vLLM response exceeded its deadline")
+        finally:
+            await response.aclose()
+            self.balancer.release(endpoint, failed=failed)
+
+    async def stream_chat(self, payload, timeout=None):
+        """Yield raw lines of a streaming chat completion"""
+        deadline = self._deadline(timeout)
+        endpoint, response = await self._send(payload, deadline)
+        failed = True
+        try:
+            lines = response.aiter_lines()
+            while True:
+                try:
+                    line = await asyncio.wait_for(lines.__anext__(), max(0.0, deadline - time.monotonic()))
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError:
+                    raise VLLMTimeout("vLLM stream exceeded its deadline")
+                yield line
+            failed = False
+        finally:
+            await response.aclose()
+            self.balancer.release(endpoint, failed=failed)
+
+    async def aclose(self):
+        await self.http_client.aclose()
+
+    def stats(self):
+        return self.balancer.stats()
+
+
+def client_settings_from_env():
+    """Timeout and retry settings shared by both clients"""
+    return {
+        "connect_timeout": float(os.environ.get('VLLM_CONNECT_TIMEOUT', '3')),
+        "read_timeout": float(os.environ.get('VLLM_READ_TIMEOUT', '60')),
+        "total_timeout": float(os.environ.get('VLLM_TOTAL_TIMEOUT', '90')),
+        "max_retries": int(os.environ.get('VLLM_MAX_RETRIES', '2')),
+    }
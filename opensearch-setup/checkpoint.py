@@ -0,0 +1,91 @@
+# checkpoint.py
+import os
+import json
+import time
+import threading
+from collections import deque
+
+class Checkpoint:
+    # Offset of the input below which every log has been indexed, reported as
+    # failed or skipped, saved to path at most every interval seconds.
+    # Logs are started in input order but finish out of order (429 retries
+    # finish late), so the offset is that of the oldest log still in flight.
+    # With parallel_bulk, logs are started from the pool's task thread while
+    # the main thread marks them done and saves, hence the lock.
+    # A log that failed but may succeed when sent again (a 5xx, a transport
+    # error, a 429 out of retries) does not hold the offset back: its offset
+    # is appended to failed_path, for --retry-failed to replay, and counts as done.
+    def __init__(self, path, source, index_name, offset=0, interval=5.0, failed_path=None):
+        self.path = path
+        self.failed_path = failed_path
+        self.failed_offsets = 0
+        self.source = source
+        self.index_name = index_name
+        self.interval = interval
+        self.read = 0
+        self._next = offset
+        self._pending = deque()
+        self._done = set()
+        self._saved = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def offset(self):
+        with self._lock:
+            return self._pending[0] if self._pending else self._next
+
+    def started(self, offset):
+        with self._lock:
+            self.read += 1
+            self._pending.append(offset)
+            self._next = offset + 1
+
+    def done(self, offset):
+        with self._lock:
+            self._done.add(offset)
+            while self._pending and self._pending[0] in self._done:
+                self._done.remove(self._pending.popleft())
+            due = time.monotonic() - self._saved >= self.interval
+        if due:
+            self.save()
+
+    def failed(self, offset):
+        with self._lock:
+            self.failed_offsets += 1
+            if self.failed_path:
+                with open(self.failed_path, 'a') as f:
+                    f.write(f"{offset}\n")
+        self.done(offset)
+
+    def save(self):
+        self._saved = time.monotonic()
+        if not self.path:
+            return
+        state = {"file": os.path.abspath(self.source), "index": self.index_name, "offset": self.offset,
+                 "updated": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())}
+        # Written aside and renamed, so a crash leaves the previous checkpoint whole
+        temporary = f"{self.path}.tmp"
+        with open(temporary, 'w') as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.path)
+
+def load_checkpoint(path, source, index_name):
+    # Offset to resume from, 0 without a checkpoint; a checkpoint of another
+    # file or index is an error rather than a silent restart
+    if not path or not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        state = json.load(f)
+    if state.get('file') != os.path.abspath(source) or state.get('index') != index_name:
+        raise ValueError(f"Checkpoint {path} is for {state.get('file')} into {state.get('index')}, "
+                         f"not {os.path.abspath(source)} into {index_name}")
+    return state['offset']
+
+def load_failed_offsets(path):
+    # Offsets recorded by Checkpoint.failed, in input order, each once
+    if not path or not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return sorted({int(line) for line in f if line.strip()})
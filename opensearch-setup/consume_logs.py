@@ -1,3 +1,5 @@
+import os
+import sys
 import json
 import boto3
 from kafka import KafkaConsumer
@@ -5,6 +7,20 @@ from aws_msk_iam_sasl_signer import MSKAuthTokenProvider
 from opensearchpy import OpenSearch, RequestsHttpConnection
 from requests_aws4auth import AWS4Auth
 
+# embedding_stage.py, embedding_batcher.py and embedding_store.py from eks-rag; bundle them with the function
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'eks-rag'))
+
+from embedding_stage import EmbeddingStage
+from embedding_store import EmbeddingStore
+
+EMBEDDING_MODEL_ID = "cohere.embed-english-v3"
+
+# Embeddings of messages seen before; /tmp survives between invocations of a warm Lambda
+EMBEDDING_STORE_PATH = os.environ.get('EMBEDDING_STORE_PATH', '/tmp/embedding-store.bin')
+
+# Opened once per container: warm invocations reuse its fd, map and key index
+embedding_store = EmbeddingStore(EMBEDDING_STORE_PATH, EMBEDDING_MODEL_ID) if EMBEDDING_STORE_PATH else None
+
 # MSK Cluster ARN; replace with your own ARN
 MSK_CLUSTER_ARN = "arn:aws:kafka:us-west-2:XXXXXXXXXX:cluster/streaming-data-ingestor/e07898e4-zzzz-xxxx-yyyy-293089f2a21f-s2"
 
@@ -78,38 +94,44 @@ def index_messages(messages):
         # Initialize OpenSearch client
         os_client = get_opensearch_client(collection_endpoint)
 
-        for message in messages:
-            log = json.loads(message)
-            embedding = generate_embedding(bedrock, log['message'])
-            if embedding:
-                log['message_embedding'] = embedding
-                try:
-                    os_client.index(
-                        index=index_name,
-                        body=log
-                    )
-                except Exception as e:
-                    print(f"Error indexing log: {e}")
+        # Embed the messages of many logs per Bedrock call, backing off on
+        # throttling; messages already in the store are not sent again
+        stage = EmbeddingStage(lambda texts: embed_texts(bedrock, texts), concurrency=2, store=embedding_store)
+        try:
+            logs = (json.loads(message) for message in messages)
+            for log, vectors in stage.embed_items(logs, lambda log: [log['message']]):
+                if vectors:
+                    log['message_embedding'] = vectors[0]
+                    try:
+                        os_client.index(
+                            index=index_name,
+                            body=log
+                        )
+                    except Exception as e:
+                        print(f"Error indexing log: {e}")
+                else:
+                    print(f"Error generating embedding: {stage.stats()['last_error']}")
+        finally:
+            # A warm container would otherwise keep the threads of every failed invocation
+            stage.close()
+        embed_stats = stage.stats()
+        print(f"Embedded {embed_stats['texts']} of {embed_stats['requested']} messages "
+              f"(dedupe ratio {embed_stats['dedupe_ratio']:.1%}), saving {embed_stats['calls_saved']} Bedrock calls")
     except Exception as e:
         print(f"Error in main: {str(e)}")
         raise
 
-def generate_embedding(bedrock, text):
-    try:
-        response = bedrock.invoke_model(
-            modelId="cohere.embed-english-v3",
-            contentType="application/json",
-            accept="application/json",
-            body=json.dumps({
-                "texts": [text],
-                "input_type": "search_query"
-            })
-        )
-        embedding = json.loads(response['body'].read())['embeddings'][0]
-        return embedding
-    except Exception as e:
-        print(f"Error generating embedding: {e}")
-        return None
+def embed_texts(bedrock, texts):
+    response = bedrock.invoke_model(
+        modelId=EMBEDDING_MODEL_ID,
+        contentType="application/json",
+        accept="application/json",
+        body=json.dumps({
+            "texts": texts,
+            "input_type": "search_query"
+        })
+    )
+    return json.loads(response['body'].read())['embeddings']
 
 def get_opensearch_client(collection_endpoint):
     credentials = boto3.Session().get_credentials()
@@ -1,6 +1,8 @@
 # generate_logs.py
+import gzip
 import json
 import random
+import argparse
 from datetime import datetime, timedelta
 
 # Sample data for generation
@@ -74,23 +76,38 @@ def generate_error_log(timestamp):
         }
     }
 
-def main():
-    logs = []
+def generate_logs(days):
     end_time = datetime.utcnow()
-    start_time = end_time - timedelta(days=7)
-    current_time = start_time
-
-    print("Generating IoT vehicle error logs...")
+    current_time = end_time - timedelta(days=days)
     while current_time < end_time:
         if random.random() < 0.1:  # 10% chance of error in each minute
-            logs.append(generate_error_log(current_time))
+            yield generate_error_log(current_time)
         current_time += timedelta(minutes=1)
 
-    print(f"Generated {len(logs)} error logs")
-    
-    with open('error_logs.json', 'w') as f:
-        json.dump(logs, f, indent=2)
-    print("Logs saved to error_logs.json")
+def main():
+    parser = argparse.ArgumentParser(description="Generate IoT vehicle error logs")
+    # .ndjson/.jsonl (optionally .gz) files get one log per line, written as
+    # they are generated; anything else a JSON array
+    parser.add_argument('--output', default='error_logs.json')
+    parser.add_argument('--days', type=float, default=7)
+    args = parser.parse_args()
+
+    print("Generating IoT vehicle error logs...")
+    output = args.output
+    if output.endswith(('.ndjson', '.jsonl', '.ndjson.gz', '.jsonl.gz')):
+        count = 0
+        with (gzip.open(output, 'wt') if output.endswith('.gz') else open(output, 'w')) as f:
+            for log in generate_logs(args.days):
+                f.write(json.dumps(log) + "\n")
+                count += 1
+    else:
+        logs = list(generate_logs(args.days))
+        count = len(logs)
+        with open(output, 'w') as f:
+            json.dump(logs, f, indent=2)
+
+    print(f"Generated {count} error logs")
+    print(f"Logs saved to {output}")
 
 if __name__ == "__main__":
     main()
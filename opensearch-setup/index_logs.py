@@ -1,9 +1,29 @@
 # index_logs.py
+import os
+import sys
 import json
+import time
+import hashlib
+import argparse
+from collections import deque
+
 import boto3
-from opensearchpy import OpenSearch, RequestsHttpConnection
+from opensearchpy import OpenSearch, RequestsHttpConnection, helpers
 from requests_aws4auth import AWS4Auth
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'eks-rag'))
+
+from embedding_stage import EmbeddingStage, MAX_EMBED_BATCH
+from embedding_store import EmbeddingStore
+from log_reader import read_logs
+from checkpoint import Checkpoint, load_checkpoint, load_failed_offsets
+
+EMBEDDING_MODEL_ID = "cohere.embed-english-v3"
+
+# Request body limit of the smaller OpenSearch Service instance types; a log with its two
+# 1024-d vectors is ~40KB of JSON, so this also caps a chunk at ~250 logs
+DEFAULT_MAX_CHUNK_BYTES = 10 * 1024 * 1024
+
 def get_opensearch_client(collection_endpoint):
     credentials = boto3.Session().get_credentials()
     region = 'us-west-2'
@@ -27,6 +47,10 @@ def get_opensearch_client(collection_endpoint):
     
     return client
 
+def get_local_opensearch_client(url):
+    # Unsigned client for a self-managed cluster or the benchmark stand-in
+    return OpenSearch(hosts=[url], timeout=60)
+
 def create_index_mapping(client, index_name):
     mapping = {
         "mappings": {
@@ -95,22 +119,21 @@ def create_index_mapping(client, index_name):
     client.indices.create(index=index_name, body=mapping)
     print(f"Created index mapping for {index_name}")
 
-def generate_embedding(bedrock, text):
-    try:
-        response = bedrock.invoke_model(
-            modelId="cohere.embed-english-v3",
-            contentType="application/json",
-            accept="application/json",
-            body=json.dumps({
-                "texts": [text],
-                "input_type": "search_query"
-            })
-        )
-        embedding = json.loads(response['body'].read())['embeddings'][0]
-        return embedding
-    except Exception as e:
-        print(f"Error generating embedding: {e}")
-        return None
+def embed_texts(bedrock, texts):
+    response = bedrock.invoke_model(
+        modelId=EMBEDDING_MODEL_ID,
+        contentType="application/json",
+        accept="application/json",
+        body=json.dumps({
+            "texts": texts,
+            "input_type": "search_query"
+        })
+    )
+    return json.loads(response['body'].read())['embeddings']
+
+def log_texts(log):
+    # The texts embedded for a log: its message and its diagnostic info
+    return [log['message'], prepare_diagnostic_text(log['diagnostic_info'])]
 
 def prepare_diagnostic_text(diagnostic_info):
     dtc_codes = ' '.join(diagnostic_info.get('dtc_codes', []))
@@ -139,6 +162,149 @@ def get_collection_endpoint(client, collection_name):
     print(f"Found endpoint: {endpoint}")
     return endpoint.replace('https://', '')
 
+def describe_log(log):
+    return f"{log.get('timestamp')} {log.get('vehicle_id')} {log.get('error_code')}"
+
+def document_id(log):
+    # Same log, same id: re-indexing it overwrites the document instead of adding a copy
+    key = f"{log.get('vehicle_id')}|{log.get('timestamp')}|{log.get('error_code')}"
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]
+
+def track_logs(records, checkpoint):
+    for offset, log in records:
+        checkpoint.started(offset)
+        yield offset, log
+
+def build_actions(records, stage, index_name, skipped, checkpoint=None, ids=False):
+    # Bulk index actions for the (offset, log) records with their embeddings,
+    # in input order; the descriptions of logs whose embeddings failed are
+    # appended to skipped and their offsets recorded as failed in the
+    # checkpoint. _offset is not sent, only the action metadata and _source are
+    for (offset, log), vectors in stage.embed_items(records, lambda record: log_texts(record[1])):
+        if vectors:
+            log['message_embedding'], log['diagnostic_embedding'] = vectors
+            action = {"_index": index_name, "_source": log, "_offset": offset}
+            if ids:
+                action["_id"] = document_id(log)
+            yield action
+        else:
+            skipped.append(describe_log(log))
+            if checkpoint is not None:
+                checkpoint.failed(offset)
+
+class BulkProgress:
+    # Documents/sec meter, printed at most every interval seconds
+    def __init__(self, interval=5.0):
+        self.interval = interval
+        self.started = time.monotonic()
+        self.last_report = self.started
+        self.indexed = 0
+        self.failed = 0
+        self.retried = 0
+
+    def update(self, ok):
+        if ok:
+            self.indexed += 1
+        else:
+            self.failed += 1
+        now = time.monotonic()
+        if now - self.last_report >= self.interval:
+            self.last_report = now
+            print(self.line())
+
+    def rate(self):
+        elapsed = time.monotonic() - self.started
+        return self.indexed / elapsed if elapsed > 0 else 0.0
+
+    def line(self):
+        return (f"Indexed {self.indexed} documents ({self.rate():.1f} docs/s), "
+                f"{self.failed} failed, {self.retried} retried after 429")
+
+def permanent_failure(item):
+    # A 4xx such as a mapping error fails the same way when sent again; a 5xx,
+    # a timeout, a 429 out of retries or a request that never reached the
+    # cluster (status 'N/A' or a transport error's) may not
+    status = item.get('status')
+    return isinstance(status, int) and 400 <= status < 500 and status not in (408, 429)
+
+def bulk_pass(client, actions, threads=1, chunk_size=500, max_chunk_bytes=DEFAULT_MAX_CHUNK_BYTES):
+    # (action, ok, item) for every action, in order. Both helpers yield one
+    # result per action in the order the actions were consumed, so the
+    # actions in flight are kept in a queue and matched to their results.
+    sent = deque()
+
+    def track(actions):
+        for action in actions:
+            sent.append(action)
+            yield action
+
+    options = {
+        "chunk_size": chunk_size,
+        "max_chunk_bytes": max_chunk_bytes,
+        # Report failed documents and failed requests per item instead of raising
+        "raise_on_error": False,
+        "raise_on_exception": False,
+    }
+    if threads > 1:
+        results = helpers.parallel_bulk(client, track(actions), thread_count=threads, queue_size=threads, **options)
+    else:
+        results = helpers.streaming_bulk(client, track(actions), **options)
+    for ok, info in results:
+        _, item = info.popitem()
+        yield sent.popleft(), ok, item
+
+def bulk_index(client, actions, threads=1, chunk_size=500, max_chunk_bytes=DEFAULT_MAX_CHUNK_BYTES,
+               max_retries=5, initial_backoff=2.0, max_backoff=60.0, progress=None, checkpoint=None, attempt=0):
+    # Index the actions with streaming_bulk, or parallel_bulk with threads > 1.
+    # Documents rejected with 429 are set aside and, once chunk_size of them
+    # or the end of the actions is reached, sent again after an exponential
+    # backoff, up to max_retries times. The pause also slows the stream down
+    # while the cluster is overloaded, and only the rejected documents are
+    # held. Each document indexed, or failed for good, is marked done in the
+    # checkpoint; one that failed in transport or on the cluster is recorded
+    # as failed, for --retry-failed to send again, so it does not hold the
+    # checkpoint back. Returns the (log description, item) of every failure.
+    progress = progress or BulkProgress()
+    failures = []
+    rejected = []
+
+    def retry():
+        delay = min(max_backoff, initial_backoff * 2 ** attempt)
+        print(f"Retrying {len(rejected)} documents rejected with 429 in {delay:.1f}s...")
+        time.sleep(delay)
+        failures.extend(bulk_index(client, list(rejected), threads, chunk_size, max_chunk_bytes,
+                                   max_retries, initial_backoff, max_backoff, progress, checkpoint, attempt + 1))
+        rejected.clear()
+
+    for action, ok, item in bulk_pass(client, actions, threads, chunk_size, max_chunk_bytes):
+        if not ok and item.get('status') == 429 and attempt < max_retries:
+            rejected.append(action)
+            progress.retried += 1
+            if len(rejected) >= chunk_size:
+                retry()
+            continue
+        progress.update(ok)
+        if not ok:
+            failures.append((describe_log(action['_source']), item))
+        if checkpoint is None:
+            continue
+        if ok or permanent_failure(item):
+            checkpoint.done(action['_offset'])
+        else:
+            checkpoint.failed(action['_offset'])
+    if rejected:
+        retry()
+    return failures
+
+def report_failures(failures, limit=20):
+    for description, item in failures[:limit]:
+        error = item.get('error')
+        if isinstance(error, dict):
+            error = f"{error.get('type')}: {error.get('reason')}"
+        print(f"Failed to index log {description}: status {item.get('status')} {error}")
+    if len(failures) > limit:
+        print(f"... and {len(failures) - limit} more failures")
+
 def delete_index_if_exists(client, index_name):
     try:
         if client.indices.exists(index=index_name):
@@ -148,65 +314,175 @@ def delete_index_if_exists(client, index_name):
     except Exception as e:
         print(f"Error deleting index: {e}")
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Embed the error logs and bulk index them into OpenSearch")
+    parser.add_argument('--file', default='error_logs.json', help='JSON array, NDJSON or gzip\'d NDJSON of logs')
+    parser.add_argument('--index', default='error-logs-mock')
+    parser.add_argument('--collection', default='error-logs-mock')
+    # A self-managed cluster or local stand-in instead of the serverless collection
+    parser.add_argument('--opensearch-url', default=os.environ.get('OPENSEARCH_URL'))
+    parser.add_argument('--bedrock-endpoint-url', default=os.environ.get('BEDROCK_ENDPOINT_URL'))
+    parser.add_argument('--embed-batch-size', type=int, default=MAX_EMBED_BATCH, help='most texts per Bedrock call')
+    parser.add_argument('--embed-concurrency', type=int, default=4, help='Bedrock calls in flight')
+    parser.add_argument('--embed-rate', type=float, default=10.0,
+                        help='most Bedrock calls per second, halved on every ThrottlingException')
+    parser.add_argument('--embedding-store', default='embedding_store.bin',
+                        help='file of the embeddings of texts seen before, kept across runs; empty to disable')
+    parser.add_argument('--chunk-size', type=int, default=500, help='most documents per bulk request')
+    parser.add_argument('--max-chunk-bytes', type=int, default=DEFAULT_MAX_CHUNK_BYTES,
+                        help='most bytes per bulk request')
+    parser.add_argument('--threads', type=int, default=1, help='bulk requests in flight; >1 uses parallel_bulk')
+    parser.add_argument('--max-retries', type=int, default=5, help='times a document rejected with 429 is resent')
+    parser.add_argument('--initial-backoff', type=float, default=2.0)
+    parser.add_argument('--max-backoff', type=float, default=60.0)
+    parser.add_argument('--progress-interval', type=float, default=5.0, help='seconds between progress lines')
+    parser.add_argument('--checkpoint', help='file of the input offset indexed so far (default FILE.checkpoint); '
+                                             'empty to disable')
+    rerun = parser.add_mutually_exclusive_group()
+    rerun.add_argument('--resume', action='store_true',
+                       help='keep the index and continue from the checkpoint instead of starting over')
+    rerun.add_argument('--retry-failed', action='store_true',
+                       help='keep the index and send again only the logs recorded in CHECKPOINT.failed')
+    # Serverless vector search collections do not accept document ids, so auto
+    # only sets them on a self-managed cluster (--opensearch-url)
+    parser.add_argument('--document-ids', choices=['auto', 'on', 'off'], default='auto',
+                        help='index each log under an id derived from vehicle, timestamp and error code')
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
+    checkpoint = None
+    store = stage = None
     try:
         # Initialize clients
-        bedrock = boto3.client('bedrock-runtime', region_name='us-west-2')
-        opensearch_client = boto3.client('opensearchserverless')
-        collection_name = 'error-logs-mock'
+        bedrock = boto3.client('bedrock-runtime', region_name='us-west-2', endpoint_url=args.bedrock_endpoint_url)
+        if args.opensearch_url:
+            os_client = get_local_opensearch_client(args.opensearch_url)
+        else:
+            opensearch_client = boto3.client('opensearchserverless')
+            # Get collection endpoint
+            collection_endpoint = get_collection_endpoint(opensearch_client, args.collection)
+            # Initialize OpenSearch client
+            os_client = get_opensearch_client(collection_endpoint)
         
-        # Get collection endpoint
-        collection_endpoint = get_collection_endpoint(opensearch_client, collection_name)
-        
-        # Initialize OpenSearch client
-        os_client = get_opensearch_client(collection_endpoint)
-        
-        # Delete existing index if it exists
-        index_name = 'error-logs-mock'
-        delete_index_if_exists(os_client, index_name)
-        
-        # Create new index with correct mapping
-        print(f"Creating new index {index_name} with updated mapping...")
-        create_index_mapping(os_client, index_name)
+        # Message and diagnostic embeddings of several logs per Bedrock call,
+        # in concurrent calls held under --embed-rate. Texts already in the
+        # embedding store, or repeated within the run, are not sent again
+        store = EmbeddingStore(args.embedding_store, EMBEDDING_MODEL_ID) if args.embedding_store else None
+        stage = EmbeddingStage(
+            lambda texts: embed_texts(bedrock, texts),
+            batch_size=args.embed_batch_size,
+            concurrency=args.embed_concurrency,
+            rate=args.embed_rate,
+            store=store
+        )
         
-        # Load error logs
-        with open('error_logs.json', 'r') as f:
-            logs = json.load(f)
+        index_name = args.index
+        checkpoint_path = f"{args.file}.checkpoint" if args.checkpoint is None else args.checkpoint
+        # Offsets of the logs that failed but may succeed when sent again
+        failed_path = f"{checkpoint_path}.failed" if checkpoint_path else None
+        ids = args.document_ids == 'on' or (args.document_ids == 'auto' and bool(args.opensearch_url))
+        if (args.resume or args.retry_failed) and not ids:
+            print("Warning: document ids are off (the default for a serverless collection), so logs indexed after "
+                  "the last checkpoint, or indexed although their request failed, are indexed again as duplicates")
+        replay = None
+        if args.retry_failed:
+            if not failed_path:
+                raise ValueError("--retry-failed needs a checkpoint")
+            # Only the failed logs are embedded and sent; the failures of this
+            # run replace the list once it completes
+            replay = set(load_failed_offsets(failed_path))
+            start = min(replay, default=0)
+            print(f"Retrying {len(replay)} failed logs of {args.file}...")
+        elif args.resume:
+            # Logs before the checkpoint are skipped without being embedded;
+            # with document ids, the ones after it that were indexed before
+            # the interruption are overwritten rather than duplicated
+            start = load_checkpoint(checkpoint_path, args.file, index_name)
+            print(f"Resuming {args.file} at offset {start}...")
+        else:
+            start = 0
+            # Delete existing index if it exists
+            delete_index_if_exists(os_client, index_name)
+            if failed_path and os.path.exists(failed_path):
+                os.remove(failed_path)
+
+        if not os_client.indices.exists(index=index_name):
+            # Create new index with correct mapping
+            print(f"Creating new index {index_name} with updated mapping...")
+            create_index_mapping(os_client, index_name)
+
+        # Stream the error logs from a JSON array, NDJSON or gzip'd NDJSON file,
+        # so only the logs being embedded and indexed are held in memory
+        logs = read_logs(args.file, start=start)
+        if replay is None:
+            checkpoint = Checkpoint(checkpoint_path, args.file, index_name, start, interval=args.progress_interval,
+                                    failed_path=failed_path)
+        else:
+            logs = ((offset, log) for offset, log in logs if offset in replay)
+            replay_path = f"{failed_path}.retry"
+            if os.path.exists(replay_path):
+                os.remove(replay_path)
+            checkpoint = Checkpoint(None, args.file, index_name, interval=args.progress_interval,
+                                    failed_path=replay_path)
+        records = track_logs(logs, checkpoint)
         
-        # Index logs with embeddings
+        # Index logs with embeddings, in bulk requests of at most
+        # --chunk-size documents and --max-chunk-bytes bytes
         print("Indexing logs with embeddings...")
-        successful_indexes = 0
-        
-        for log in logs:
-            # Generate embeddings for message and diagnostic info
-            message_embedding = generate_embedding(bedrock, log['message'])
-            diagnostic_text = prepare_diagnostic_text(log['diagnostic_info'])
-            diagnostic_embedding = generate_embedding(bedrock, diagnostic_text)
-            
-            if message_embedding and diagnostic_embedding:
-                log['message_embedding'] = message_embedding
-                log['diagnostic_embedding'] = diagnostic_embedding
-                try:
-                    os_client.index(
-                        index=index_name,
-                        body=log
-                    )
-                    successful_indexes += 1
-                    if successful_indexes % 10 == 0:
-                        print(f"Successfully indexed {successful_indexes} documents...")
-                except Exception as e:
-                    print(f"Error indexing log: {e}")
+        skipped = []
+        progress = BulkProgress(args.progress_interval)
+        failures = bulk_index(
+            os_client,
+            build_actions(records, stage, index_name, skipped, checkpoint, ids),
+            threads=args.threads,
+            chunk_size=args.chunk_size,
+            max_chunk_bytes=args.max_chunk_bytes,
+            max_retries=args.max_retries,
+            initial_backoff=args.initial_backoff,
+            max_backoff=args.max_backoff,
+            progress=progress,
+            checkpoint=checkpoint
+        )
+        checkpoint.save()
+        print(progress.line())
+        report_failures(failures)
+        if replay is not None:
+            if os.path.exists(checkpoint.failed_path):
+                os.replace(checkpoint.failed_path, failed_path)
+            elif os.path.exists(failed_path):
+                os.remove(failed_path)
+        if checkpoint.failed_offsets:
+            print(f"Recorded {checkpoint.failed_offsets} failed logs in {failed_path or 'no file (no checkpoint)'}; "
+                  f"rerun with --retry-failed to send them again")
+        embed_stats = stage.stats()
+        if skipped:
+            print(f"Skipped {len(skipped)} logs whose embeddings could not be generated: {embed_stats['last_error']}")
+        print(f"Embedded {embed_stats['texts']} texts in {embed_stats['calls']} Bedrock calls, "
+              f"{embed_stats['throttles']} throttled")
+        print(f"Reused {embed_stats['store_hits']} stored and {embed_stats['deduplicated']} repeated texts of "
+              f"{embed_stats['requested']} (dedupe ratio {embed_stats['dedupe_ratio']:.1%}), "
+              f"saving {embed_stats['calls_saved']} Bedrock calls")
         
-        print(f"\nIndexing complete. Successfully indexed {successful_indexes} out of {len(logs)} logs")
+        print(f"\nIndexing complete. Successfully indexed {progress.indexed} out of {checkpoint.read} logs")
 
         # Verify the index was created with correct mapping
         print("\nVerifying index mapping:")
         mapping = os_client.indices.get_mapping(index=index_name)
         print(json.dumps(mapping, indent=2))
 
-    except Exception as e:
+    except BaseException as e:
+        # Keep what was acknowledged so far for --resume
+        if checkpoint is not None and checkpoint.path:
+            checkpoint.save()
+            print(f"Checkpoint saved at offset {checkpoint.offset}; rerun with --resume to continue")
         print(f"Error in main: {str(e)}")
         raise
+    finally:
+        if stage is not None:
+            stage.close()
+        if store is not None:
+            store.close()
 
 if __name__ == "__main__":
     main()
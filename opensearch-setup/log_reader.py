@@ -0,0 +1,115 @@
+# log_reader.py
+import io
+import gzip
+import json
+
+GZIP_MAGIC = b'\x1f\x8b'
+UTF8_BOM = b'\xef\xbb\xbf'
+READ_SIZE = 1 << 16
+
+def open_binary(path):
+    # Binary stream of a plain or gzip'd file, recognised by its first bytes;
+    # both support peek() to sniff the format without consuming anything
+    with open(path, 'rb') as raw:
+        compressed = raw.peek(2)[:2] == GZIP_MAGIC
+    return gzip.open(path, 'rb') if compressed else open(path, 'rb')
+
+def iter_ndjson(stream, skipped=None, start=0):
+    # (offset, log) for each non-blank line from offset start on, counting
+    # lines without parsing them up to there; lines that do not parse are
+    # reported and appended to skipped
+    offset = 0
+    for line_number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        offset += 1
+        if offset <= start:
+            continue
+        try:
+            yield offset - 1, json.loads(line)
+        except json.JSONDecodeError as e:
+            print(f"Skipping line {line_number}: {e}")
+            if skipped is not None:
+                skipped.append(line_number)
+
+def iter_json_array(stream, read_size=READ_SIZE, start=0):
+    # (offset, element) of a top-level JSON array from offset start on,
+    # decoded one at a time from a buffer holding at most the element being
+    # read plus one read
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    offset = 0
+    # What comes next: the opening bracket, the first element or the closing
+    # bracket, an element, or the comma or closing bracket after one
+    expect = '['
+    eof = False
+    while True:
+        while position < len(buffer) and buffer[position].isspace():
+            position += 1
+        if position == len(buffer):
+            if eof:
+                if expect == '[':
+                    return
+                raise ValueError("JSON array is not terminated")
+            buffer, position, eof = _read_more(stream, read_size, buffer, position)
+            continue
+        char = buffer[position]
+        if expect == '[':
+            if char != '[':
+                raise ValueError(f"Expected '[' but found {char!r}")
+            position += 1
+            expect = 'first'
+            continue
+        if expect == 'separator' or (expect == 'first' and char == ']'):
+            if char == ']':
+                return
+            if char != ',':
+                raise ValueError(f"Expected ',' or ']' after element {offset - 1} but found {char!r}")
+            position += 1
+            expect = 'element'
+            continue
+        try:
+            value, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            # An element cut by the end of the buffer fails to decode until it is complete
+            if eof:
+                raise
+            buffer, position, eof = _read_more(stream, read_size, buffer, position)
+            continue
+        if not eof and _number_may_continue(value, buffer, end):
+            buffer, position, eof = _read_more(stream, read_size, buffer, position)
+            continue
+        if offset >= start:
+            yield offset, value
+        offset += 1
+        position = end
+        expect = 'separator'
+
+def _read_more(stream, read_size, buffer, position):
+    chunk = stream.read(read_size)
+    return buffer[position:] + chunk, 0, not chunk
+
+def _number_may_continue(value, buffer, end):
+    # "1" decoded from a buffer ending in "1" or "1." may be the start of
+    # 1.5 or 1e3: wait for the character that ends the number
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return False
+    return end == len(buffer) or buffer[end] in '.eE+-0123456789'
+
+def read_logs(path, skipped=None, start=0):
+    # (offset, log) of a JSON array, NDJSON or gzip'd NDJSON file, one at a
+    # time; the offset is the log's position in the file, the element or the
+    # non-blank line, and reading starts at offset start
+    with open_binary(path) as raw:
+        # A byte order mark would hide the bracket of an array from the sniffing
+        head = raw.peek(READ_SIZE)
+        if head.startswith(UTF8_BOM):
+            head = head[len(UTF8_BOM):]
+        array = head.lstrip()[:1] == b'['
+        stream = io.TextIOWrapper(raw, encoding='utf-8-sig')
+        if array:
+            yield from iter_json_array(stream, start=start)
+        else:
+            yield from iter_ndjson(stream, skipped, start)
@@ -48,6 +48,11 @@ docsearch = OpenSearchVectorSearch.from_documents(
     timeout=CONNECTION_TIMEOUT
 )
 
+# One system message for every request, so vLLM can reuse its KV cache
+# blocks across requests; what varies goes in the user message after it
+SYSTEM_MESSAGE = "You are an AI assistant that can answer both general questions and questions about SkyWing Airways. For questions about SkyWing Airways, use only the information provided in the context, and clearly state if the context does not contain it. For general questions not related to SkyWing Airways, provide answers based on your general knowledge."
+NO_CONTEXT = "No SkyWing Airways documents matched this question."
+
 class ChatCompletionRequest(BaseModel):
     messages: List[dict]
     model: str
@@ -62,7 +67,8 @@ def get_context(query: str, limit: int = 3, similarity_threshold: float = 0.7) -
     )
     
     contexts = []
-    for hit in search_results:
+    # Fixed order, so the same passages always produce the same prompt bytes
+    for hit in sorted(search_results, key=lambda hit: str(hit.id)):
         contexts.append(f"{hit.payload['text']}")
     
     return "\n\n".join(contexts) if contexts else ""
@@ -75,17 +81,12 @@ async def chat_completions(request: ChatCompletionRequest):
         context = get_context(user_query)
         logger.info(f"Retrieved context: {context}")
 
-        if context:
-            system_message = "You are an AI assistant that provides information about SkyWing Airways based on the given context. For questions about SkyWing Airways, use only the information provided in the context. For general questions not related to SkyWing Airways, provide answers based on your general knowledge."
-            prompt = f"Context about SkyWing Airways:\n{context}\n\nHuman: {user_query}\n\nAssistant: I'll answer the question based on the context if it's about SkyWing Airways, or use my general knowledge for other topics."
-        else:
-            system_message = "You are an AI assistant that can answer both general questions and questions about SkyWing Airways. For SkyWing Airways questions, clearly state if you don't have specific information. For general questions, use your broad knowledge to provide accurate answers."
-            prompt = f"Human: {user_query}\n\nAssistant: I'll answer your question to the best of my ability. If it's about SkyWing Airways and I don't have specific information, I'll let you know."
+        prompt = f"Context about SkyWing Airways:\n{context or NO_CONTEXT}\n\nHuman: {user_query}"
 
         vllm_request = {
             "model": request.model,
             "messages": [
-                {"role": "system", "content": system_message},
+                {"role": "system", "content": SYSTEM_MESSAGE},
                 {"role": "user", "content": prompt}
             ]
         }
@@ -0,0 +1,8 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The services and the ingestion scripts are flat modules run from their own directories
+for directory in ('eks-rag', 'opensearch-setup'):
+    sys.path.insert(0, os.path.join(ROOT, directory))
@@ -0,0 +1,115 @@
+import time
+import asyncio
+import threading
+
+import pytest
+
+from admission import AdmissionController, AsyncAdmissionController, Overloaded, request_priority
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(0.005)
+
+
+def test_waiters_are_served_by_priority_then_arrival():
+    controller = AdmissionController(1, max_wait=30.0, service_time=0.01)
+    served = []
+
+    def request(name, priority):
+        with controller.slot(priority):
+            served.append(name)
+
+    holder = controller.slot("interactive")
+    holder.__enter__()
+    threads = []
+    for name, priority in [("canary", "canary"), ("batch-1", "batch"), ("interactive", "interactive"),
+                           ("batch-2", "batch")]:
+        thread = threading.Thread(target=request, args=(name, priority))
+        thread.start()
+        threads.append(thread)
+        # Queue them one at a time so the arrival order is known
+        wait_until(lambda: sum(controller.queued.values()) == len(threads))
+    holder.__exit__(None, None, None)
+    for thread in threads:
+        thread.join(5)
+    assert served == ["interactive", "batch-1", "batch-2", "canary"]
+    stats = controller.stats()
+    assert stats["outstanding"] == 0
+    assert stats["admitted"] == {"interactive": 2, "batch": 2, "canary": 1}
+
+
+def test_check_rejects_with_retry_after_when_the_queue_is_too_long():
+    controller = AdmissionController(1, max_wait=1.0, service_time=5.0)
+    controller.check("interactive")
+    with controller.slot("interactive"):
+        with pytest.raises(Overloaded) as raised:
+            controller.check("interactive")
+        # One service time to wait, one second allowed
+        assert raised.value.retry_after == 4
+        with pytest.raises(Overloaded):
+            with controller.slot("batch"):
+                pass
+    assert controller.stats()["rejected"]["interactive"] == 1
+    assert controller.stats()["rejected"]["batch"] == 1
+
+
+def test_deadline_tightens_the_bound():
+    controller = AdmissionController(1, max_wait=60.0, service_time=5.0)
+    with controller.slot():
+        controller.check("interactive", timeout=10.0)
+        with pytest.raises(Overloaded):
+            controller.check("interactive", timeout=2.0)
+
+
+def test_waiter_that_times_out_gets_retry_after_and_leaves_the_queue():
+    controller = AdmissionController(1, max_wait=0.05, service_time=0.01)
+    with controller.slot():
+        with pytest.raises(Overloaded) as raised:
+            with controller.slot("batch"):
+                pass
+        assert raised.value.retry_after >= 1
+    stats = controller.stats()
+    assert stats["queue_depth"] == 0
+    assert stats["outstanding"] == 0
+    with controller.slot():
+        pass
+
+
+def test_zero_capacity_admits_everything():
+    controller = AdmissionController(0)
+    with controller.slot(), controller.slot():
+        controller.check("canary")
+        assert controller.stats()["outstanding"] == 2
+        assert controller.stats()["load"] == 0.0
+
+
+def test_async_waiters_are_served_by_priority():
+    async def run():
+        controller = AsyncAdmissionController(1, max_wait=30.0, service_time=0.01)
+        served = []
+
+        async def request(name, priority):
+            async with controller.slot(priority):
+                served.append(name)
+
+        holder = controller.slot("interactive")
+        await holder.__aenter__()
+        tasks = []
+        for name, priority in [("canary", "canary"), ("batch", "batch"), ("interactive", "interactive")]:
+            tasks.append(asyncio.ensure_future(request(name, priority)))
+            await asyncio.sleep(0)
+        await holder.__aexit__(None, None, None)
+        await asyncio.gather(*tasks)
+        return served
+
+    assert asyncio.run(run()) == ["interactive", "batch", "canary"]
+
+
+def test_request_priority():
+    assert request_priority({}, {}) == "interactive"
+    assert request_priority({"X-Request-Priority": "Canary"}, {}) == "canary"
+    assert request_priority({"X-Request-Priority": "canary"}, {"priority": "batch"}) == "batch"
+    assert request_priority({}, {"priority": "urgent"}) == "interactive"
@@ -0,0 +1,160 @@
+import types
+import datetime
+
+import pytest
+import requests
+from botocore.credentials import ReadOnlyCredentials
+
+import aws_auth
+from aws_auth import CachedAWS4Auth, CachedCredentialProvider
+
+
+class FakeCredentials:
+    """botocore credentials whose keys change with every ``rotate``"""
+
+    def __init__(self, expiry=None):
+        self.generation = 0
+        self._expiry_time = expiry
+
+    def rotate(self, expiry):
+        self.generation += 1
+        self._expiry_time = expiry
+
+    def get_frozen_credentials(self):
+        n = self.generation
+        return ReadOnlyCredentials(f"AKIA{n}", f"secret-{n}", f"token-{n}" if self._expiry_time else None)
+
+
+class FakeSession:
+    def __init__(self, credentials):
+        self.credentials = credentials
+        self.calls = 0
+
+    def get_credentials(self):
+        self.calls += 1
+        return self.credentials
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def time(self):
+        return self.now
+
+    def at(self, offset):
+        return datetime.datetime.fromtimestamp(self.now + offset, datetime.timezone.utc)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(aws_auth, 'time', types.SimpleNamespace(time=clock.time, sleep=lambda seconds: None))
+    return clock
+
+
+def provider_of(credentials, **kwargs):
+    kwargs.setdefault('background_refresh', False)
+    return CachedCredentialProvider(FakeSession(credentials), **kwargs)
+
+
+def test_static_credentials_are_resolved_once(clock):
+    provider = provider_of(FakeCredentials())
+    assert provider.get() == ReadOnlyCredentials("AKIA0", "secret-0", None)
+    clock.now += 10 ** 7
+    assert provider.get().access_key == "AKIA0"
+    assert provider.session.calls == 1
+    stats = provider.stats()
+    assert stats["resolves"] == 1 and stats["refreshes"] == 1 and stats["expires_in_s"] is None
+
+
+def test_temporary_credentials_are_reused_until_close_to_expiry(clock):
+    credentials = FakeCredentials(expiry=clock.at(3600))
+    provider = provider_of(credentials, min_validity=60)
+    assert provider.get().access_key == "AKIA0"
+    credentials.rotate(clock.at(7200))
+    # botocore has new keys, but the frozen ones still have an hour left
+    clock.now += 3000
+    assert provider.get().access_key == "AKIA0"
+    assert provider.stats()["expires_in_s"] == 600
+
+
+def test_inline_refresh_within_min_validity_of_expiry(clock):
+    credentials = FakeCredentials(expiry=clock.at(3600))
+    provider = provider_of(credentials, min_validity=60)
+    provider.get()
+    credentials.rotate(clock.at(7200))
+    clock.now += 3550
+    assert provider.get().access_key == "AKIA1"
+    stats = provider.stats()
+    assert stats["inline_refreshes"] == 1 and stats["refreshes"] == 2 and stats["resolves"] == 1
+    assert stats["expires_in_s"] == 3650
+
+
+def test_missing_credentials_raise(clock):
+    provider = CachedCredentialProvider(FakeSession(None), background_refresh=False)
+    with pytest.raises(RuntimeError):
+        provider.get()
+
+
+def test_background_refresh_replaces_credentials_before_expiry(clock, monkeypatch):
+    credentials = FakeCredentials(expiry=clock.at(3600))
+    provider = provider_of(credentials, refresh_margin=300)
+    provider.get()
+    credentials.rotate(clock.at(7200))
+
+    def sleep(seconds):
+        # The loop sleeps until the refresh margin, refreshes, then stops here on its next sleep
+        if provider.stats()["refreshes"] > 1:
+            raise SystemExit
+        clock.now += seconds
+
+    monkeypatch.setattr(aws_auth, 'time', types.SimpleNamespace(time=clock.time, sleep=sleep))
+    with pytest.raises(SystemExit):
+        provider._refresh_loop()
+    assert provider.get().access_key == "AKIA1"
+    assert provider.stats()["inline_refreshes"] == 0
+
+
+def signed(auth, url="https://search.example.com/logs/_search"):
+    return auth(requests.Request('POST', url, data=b'{}').prepare())
+
+
+@pytest.fixture
+def utc_now(monkeypatch):
+    now = [datetime.datetime(2024, 5, 1, 23, 59, 58, tzinfo=datetime.timezone.utc)]
+    fake = types.SimpleNamespace(datetime=types.SimpleNamespace(now=lambda tz: now[0]), timezone=datetime.timezone)
+    monkeypatch.setattr(aws_auth, 'datetime', fake)
+    return now
+
+
+def test_signing_key_is_reused_across_requests(clock, utc_now):
+    auth = CachedAWS4Auth(provider_of(FakeCredentials(expiry=clock.at(3600))), "us-west-2", "es")
+    first = signed(auth)
+    second = signed(auth)
+    assert auth.signers_built == 1
+    assert first.headers['x-amz-date'] == "20240501T235958Z"
+    assert first.headers['x-amz-security-token'] == "token-0"
+    assert "Credential=AKIA0/20240501/us-west-2/es/aws4_request" in second.headers['Authorization']
+
+
+def test_signing_key_is_rebuilt_when_the_date_rolls_over(clock, utc_now):
+    auth = CachedAWS4Auth(provider_of(FakeCredentials()), "us-west-2", "es")
+    signed(auth)
+    utc_now[0] += datetime.timedelta(seconds=5)
+    request = signed(auth)
+    assert auth.signers_built == 2
+    assert request.headers['x-amz-date'] == "20240502T000003Z"
+    assert "/20240502/us-west-2/es/aws4_request" in request.headers['Authorization']
+
+
+def test_signing_key_is_rebuilt_when_the_credentials_rotate(clock, utc_now):
+    credentials = FakeCredentials(expiry=clock.at(3600))
+    auth = CachedAWS4Auth(provider_of(credentials, min_validity=60), "us-west-2", "es")
+    signed(auth)
+    credentials.rotate(clock.at(7200))
+    clock.now += 3590
+    request = signed(auth)
+    assert auth.signers_built == 2
+    assert "Credential=AKIA1/" in request.headers['Authorization']
+    assert request.headers['x-amz-security-token'] == "token-1"
@@ -0,0 +1,111 @@
+import json
+import types
+import threading
+
+import pytest
+from opensearchpy.serializer import JSONSerializer
+
+import index_logs
+
+
+class FakeBulkClient:
+    """client.bulk that rejects documents with 429 the first ``rejections[vehicle_id]`` times they are sent"""
+
+    transport = types.SimpleNamespace(serializer=JSONSerializer())
+
+    def __init__(self, rejections=None, statuses=None):
+        self.rejections = dict(rejections or {})
+        self.statuses = statuses or {}
+        self.requests = []
+        self.indexed = []
+        self._lock = threading.Lock()
+
+    def bulk(self, body=None, *args, **kwargs):
+        lines = [json.loads(line) for line in body.splitlines() if line.strip()]
+        items = []
+        with self._lock:
+            self.requests.append(len(lines) // 2)
+            for action, source in zip(lines[::2], lines[1::2]):
+                vehicle = source["vehicle_id"]
+                status = self.statuses.get(vehicle, 201)
+                if self.rejections.get(vehicle, 0) > 0:
+                    self.rejections[vehicle] -= 1
+                    status = 429
+                item = {"_index": action["index"]["_index"], "status": status}
+                if status == 201:
+                    self.indexed.append(vehicle)
+                else:
+                    item["error"] = {"type": "es_rejected_execution_exception", "reason": "queue full"}
+                items.append({"index": item})
+        return {"took": 1, "errors": any(item["index"]["status"] != 201 for item in items), "items": items}
+
+
+def actions(count):
+    return [{"_index": "logs", "_source": {"vehicle_id": f"V-{n}", "timestamp": n, "error_code": "E"}, "_offset": n}
+            for n in range(count)]
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    delays = []
+    monkeypatch.setattr(index_logs, 'time', types.SimpleNamespace(sleep=delays.append,
+                                                                  monotonic=index_logs.time.monotonic))
+    return delays
+
+
+@pytest.mark.parametrize("threads", [1, 3])
+def test_every_document_is_indexed_in_order(threads):
+    client = FakeBulkClient()
+    results = list(index_logs.bulk_pass(client, iter(actions(25)), threads=threads, chunk_size=4))
+    assert [action["_offset"] for action, _, _ in results] == list(range(25))
+    assert all(ok for _, ok, _ in results)
+    assert max(client.requests) == 4
+    assert sorted(client.indexed) == sorted(f"V-{n}" for n in range(25))
+
+
+def test_rejected_documents_are_retried_with_backoff(sleeps):
+    client = FakeBulkClient(rejections={"V-3": 2, "V-7": 1})
+    progress = index_logs.BulkProgress(3600)
+    failures = index_logs.bulk_index(client, iter(actions(10)), chunk_size=5, initial_backoff=1.0,
+                                     progress=progress)
+    assert failures == []
+    assert sorted(client.indexed) == sorted(f"V-{n}" for n in range(10))
+    # V-3 and V-7 are sent again together, then V-3 alone after twice the wait
+    assert sleeps == [1.0, 2.0]
+    assert progress.indexed == 10 and progress.retried == 3 and progress.failed == 0
+
+
+def test_retry_starts_once_chunk_size_documents_are_rejected(sleeps):
+    client = FakeBulkClient(rejections={f"V-{n}": 1 for n in range(4)})
+    index_logs.bulk_index(client, iter(actions(12)), chunk_size=4, initial_backoff=1.0,
+                          progress=index_logs.BulkProgress(3600))
+    # The first chunk is rejected whole and resent before the rest of the input is read
+    assert client.requests[:3] == [4, 4, 4]
+    assert client.indexed[:4] == ["V-0", "V-1", "V-2", "V-3"]
+    assert sleeps == [1.0]
+
+
+def test_backoff_is_capped(sleeps):
+    client = FakeBulkClient(rejections={"V-0": 5})
+    index_logs.bulk_index(client, iter(actions(1)), initial_backoff=2.0, max_backoff=5.0, max_retries=5,
+                          progress=index_logs.BulkProgress(3600))
+    assert sleeps == [2.0, 4.0, 5.0, 5.0, 5.0]
+    assert client.indexed == ["V-0"]
+
+
+def test_documents_rejected_after_every_retry_fail(sleeps):
+    client = FakeBulkClient(rejections={"V-1": 10})
+    progress = index_logs.BulkProgress(3600)
+    failures = index_logs.bulk_index(client, iter(actions(3)), max_retries=2, initial_backoff=1.0,
+                                     progress=progress)
+    assert [(description.split()[1], item["status"]) for description, item in failures] == [("V-1", 429)]
+    assert sleeps == [1.0, 2.0]
+    assert progress.indexed == 2 and progress.failed == 1 and progress.retried == 2
+
+
+def test_other_errors_are_not_retried(sleeps):
+    client = FakeBulkClient(statuses={"V-0": 400})
+    failures = index_logs.bulk_index(client, iter(actions(2)), progress=index_logs.BulkProgress(3600))
+    assert [item["status"] for _, item in failures] == [400]
+    assert sleeps == []
+    assert client.requests == [2]
@@ -0,0 +1,153 @@
+import json
+
+import pytest
+
+import index_logs
+from checkpoint import Checkpoint, load_checkpoint, load_failed_offsets
+
+
+def started(checkpoint, offsets):
+    for offset in offsets:
+        checkpoint.started(offset)
+
+
+def test_offset_waits_for_the_oldest_log_in_flight():
+    checkpoint = Checkpoint(None, 'logs.json', 'logs', interval=3600)
+    started(checkpoint, range(5))
+    checkpoint.done(2)
+    checkpoint.done(1)
+    assert checkpoint.offset == 0
+    checkpoint.done(0)
+    assert checkpoint.offset == 3
+    checkpoint.done(4)
+    assert checkpoint.offset == 3
+    checkpoint.done(3)
+    assert checkpoint.offset == 5
+    assert checkpoint.read == 5
+
+
+def test_offset_without_logs_in_flight_is_the_next_one():
+    checkpoint = Checkpoint(None, 'logs.json', 'logs', offset=7)
+    assert checkpoint.offset == 7
+    started(checkpoint, [7, 8])
+    assert checkpoint.offset == 7
+
+
+def test_resume_offset_round_trips(tmp_path):
+    path = str(tmp_path / 'logs.json.checkpoint')
+    source = str(tmp_path / 'logs.json')
+    checkpoint = Checkpoint(path, source, 'logs', offset=10, interval=3600)
+    started(checkpoint, range(10, 14))
+    for offset in (10, 11, 13):
+        checkpoint.done(offset)
+    checkpoint.save()
+    assert load_checkpoint(path, source, 'logs') == 12
+    with open(path) as f:
+        assert json.load(f)["offset"] == 12
+    assert not (tmp_path / 'logs.json.checkpoint.tmp').exists()
+
+
+def test_missing_checkpoint_starts_at_zero(tmp_path):
+    assert load_checkpoint(str(tmp_path / 'none'), 'logs.json', 'logs') == 0
+    assert load_checkpoint(None, 'logs.json', 'logs') == 0
+
+
+def test_checkpoint_of_another_index_is_refused(tmp_path):
+    path = str(tmp_path / 'checkpoint')
+    Checkpoint(path, 'logs.json', 'logs').save()
+    with pytest.raises(ValueError):
+        load_checkpoint(path, 'logs.json', 'other-logs')
+    with pytest.raises(ValueError):
+        load_checkpoint(path, 'other.json', 'logs')
+
+
+def fake_bulk_pass(monkeypatch, results):
+    def bulk_pass(client, actions, *args):
+        for action, (ok, item) in zip(actions, results):
+            yield action, ok, item
+
+    monkeypatch.setattr(index_logs, 'bulk_pass', bulk_pass)
+
+
+def tracked(actions, checkpoint):
+    for action in actions:
+        checkpoint.started(action["_offset"])
+        yield action
+
+
+def test_failed_offsets_are_recorded_and_do_not_hold_the_offset_back(tmp_path):
+    failed_path = str(tmp_path / 'checkpoint.failed')
+    checkpoint = Checkpoint(None, 'logs.json', 'logs', interval=3600, failed_path=failed_path)
+    started(checkpoint, range(4))
+    checkpoint.failed(1)
+    checkpoint.done(0)
+    assert checkpoint.offset == 2
+    checkpoint.failed(3)
+    checkpoint.done(2)
+    assert checkpoint.offset == 4
+    assert checkpoint.failed_offsets == 2
+    assert load_failed_offsets(failed_path) == [1, 3]
+
+
+def test_failed_offsets_of_several_runs_are_read_once_in_order(tmp_path):
+    failed_path = tmp_path / 'checkpoint.failed'
+    failed_path.write_text("7\n2\n7\n\n4\n")
+    assert load_failed_offsets(str(failed_path)) == [2, 4, 7]
+    assert load_failed_offsets(str(tmp_path / 'none')) == []
+    assert load_failed_offsets(None) == []
+
+
+def test_bulk_index_records_retryable_failures(monkeypatch, tmp_path):
+    results = [
+        (True, {"status": 201}),
+        (False, {"status": 400, "error": {"type": "mapper_parsing_exception"}}),
+        (False, {"status": 503, "error": "unavailable"}),
+        (False, {"status": 'N/A', "error": "ConnectionError"}),
+        (True, {"status": 201}),
+    ]
+    actions = [{"_source": {"vehicle_id": f"V-{offset}"}, "_offset": offset} for offset in range(len(results))]
+    fake_bulk_pass(monkeypatch, results)
+    failed_path = str(tmp_path / 'checkpoint.failed')
+    checkpoint = Checkpoint(None, 'logs.json', 'logs', interval=3600, failed_path=failed_path)
+    started(checkpoint, range(len(results)))
+    failures = index_logs.bulk_index(None, actions, checkpoint=checkpoint, progress=index_logs.BulkProgress(3600))
+    assert [item["status"] for _, item in failures] == [400, 503, 'N/A']
+    # 1 is rejected for good; 2 and 3 may succeed when sent again
+    assert checkpoint.offset == len(results)
+    assert load_failed_offsets(failed_path) == [2, 3]
+
+
+def test_one_failed_document_does_not_stall_the_checkpoint(monkeypatch, tmp_path):
+    count = 1000
+    results = [(False, {"status": 429, "error": "too many requests"}) if offset == 10 else (True, {"status": 201})
+               for offset in range(count)]
+    actions = [{"_source": {"vehicle_id": f"V-{offset}"}, "_offset": offset} for offset in range(count)]
+    fake_bulk_pass(monkeypatch, results)
+    path = str(tmp_path / 'logs.json.checkpoint')
+    checkpoint = Checkpoint(path, 'logs.json', 'logs', interval=3600, failed_path=f"{path}.failed")
+    failures = index_logs.bulk_index(None, tracked(actions, checkpoint), checkpoint=checkpoint, max_retries=0,
+                                     progress=index_logs.BulkProgress(3600))
+    assert len(failures) == 1
+    # Nothing is held for the offsets after the failed one
+    assert checkpoint.offset == count
+    assert not checkpoint._pending and not checkpoint._done
+    checkpoint.save()
+    assert load_checkpoint(path, 'logs.json', 'logs') == count
+    assert load_failed_offsets(f"{path}.failed") == [10]
+
+
+def test_logs_whose_embeddings_failed_are_recorded(tmp_path):
+    class FailingStage:
+        def embed_items(self, records, texts_of):
+            for record in records:
+                yield record, None if record[0] == 1 else [[0.0], [1.0]]
+
+    failed_path = str(tmp_path / 'checkpoint.failed')
+    checkpoint = Checkpoint(None, 'logs.json', 'logs', interval=3600, failed_path=failed_path)
+    logs = [(offset, {"vehicle_id": f"V-{offset}", "message": "m", "diagnostic_info": {}}) for offset in range(3)]
+    skipped = []
+    actions = list(index_logs.build_actions(index_logs.track_logs(logs, checkpoint), FailingStage(), 'logs',
+                                            skipped, checkpoint))
+    assert [action["_offset"] for action in actions] == [0, 2]
+    assert len(skipped) == 1
+    assert load_failed_offsets(failed_path) == [1]
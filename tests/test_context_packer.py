@@ -0,0 +1,49 @@
+from context_packer import ByteEstimateTokenizer, TABLE_HEADER, pack_context, render_context
+
+
+def document(doc_id, score, message="Battery voltage low", error_code="P1234"):
+    return {
+        "doc_id": doc_id, "score": score, "message": message, "error_code": error_code, "service": "battery",
+        "vehicle_id": f"V-{doc_id}", "vehicle_state": "driving",
+        "sensor_readings": {"battery_voltage": 11.6, "engine_temp": 92.5},
+        "diagnostic_info": {"dtc_codes": ["P1234"], "system_status": "warning",
+                            "last_maintenance": "2024-01-15T00:00:00"},
+    }
+
+
+def characters(text):
+    return len(text)
+
+
+def test_no_documents():
+    assert pack_context([], 100) == ("No matching error logs were found.", [])
+
+
+def test_lowest_scores_are_dropped():
+    docs = [document(1, 0.5), document(2, 0.9), document(3, 0.7)]
+    budget = len(render_context([docs[1], docs[2]]))
+    context, packed = pack_context(docs, budget, characters)
+    assert [doc["doc_id"] for doc in packed] == [2, 3]
+    assert len(context) <= budget
+
+
+def test_everything_fits():
+    docs = [document(1, 0.5), document(2, 0.9)]
+    context, packed = pack_context(docs, 10000)
+    assert len(packed) == 2
+    assert ByteEstimateTokenizer()(context) <= 10000
+
+
+def test_first_document_over_budget_is_truncated():
+    docs = [document(1, 0.9, message="x" * 500), document(2, 0.5)]
+    budget = len(TABLE_HEADER) + 40
+    context, packed = pack_context(docs, budget, characters)
+    assert [doc["doc_id"] for doc in packed] == [1]
+    assert context.startswith(TABLE_HEADER + "\n[P1234] battery: xxx")
+    assert len(context) == budget
+
+
+def test_budget_smaller_than_the_header_still_returns_text():
+    context, packed = pack_context([document(1, 0.9)], 10, characters)
+    assert context == TABLE_HEADER[:10]
+    assert len(packed) == 1
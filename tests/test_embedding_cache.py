@@ -0,0 +1,167 @@
+import os
+import types
+import fcntl
+import threading
+import multiprocessing
+
+import pytest
+
+import embedding_cache
+from embedding_cache import EmbeddingCache, cache_from_env, normalize_query
+
+MODEL = "cohere.embed-english-v3"
+DIMENSION = 4
+
+
+def vector(seed):
+    return [float(seed), seed + 0.5, -float(seed), 0.25]
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(embedding_cache, 'time', types.SimpleNamespace(time=clock.time))
+    return clock
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "cache.bin")
+
+
+def open_cache(path, **kwargs):
+    kwargs.setdefault('dimension', DIMENSION)
+    return EmbeddingCache(path, **kwargs)
+
+
+def test_get_and_put(path, clock):
+    cache = open_cache(path)
+    assert cache.get("engine overheating", MODEL) is None
+    cache.put("engine overheating", MODEL, vector(1))
+    assert cache.get("engine overheating", MODEL) == vector(1)
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 1 and stats["inserts"] == 1 and stats["entries"] == 1
+    assert stats["hit_rate"] == 0.5
+
+
+def test_key_ignores_case_and_whitespace_but_not_the_model(path, clock):
+    assert normalize_query("  Engine\tOVERHEATING \n") == "engine overheating"
+    cache = open_cache(path)
+    cache.put("Engine overheating", MODEL, vector(1))
+    assert cache.get(" engine   OVERHEATING", MODEL) == vector(1)
+    assert cache.get("engine overheating", "amazon.titan-embed-text-v2") is None
+
+
+def test_expired_entry_is_a_miss(path, clock):
+    cache = open_cache(path, ttl=60)
+    cache.put("q", MODEL, vector(1))
+    clock.now += 61
+    assert cache.get("q", MODEL) is None
+    stats = cache.stats()
+    assert stats["expirations"] == 1 and stats["entries"] == 0
+
+
+def test_full_set_replaces_its_least_recently_used_entry(path, clock):
+    # One set of two ways, so every key competes for the same slots
+    cache = open_cache(path, max_entries=2, ways=2)
+    cache.put("a", MODEL, vector(1))
+    clock.now += 1
+    cache.put("b", MODEL, vector(2))
+    clock.now += 1
+    assert cache.get("a", MODEL) == vector(1)
+    clock.now += 1
+    cache.put("c", MODEL, vector(3))
+    assert cache.get("b", MODEL) is None
+    assert cache.get("a", MODEL) == vector(1)
+    assert cache.get("c", MODEL) == vector(3)
+    stats = cache.stats()
+    assert stats["evictions"] == 1 and stats["entries"] == 2 and stats["capacity"] == 2
+
+
+def test_replacing_an_expired_entry_counts_as_expiration(path, clock):
+    cache = open_cache(path, max_entries=1, ways=1, ttl=60)
+    cache.put("a", MODEL, vector(1))
+    clock.now += 61
+    cache.put("b", MODEL, vector(2))
+    stats = cache.stats()
+    assert stats["expirations"] == 1 and stats["evictions"] == 0
+
+
+def test_put_of_a_cached_text_updates_it_in_place(path, clock):
+    cache = open_cache(path, max_entries=2, ways=2)
+    cache.put("a", MODEL, vector(1))
+    cache.put("a", MODEL, vector(5))
+    assert cache.get("a", MODEL) == vector(5)
+    assert cache.stats()["entries"] == 1
+
+
+def test_entries_and_counters_survive_a_reopen(path, clock):
+    cache = open_cache(path)
+    cache.put("a", MODEL, vector(1))
+    cache.get("a", MODEL)
+    reopened = open_cache(path)
+    assert reopened.get("a", MODEL) == vector(1)
+    assert reopened.stats()["hits"] == 2
+
+
+def test_file_of_another_layout_starts_empty(path, clock):
+    open_cache(path).put("a", MODEL, vector(1))
+    wider = open_cache(path, dimension=8)
+    assert wider.get("a", MODEL) is None
+    assert wider.stats()["inserts"] == 0
+
+
+def test_updates_wait_for_the_file_lock(path, clock):
+    cache = open_cache(path)
+    fd = os.open(path, os.O_RDWR)
+    fcntl.flock(fd, fcntl.LOCK_EX)
+    writer = threading.Thread(target=cache.put, args=("a", MODEL, vector(1)))
+    writer.start()
+    writer.join(0.2)
+    assert writer.is_alive()
+    fcntl.flock(fd, fcntl.LOCK_UN)
+    os.close(fd)
+    writer.join(5)
+    assert cache.get("a", MODEL) == vector(1)
+
+
+def hammer(path, worker):
+    cache = open_cache(path, max_entries=64)
+    for n in range(200):
+        cache.put(f"worker {worker} query {n}", MODEL, vector(n))
+        cache.get(f"worker {worker} query {n}", MODEL)
+
+
+def test_processes_share_entries_and_counters(path):
+    open_cache(path, max_entries=64)
+    context = multiprocessing.get_context('fork')
+    workers = [context.Process(target=hammer, args=(path, worker)) for worker in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(30)
+    assert [worker.exitcode for worker in workers] == [0] * 4
+    stats = open_cache(path, max_entries=64).stats()
+    # No counter update is lost between processes
+    assert stats["inserts"] == 800
+    assert stats["hits"] + stats["misses"] == 800
+    assert stats["entries"] == 64 and stats["evictions"] == 800 - 64
+
+
+def test_cache_from_env(monkeypatch, tmp_path):
+    monkeypatch.setenv('EMBEDDING_CACHE_ENTRIES', '0')
+    assert cache_from_env() is None
+    monkeypatch.setenv('EMBEDDING_CACHE_ENTRIES', '16')
+    monkeypatch.setenv('EMBEDDING_CACHE_PATH', str(tmp_path / "env.bin"))
+    monkeypatch.setenv('EMBEDDING_CACHE_TTL', '30')
+    cache = cache_from_env(dimension=DIMENSION)
+    assert cache.path == str(tmp_path / "env.bin")
+    assert cache.ttl == 30.0 and cache.stats()["capacity"] == 16
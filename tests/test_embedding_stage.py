@@ -0,0 +1,188 @@
+import time
+import threading
+
+import pytest
+from botocore.exceptions import ClientError
+
+from embedding_stage import EmbeddingStage, TokenBucket, is_throttle
+from embedding_store import EmbeddingStore
+
+
+def throttle():
+    return ClientError({"Error": {"Code": "ThrottlingException", "Message": "Rate exceeded"}}, "InvokeModel")
+
+
+def vectors_of(texts):
+    return [[float(len(text)), float(ord(text[0]))] for text in texts]
+
+
+class FakeBedrock:
+    """embed_batch recording its calls, optionally throttling the first ones or delaying some texts"""
+
+    def __init__(self, throttles=0, delays=None):
+        self.calls = []
+        self.throttles = throttles
+        self.delays = delays or {}
+        self._lock = threading.Lock()
+
+    def __call__(self, texts):
+        with self._lock:
+            self.calls.append(list(texts))
+            throttled = self.throttles > 0
+            self.throttles -= 1
+        if throttled:
+            raise throttle()
+        time.sleep(max((self.delays.get(text, 0) for text in texts), default=0))
+        return vectors_of(texts)
+
+
+@pytest.fixture
+def stage_of():
+    stages = []
+
+    def make(embed_batch, **kwargs):
+        kwargs.setdefault('rate', 1000.0)
+        kwargs.setdefault('initial_backoff', 0.001)
+        stages.append(EmbeddingStage(embed_batch, **kwargs))
+        return stages[-1]
+
+    yield make
+    for stage in stages:
+        stage.close()
+
+
+def test_is_throttle():
+    assert is_throttle(throttle())
+    assert not is_throttle(ClientError({"Error": {"Code": "ValidationException"}}, "InvokeModel"))
+    assert not is_throttle(ValueError("no response"))
+
+
+def test_token_bucket_limits_the_rate():
+    bucket = TokenBucket(rate=50, burst=1)
+    started = time.monotonic()
+    for _ in range(6):
+        bucket.acquire()
+    # The first token is there at once, the other five arrive 20ms apart
+    assert time.monotonic() - started >= 0.09
+
+
+def test_token_bucket_halves_on_throttling_and_recovers():
+    bucket = TokenBucket(rate=8, min_rate=1, increase=0.5)
+    bucket.throttled()
+    bucket.throttled()
+    assert bucket.rate == 2
+    for _ in range(3):
+        bucket.throttled()
+    assert bucket.rate == 1
+    for _ in range(20):
+        bucket.succeeded()
+    assert bucket.rate == 8
+
+
+def test_embed_returns_vectors_in_order(stage_of):
+    texts = [f"text {n}" for n in range(10)]
+    # The first chunk finishes last
+    bedrock = FakeBedrock(delays={"text 0": 0.05})
+    stage = stage_of(bedrock, batch_size=3, concurrency=4)
+    assert stage.embed(texts) == vectors_of(texts)
+    assert sorted(map(len, bedrock.calls)) == [1, 3, 3, 3]
+    stats = stage.stats()
+    assert stats["calls"] == 4 and stats["texts"] == 10 and stats["requested"] == 10
+
+
+def test_throttled_call_is_retried(stage_of):
+    bedrock = FakeBedrock(throttles=2)
+    stage = stage_of(bedrock, max_retries=3)
+    assert stage.embed(["a", "b"]) == vectors_of(["a", "b"])
+    assert len(bedrock.calls) == 3
+    stats = stage.stats()
+    assert stats["throttles"] == 2 and stats["errors"] == 0
+    assert stats["rate_limit"] < 1000.0
+
+
+def test_throttling_beyond_the_retries_fails(stage_of):
+    stage = stage_of(FakeBedrock(throttles=5), max_retries=2)
+    with pytest.raises(ClientError):
+        stage.embed(["a"])
+    stats = stage.stats()
+    assert stats["throttles"] == 2 and stats["errors"] == 1
+    assert stats["last_error"].startswith("ClientError")
+
+
+def test_other_errors_are_not_retried(stage_of):
+    calls = []
+
+    def failing(texts):
+        calls.append(texts)
+        raise ValueError("malformed input")
+
+    stage = stage_of(failing)
+    with pytest.raises(ValueError):
+        stage.embed(["a"])
+    assert len(calls) == 1
+
+
+def test_embed_items_keeps_input_order_and_sends_repeats_once(stage_of):
+    bedrock = FakeBedrock(delays={"slow": 0.05})
+    stage = stage_of(bedrock, batch_size=2, concurrency=3)
+    items = [["slow"], ["b", "c"], ["b"], ["d"], ["c", "e"]]
+    results = list(stage.embed_items(iter(items), lambda item: item))
+    assert [item for item, _ in results] == items
+    assert [vectors for _, vectors in results] == [vectors_of(item) for item in items]
+    assert sorted(text for call in bedrock.calls for text in call) == ["b", "c", "d", "e", "slow"]
+    assert stage.stats()["deduplicated"] == 2
+
+
+def test_embed_items_reports_failed_items(stage_of):
+    def embed_batch(texts):
+        if "bad" in texts:
+            raise ValueError("malformed input")
+        return vectors_of(texts)
+
+    stage = stage_of(embed_batch, batch_size=1)
+    results = list(stage.embed_items(iter([["good"], ["bad"], ["fine"]]), lambda item: item))
+    assert [vectors for _, vectors in results] == [vectors_of(["good"]), None, vectors_of(["fine"])]
+
+
+def test_embed_items_uses_the_store(stage_of, tmp_path):
+    store = EmbeddingStore(str(tmp_path / "store.bin"), "model", dimension=2)
+    first = FakeBedrock()
+    list(stage_of(first, store=store).embed_items(iter([["a"], ["b"]]), lambda item: item))
+    second = FakeBedrock()
+    stage = stage_of(second, store=store)
+    results = list(stage.embed_items(iter([["a"], ["b"], ["c"]]), lambda item: item))
+    assert [vectors for _, vectors in results] == [vectors_of([text]) for text in "abc"]
+    assert second.calls == [["c"]]
+    assert stage.stats()["store_hits"] == 2
+    store.close()
+
+
+def test_requested_is_counted_across_threads(stage_of):
+    stage = stage_of(lambda texts: vectors_of(texts))
+    threads = [threading.Thread(target=lambda: [stage.embed(["a"]) for _ in range(200)]) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert stage.stats()["requested"] == 800
+
+
+def test_close_drops_batches_not_started(stage_of):
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def blocking(texts):
+        calls.append(texts)
+        started.set()
+        release.wait(5)
+        return vectors_of(texts)
+
+    stage = stage_of(blocking, batch_size=1, concurrency=1)
+    worker = threading.Thread(target=lambda: pytest.raises(Exception, stage.embed, ["a", "b", "c"]))
+    worker.start()
+    assert started.wait(5)
+    stage.close()
+    release.set()
+    worker.join(5)
+    assert calls == [["a"]]
@@ -0,0 +1,102 @@
+import os
+
+import pytest
+
+from embedding_store import HEADER_BYTES, EmbeddingStore
+
+MODEL = "cohere.embed-english-v3"
+DIMENSION = 4
+
+
+def vector(seed):
+    return [float(seed), seed + 0.5, -float(seed), 0.25]
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "store.bin")
+
+
+def open_store(path, dimension=DIMENSION):
+    return EmbeddingStore(path, MODEL, dimension=dimension)
+
+
+def test_get_and_put(path):
+    store = open_store(path)
+    assert store.get("engine overheating") is None
+    store.put_many(["engine overheating", "GPS signal lost"], [vector(1), vector(2)])
+    assert store.get("engine overheating") == vector(1)
+    assert store.get("GPS signal lost") == vector(2)
+    assert store.stats() == {"entries": 2, "hits": 2, "misses": 1, "inserts": 2}
+    store.close()
+
+
+def test_texts_are_stored_once(path):
+    store = open_store(path)
+    store.put_many(["a", "b", "a"], [vector(1), vector(2), vector(3)])
+    store.put_many(["b", "c"], [vector(4), vector(5)])
+    assert len(store) == 3
+    assert store.get("a") == vector(1)
+    assert store.get("b") == vector(2)
+    assert os.path.getsize(path) == HEADER_BYTES + 3 * store.record_dtype.itemsize
+    store.close()
+
+
+def test_key_covers_the_model(path):
+    store = open_store(path)
+    store.put_many(["a"], [vector(1)])
+    other = EmbeddingStore(path, "amazon.titan-embed-text-v2", dimension=DIMENSION)
+    assert other.get("a") is None
+    store.close()
+    other.close()
+
+
+def test_reopened_store_keeps_its_records(path):
+    store = open_store(path)
+    store.put_many(["a", "b"], [vector(1), vector(2)])
+    store.close()
+    reopened = open_store(path)
+    assert len(reopened) == 2
+    assert reopened.get("b") == vector(2)
+    reopened.put_many(["c"], [vector(3)])
+    assert reopened.get("c") == vector(3)
+    reopened.close()
+
+
+def test_torn_record_is_dropped_on_open(path):
+    store = open_store(path)
+    store.put_many(["a", "b"], [vector(1), vector(2)])
+    store.close()
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) - 3)
+    reopened = open_store(path)
+    assert len(reopened) == 1
+    assert reopened.get("a") == vector(1)
+    assert reopened.get("b") is None
+    assert os.path.getsize(path) == HEADER_BYTES + reopened.record_dtype.itemsize
+    reopened.close()
+
+
+def test_store_of_another_dimension_starts_empty(path):
+    store = open_store(path)
+    store.put_many(["a"], [vector(1)])
+    store.close()
+    wider = open_store(path, dimension=8)
+    assert len(wider) == 0
+    assert wider.get("a") is None
+    wider.close()
+
+
+def test_shared_file_keeps_the_appends_of_both_stores(path):
+    first = open_store(path)
+    second = open_store(path)
+    first.put_many(["a"], [vector(1)])
+    second.put_many(["b"], [vector(2)])
+    # Each sees its own records; the other's show up when the file is reopened
+    assert first.get("a") == vector(1) and second.get("b") == vector(2)
+    first.close()
+    second.close()
+    reopened = open_store(path)
+    assert reopened.get("a") == vector(1)
+    assert reopened.get("b") == vector(2)
+    reopened.close()
@@ -0,0 +1,52 @@
+import pytest
+
+from hybrid_search import RRF_RANK_CONSTANT, fuse_msearch_response, reciprocal_rank_fusion
+
+
+def fuse(ranked_ids, weights=(1.0, 1.0)):
+    ids, scores = reciprocal_rank_fusion(ranked_ids, list(weights))
+    return list(ids), list(scores)
+
+
+def test_documents_in_both_lists_rank_first():
+    ids, scores = fuse([["a", "b", "c"], ["c", "d"]])
+    assert ids[0] == "c"
+    assert scores[0] == pytest.approx(1 / (RRF_RANK_CONSTANT + 3) + 1 / (RRF_RANK_CONSTANT + 1))
+    assert sorted(ids) == ["a", "b", "c", "d"]
+
+
+def test_ties_keep_ids_in_sorted_order():
+    # Rank 1 in one list each, with equal weights
+    ids, scores = fuse([["b"], ["a"]])
+    assert ids == ["a", "b"]
+    assert scores[0] == scores[1]
+    assert fuse([["b"], ["a"]]) == fuse([["b"], ["a"]])
+
+
+def test_duplicate_ids_in_a_list_count_once_at_their_best_rank():
+    ids, scores = fuse([["a", "b", "a"], []])
+    assert ids == ["a", "b"]
+    assert scores == pytest.approx([1 / (RRF_RANK_CONSTANT + 1), 1 / (RRF_RANK_CONSTANT + 2)])
+
+
+def test_weights_scale_each_list():
+    ids, scores = fuse([["a"], ["b"]], weights=(0.25, 0.75))
+    assert ids == ["b", "a"]
+    assert scores == pytest.approx([0.75 / (RRF_RANK_CONSTANT + 1), 0.25 / (RRF_RANK_CONSTANT + 1)])
+    ids, _ = fuse([["a", "b"], ["b", "a"]], weights=(1.0, 0.0))
+    assert ids == ["a", "b"]
+
+
+def test_no_hits():
+    assert fuse([[], []]) == ([], [])
+
+
+def test_failed_sub_search_leaves_the_other():
+    response = {"responses": [
+        {"error": {"type": "search_phase_execution_exception"}},
+        {"hits": {"hits": [{"_id": "x", "_source": {"message": "m"}}, {"_id": "y", "_source": {}}]}},
+    ]}
+    fused = fuse_msearch_response(response, k=1)
+    assert fused["hits"]["total"]["value"] == 2
+    assert [hit["_id"] for hit in fused["hits"]["hits"]] == ["x"]
+    assert fused["hits"]["hits"][0]["_source"] == {"message": "m"}
@@ -0,0 +1,84 @@
+import io
+import gzip
+import json
+
+import pytest
+
+from log_reader import iter_json_array, read_logs
+
+READ_SIZES = range(1, 8)
+
+ARRAYS = [
+    '[]',
+    ' [ ] ',
+    '[1.5]',
+    '["ab", 1.5e3]',
+    '[-12, 0.25, 1E-2, 3e+4, 7]',
+    '[true, false, null, "x"]',
+    '[{"vehicle_id": "V-1", "voltage": 11.75}, {"nested": [1, [2.5, {}]]}]',
+    '[\n  {"a": 1},\n  {"b": "]"}\n]\n',
+]
+
+
+def read(text, read_size, start=0):
+    return list(iter_json_array(io.StringIO(text), read_size=read_size, start=start))
+
+
+@pytest.mark.parametrize('read_size', READ_SIZES)
+@pytest.mark.parametrize('text', ARRAYS)
+def test_elements_match_json_loads(text, read_size):
+    assert read(text, read_size) == list(enumerate(json.loads(text)))
+
+
+@pytest.mark.parametrize('read_size', READ_SIZES)
+def test_start_skips_elements_but_keeps_offsets(read_size):
+    assert read('[10, 20.5, {"c": 3}]', read_size, start=1) == [(1, 20.5), (2, {"c": 3})]
+
+
+@pytest.mark.parametrize('read_size', READ_SIZES)
+@pytest.mark.parametrize('text', ['[1, 2', '[1.5', '[{"a": 1}', '[{"a": ', '["ab', '[', '[1,'])
+def test_truncated_input_raises(text, read_size):
+    with pytest.raises(ValueError):
+        read(text, read_size)
+
+
+@pytest.mark.parametrize('read_size', READ_SIZES)
+@pytest.mark.parametrize('text', ['[1,,2]', '[,1]', '[1,]', '[1 2]', '[{"a": 1} {"b": 2}]', '["a" "b"]', '{"a": 1}'])
+def test_malformed_separators_raise(text, read_size):
+    with pytest.raises(ValueError):
+        read(text, read_size)
+
+
+def test_empty_input_has_no_elements():
+    assert read('', 3) == []
+
+
+def test_read_logs_detects_each_format(tmp_path):
+    logs = [{"vehicle_id": "V-1", "voltage": 12.5}, {"vehicle_id": "V-2", "voltage": 13.0}]
+    array = tmp_path / 'logs.json'
+    array.write_text(json.dumps(logs, indent=2))
+    ndjson = tmp_path / 'logs.ndjson'
+    ndjson.write_text("".join(json.dumps(log) + "\n" for log in logs))
+    compressed = tmp_path / 'logs.ndjson.gz'
+    with gzip.open(compressed, 'wt') as f:
+        f.write(ndjson.read_text())
+    for path in (array, ndjson, compressed):
+        assert list(read_logs(str(path))) == list(enumerate(logs))
+
+
+def test_read_logs_handles_a_byte_order_mark(tmp_path):
+    logs = [{"vehicle_id": "V-1"}, {"vehicle_id": "V-2"}]
+    array = tmp_path / 'logs.json'
+    array.write_bytes(b'\xef\xbb\xbf' + json.dumps(logs).encode())
+    ndjson = tmp_path / 'logs.ndjson'
+    ndjson.write_bytes(b'\xef\xbb\xbf' + "".join(json.dumps(log) + "\n" for log in logs).encode())
+    assert list(read_logs(str(array))) == list(enumerate(logs))
+    assert list(read_logs(str(ndjson))) == list(enumerate(logs))
+
+
+def test_read_logs_skips_bad_ndjson_lines(tmp_path):
+    path = tmp_path / 'logs.ndjson'
+    path.write_text('{"a": 1}\nnot json\n\n{"b": 2}\n')
+    skipped = []
+    assert list(read_logs(str(path), skipped)) == [(0, {"a": 1}), (2, {"b": 2})]
+    assert skipped == [2]
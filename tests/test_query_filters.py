@@ -0,0 +1,81 @@
+import pytest
+
+from query_filters import build_filter_clauses, extract_query_filters
+
+
+def test_no_constraints():
+    assert extract_query_filters("What does the engine overheating warning mean?") == {}
+
+
+@pytest.mark.parametrize("question, window", [
+    ("Errors in the last hour", "now-1h"),
+    ("What failed over the past 2 days?", "now-2d"),
+    ("Any GPS faults within the last 30 minutes", "now-30m"),
+    ("Which vehicles reported errors today?", "now/d"),
+])
+def test_time_window(question, window):
+    assert extract_query_filters(question) == {"timestamp": {"gte": window}}
+
+
+@pytest.mark.parametrize("question, field, constraint", [
+    ("Show me vehicles with battery voltage <11.5", "battery_voltage", {"lt": 11.5}),
+    ("engine temperatures above 110°C", "engine_temp", {"gt": 110.0}),
+    ("Coolant temperature readings of at least 105", "engine_temp", {"gte": 105.0}),
+    ("battery charge no more than 20", "battery_level", {"lte": 20.0}),
+    ("fuel pressure is under 30", "fuel_pressure", {"lt": 30.0}),
+    ("speeds exceeding 120", "speed", {"gt": 120.0}),
+    ("voltage below -1", "battery_voltage", {"lt": -1.0}),
+])
+def test_threshold(question, field, constraint):
+    assert extract_query_filters(question) == {f"sensor_readings.{field}": constraint}
+
+
+@pytest.mark.parametrize("question, constraint", [
+    ("engine temp above 80 and below 115", {"gt": 80.0, "lt": 115.0}),
+    ("engine temperature at most 115, at least 80", {"lte": 115.0, "gte": 80.0}),
+    ("temperature over 80 but under 115", {"gt": 80.0, "lt": 115.0}),
+])
+def test_range_of_two_bounds(question, constraint):
+    assert extract_query_filters(question) == {"sensor_readings.engine_temp": constraint}
+
+
+@pytest.mark.parametrize("question", [
+    "engine temperature under 80 or over 115",
+    "temperature over 115 or temperature under 80",
+    "temperature above 115 and below 80",
+    "temperature above 80 and above 90",
+    "temperature above 80, below 115 and above 90",
+])
+def test_thresholds_that_are_not_one_range_are_not_filtered(question):
+    assert extract_query_filters(question) == {}
+
+
+def test_thresholds_of_different_readings():
+    assert extract_query_filters("battery voltage below 12 and engine temperature above 100") == {
+        "sensor_readings.battery_voltage": {"lt": 12.0},
+        "sensor_readings.engine_temp": {"gt": 100.0},
+    }
+
+
+def test_keywords():
+    question = "Did VIN-1234 or vin-0042 log sensor_002, DIAG_001 or p0700 while IDLE? Which ones are moving?"
+    assert extract_query_filters(question) == {
+        "vehicle_state": ["IDLE", "MOVING"],
+        "error_code": ["DIAG_001", "SENSOR_002"],
+        "diagnostic_info.dtc_codes": ["P0700"],
+        "vehicle_id": ["VIN-0042", "VIN-1234"],
+    }
+
+
+def test_lower_case_state_needs_a_verb():
+    assert extract_query_filters("vehicles moving fast") == {}
+    assert extract_query_filters("vehicles that are charging") == {"vehicle_state": ["CHARGING"]}
+
+
+def test_filter_clauses():
+    filters = extract_query_filters("battery voltage below 12 in the last hour on VIN-1234")
+    assert build_filter_clauses(filters) == [
+        {"range": {"timestamp": {"gte": "now-1h"}}},
+        {"range": {"sensor_readings.battery_voltage": {"lt": 12.0}}},
+        {"terms": {"vehicle_id": ["VIN-1234"]}},
+    ]
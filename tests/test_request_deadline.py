@@ -0,0 +1,103 @@
+import types
+
+import pytest
+
+import request_deadline
+from request_deadline import (DEADLINE_HEADER, DEGRADED_NOTICE, MIN_GENERATION_SECONDS, REQUEST_DEADLINE,
+                              STAGE_SHARES, Deadline, deadline_from_request, degraded_answer, search_options,
+                              stage_budget)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(request_deadline, 'time', types.SimpleNamespace(monotonic=clock.monotonic))
+    return clock
+
+
+def test_remaining_counts_down_and_stops_at_zero(clock):
+    deadline = Deadline(10)
+    assert deadline.remaining() == 10
+    clock.now += 4
+    assert deadline.remaining() == 6
+    assert not deadline.expired()
+    clock.now += 7
+    assert deadline.remaining() == 0
+    assert deadline.expired()
+
+
+def test_stage_timeout_is_its_share_of_the_budget(clock):
+    deadline = Deadline(20)
+    assert deadline.timeout("embed") == pytest.approx(STAGE_SHARES["embed"] * 20)
+    assert deadline.timeout("search") == pytest.approx(STAGE_SHARES["search"] * 20)
+    assert deadline.timeout() == 20
+
+
+def test_stage_timeout_is_at_most_what_is_left(clock):
+    deadline = Deadline(20)
+    clock.now += 19.5
+    assert deadline.timeout("search") == pytest.approx(0.5)
+    assert deadline.timeout() == pytest.approx(0.5)
+
+
+def test_generation_needs_the_minimum_left(clock):
+    deadline = Deadline(MIN_GENERATION_SECONDS + 3)
+    assert deadline.allows_generation()
+    assert deadline.spare() == pytest.approx(3)
+    clock.now += 3
+    assert deadline.allows_generation()
+    assert deadline.spare() == 0
+    clock.now += 0.1
+    assert not deadline.allows_generation()
+    assert deadline.spare() == 0
+
+
+def test_search_options():
+    assert search_options(None) == {}
+    assert search_options(2.5) == {"request_timeout": 2.5}
+    # An expired budget still passes opensearch-py a positive timeout
+    assert search_options(0) == {"request_timeout": 0.01}
+
+
+def test_stage_budget():
+    assert stage_budget("cache_check", 40) == pytest.approx(STAGE_SHARES["cache_check"] * 40)
+    assert stage_budget("embed") == pytest.approx(STAGE_SHARES["embed"] * REQUEST_DEADLINE)
+
+
+@pytest.mark.parametrize("headers, data, seconds", [
+    ({}, {}, REQUEST_DEADLINE),
+    ({}, {"timeout": 5}, 5),
+    ({DEADLINE_HEADER: "3.5"}, {}, 3.5),
+    ({DEADLINE_HEADER: "8"}, {"timeout": 4}, 4),
+    ({}, {"timeout": REQUEST_DEADLINE * 10}, REQUEST_DEADLINE),
+    ({DEADLINE_HEADER: "soon"}, {"timeout": -1}, REQUEST_DEADLINE),
+    ({}, {"timeout": [5]}, REQUEST_DEADLINE),
+])
+def test_client_may_only_shorten_the_deadline(headers, data, seconds):
+    assert deadline_from_request(headers, data).seconds == seconds
+
+
+def test_degraded_answer_lists_the_retrieved_logs():
+    docs = [
+        {"error_code": "E101", "service": "engine", "message": "Overheating", "vehicle_id": "V-1",
+         "timestamp": "2024-05-01T10:00:00Z"},
+        {"error_code": "E202", "service": "gps", "message": "Signal lost", "vehicle_id": "V-2",
+         "group": {"count": 9, "vehicle_ids": [f"V-{n}" for n in range(7)], "last_seen": "2024-05-02T08:00:00Z"}},
+    ]
+    assert degraded_answer(docs).splitlines() == [
+        DEGRADED_NOTICE,
+        "- [E101] engine: Overheating (1 logs; vehicles V-1; latest 2024-05-01T10:00:00Z)",
+        "- [E202] gps: Signal lost (9 logs; vehicles V-0, V-1, V-2, V-3, V-4 and 2 more; latest 2024-05-02T08:00:00Z)",
+    ]
+
+
+def test_degraded_answer_without_logs():
+    assert "no matching error logs" in degraded_answer([])
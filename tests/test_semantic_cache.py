@@ -0,0 +1,136 @@
+import types
+
+import pytest
+
+import semantic_cache
+from semantic_cache import SemanticCache, build_freshness_query, semantic_cache_from_env, stale_keys
+
+
+def doc(doc_id, vehicle="V-1", error_code="E101"):
+    return {"doc_id": doc_id, "vehicle_id": vehicle, "error_code": error_code}
+
+
+DOCS = [doc("d1"), doc("d2", "V-2"), doc("d3", "V-3", "E202")]
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(semantic_cache, 'time', types.SimpleNamespace(time=clock.time))
+    return clock
+
+
+def cache_of(**kwargs):
+    kwargs.setdefault('dimension', 3)
+    return SemanticCache(**kwargs)
+
+
+def test_similar_query_over_the_same_documents_hits(clock):
+    cache = cache_of()
+    cache.insert("why is V-1 overheating", [1.0, 0.0, 0.0], DOCS, "Check the coolant.")
+    entry = cache.lookup([0.99, 0.05, 0.0], ["d1", "d2", "d3"])
+    assert entry["llm_response"] == "Check the coolant."
+    # Scale does not matter, only direction
+    assert cache.lookup([5.0, 0.0, 0.0], ["d1", "d2", "d3"]) is entry
+    stats = cache.stats()
+    assert stats["hits"] == 2 and stats["misses"] == 0 and stats["entries"] == 1 and stats["hit_rate"] == 1.0
+
+
+def test_distant_query_misses(clock):
+    cache = cache_of(max_distance=0.1)
+    cache.insert("q", [1.0, 0.0, 0.0], DOCS, "answer")
+    assert cache.lookup([0.0, 1.0, 0.0], ["d1", "d2", "d3"]) is None
+    assert cache.stats()["misses"] == 1
+
+
+def test_hit_needs_enough_document_overlap(clock):
+    cache = cache_of(min_doc_overlap=0.6)
+    cache.insert("q", [1.0, 0.0, 0.0], DOCS, "answer")
+    # 2 of 4 distinct ids shared
+    assert cache.lookup([1.0, 0.0, 0.0], ["d1", "d2", "d9"]) is None
+    # 3 of 4
+    assert cache.lookup([1.0, 0.0, 0.0], ["d1", "d2", "d3", "d9"]) is not None
+
+
+def test_closest_entry_with_overlapping_documents_wins(clock):
+    cache = cache_of(max_distance=0.5)
+    cache.insert("near", [1.0, 0.1, 0.0], [doc("x")], "near answer")
+    cache.insert("farther", [1.0, 0.4, 0.0], DOCS, "farther answer")
+    # The nearest entry was built from other documents, so the next one is used
+    assert cache.lookup([1.0, 0.0, 0.0], ["d1", "d2", "d3"])["llm_response"] == "farther answer"
+    assert cache.lookup([1.0, 0.0, 0.0], ["x"])["llm_response"] == "near answer"
+
+
+def test_expired_entry_is_dropped(clock):
+    cache = cache_of(ttl=60)
+    cache.insert("q", [1.0, 0.0, 0.0], DOCS, "answer")
+    clock.now += 61
+    assert cache.lookup([1.0, 0.0, 0.0], ["d1", "d2", "d3"]) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = cache_of(max_entries=2)
+    cache.insert("a", [1.0, 0.0, 0.0], DOCS, "a")
+    clock.now += 1
+    cache.insert("b", [0.0, 1.0, 0.0], DOCS, "b")
+    clock.now += 1
+    assert cache.lookup([1.0, 0.0, 0.0], ["d1", "d2", "d3"])["query"] == "a"
+    clock.now += 1
+    cache.insert("c", [0.0, 0.0, 1.0], DOCS, "c")
+    assert cache.lookup([0.0, 1.0, 0.0], ["d1", "d2", "d3"]) is None
+    assert cache.lookup([1.0, 0.0, 0.0], ["d1", "d2", "d3"])["query"] == "a"
+    assert cache.lookup([0.0, 0.0, 1.0], ["d1", "d2", "d3"])["query"] == "c"
+    stats = cache.stats()
+    assert stats["evictions"] == 1 and stats["entries"] == 2
+
+
+def test_invalidate_by_vehicle_or_error_code(clock):
+    cache = cache_of()
+    cache.insert("a", [1.0, 0.0, 0.0], [doc("d1", "V-1", "E101")], "a")
+    cache.insert("b", [0.0, 1.0, 0.0], [doc("d2", "V-2", "E202")], "b")
+    cache.insert("c", [0.0, 0.0, 1.0], [doc("d3", "V-3", "E303")], "c")
+    assert cache.invalidate(vehicle_ids=["V-1"], error_codes=["E202"]) == 2
+    assert cache.lookup([1.0, 0.0, 0.0], ["d1"]) is None
+    assert cache.lookup([0.0, 1.0, 0.0], ["d2"]) is None
+    assert cache.lookup([0.0, 0.0, 1.0], ["d3"])["query"] == "c"
+    assert cache.stats()["invalidations"] == 2
+
+
+def test_grouped_documents_count_every_hit(clock):
+    cache = cache_of()
+    grouped = dict(doc("d1"), group={"doc_ids": ["d1", "d4"], "vehicle_ids": ["V-1", "V-4"], "count": 2})
+    entry = cache.insert("q", [1.0, 0.0, 0.0], [grouped], "answer")
+    assert entry["doc_ids"] == {"d1", "d4"}
+    assert entry["vehicle_ids"] == {"V-1", "V-4"}
+    assert cache.invalidate(vehicle_ids=["V-4"]) == 1
+
+
+def test_freshness_query_and_stale_keys(clock):
+    entry = cache_of().insert("q", [1.0, 0.0, 0.0], DOCS, "answer")
+    query = build_freshness_query(entry)["query"]["bool"]
+    assert query["filter"] == [{"range": {"timestamp": {"gt": "2023-11-14T22:13:20+00:00"}}}]
+    assert query["should"] == [{"terms": {"vehicle_id": ["V-1", "V-2", "V-3"]}},
+                               {"terms": {"error_code": ["E101", "E202"]}}]
+    response = {"aggregations": {"vehicle_ids": {"buckets": [{"key": "V-2", "doc_count": 1}]},
+                                 "error_codes": {"buckets": []}}}
+    assert stale_keys(response) == (["V-2"], [])
+    assert stale_keys({}) == ([], [])
+
+
+def test_cache_from_env(monkeypatch):
+    monkeypatch.setenv('SEMANTIC_CACHE_ENTRIES', '0')
+    assert semantic_cache_from_env() is None
+    monkeypatch.setenv('SEMANTIC_CACHE_ENTRIES', '8')
+    monkeypatch.setenv('SEMANTIC_CACHE_TTL', '30')
+    cache = semantic_cache_from_env(dimension=4)
+    assert cache.max_entries == 8 and cache.ttl == 30.0
+    assert cache._vectors.shape == (8, 4)
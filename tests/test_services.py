@@ -0,0 +1,324 @@
+import io
+import os
+import json
+import time
+import asyncio
+
+import pytest
+
+# Caches would answer repeated questions without going through the backends
+os.environ.setdefault('EMBEDDING_CACHE_ENTRIES', '0')
+os.environ.setdefault('SEMANTIC_CACHE_ENTRIES', '0')
+
+httpx = pytest.importorskip('httpx')
+
+import rag_pipeline
+import async_service
+import vector_search_service
+from admission import AdmissionController
+from stage_timing import StageTimer
+
+QUESTION = "What does the engine overheating warning mean?"
+
+
+def hit(doc_id, score, message):
+    return {"_id": doc_id, "_score": score, "_source": {
+        "timestamp": "2024-01-15T10:00:00Z", "message": message, "service": "engine", "error_code": "ENG_001",
+        "vehicle_id": f"VIN-{doc_id}", "vehicle_state": "MOVING",
+        "sensor_readings": {"engine_temp": 118.5}, "diagnostic_info": {"dtc_codes": [], "system_status": "WARNING"},
+    }}
+
+
+HITS = [hit("1001", 0.9, "Engine temperature above threshold"), hit("1002", 0.8, "Coolant pressure low")]
+
+
+class FakeBedrock:
+    def __init__(self):
+        self.calls = 0
+
+    def invoke_model(self, body, **kwargs):
+        self.calls += 1
+        texts = json.loads(body)["texts"]
+        return {"body": io.BytesIO(json.dumps({"embeddings": [[0.1] * 1024 for _ in texts]}).encode())}
+
+
+class FakeOpenSearch:
+    def __init__(self, hits=HITS):
+        self.hits = hits
+        self.searches = []
+
+    def search(self, index=None, body=None, **kwargs):
+        self.searches.append(body)
+        # No log matches a filter of the question
+        filtered = "filter" in body["query"]["knn"]["message_embedding"]
+        return {"took": 1, "hits": {"hits": [] if filtered else self.hits}}
+
+    def msearch(self, body=None, **kwargs):
+        return {"responses": [FakeOpenSearch.search(self, body=search) for search in body[1::2]]}
+
+
+class FakeAsyncOpenSearch(FakeOpenSearch):
+    async def search(self, index=None, body=None, **kwargs):
+        return FakeOpenSearch.search(self, body=body)
+
+    async def msearch(self, body=None, **kwargs):
+        return FakeOpenSearch.msearch(self, body)
+
+    async def close(self):
+        pass
+
+
+TOKENS = ["The engine ", "is overheating."]
+
+
+def stream_lines():
+    for token in TOKENS:
+        yield "data: " + json.dumps({"choices": [{"delta": {"content": token}}]})
+    yield "data: [DONE]"
+
+
+class FakeVLLM:
+    def __init__(self):
+        self.calls = 0
+
+    def chat(self, payload, timeout=None):
+        self.calls += 1
+        return {"choices": [{"message": {"content": "".join(TOKENS)}}]}
+
+    def stream_chat(self, payload, timeout=None):
+        self.calls += 1
+        return stream_lines()
+
+    def stats(self):
+        return {}
+
+
+class FakeAsyncVLLM(FakeVLLM):
+    async def chat(self, payload, timeout=None):
+        return FakeVLLM.chat(self, payload, timeout)
+
+    async def stream_chat(self, payload, timeout=None):
+        self.calls += 1
+        for line in stream_lines():
+            yield line
+
+    async def aclose(self):
+        pass
+
+
+class SyncService:
+    name = "sync"
+
+    def __init__(self, monkeypatch):
+        self.vllm = FakeVLLM()
+        monkeypatch.setattr(vector_search_service, 'bedrock_runtime', FakeBedrock())
+        monkeypatch.setattr(vector_search_service, 'embedding_batcher', None)
+        self.opensearch = FakeOpenSearch()
+        monkeypatch.setattr(vector_search_service, 'opensearch_client', self.opensearch)
+        monkeypatch.setattr(vector_search_service, 'vllm_client', self.vllm)
+        self.pipeline = vector_search_service.pipeline
+        self.client = vector_search_service.app.test_client()
+
+    def post(self, path, body, headers=None):
+        response = self.client.post(path, json=body, headers=headers or {})
+        return response.status_code, response.headers, response.get_data(as_text=True)
+
+
+class AsyncService:
+    name = "async"
+
+    def __init__(self, monkeypatch):
+        self.vllm = FakeAsyncVLLM()
+        for name in ('bedrock_executor', 'embedding_batcher', 'embedding_stage', 'pipeline', 'flights', 'admission'):
+            monkeypatch.setattr(async_service, name, None)
+        monkeypatch.setattr(async_service, 'EMBED_BATCH_WINDOW_MS', 0)
+        monkeypatch.setattr(async_service, 'bedrock_runtime', FakeBedrock())
+        self.opensearch = FakeAsyncOpenSearch()
+        monkeypatch.setattr(async_service, 'opensearch_client', self.opensearch)
+        monkeypatch.setattr(async_service, 'vllm_client', self.vllm)
+        async_service.init_clients()
+        self.pipeline = async_service.pipeline
+
+    def post(self, path, body, headers=None):
+        async def send():
+            transport = httpx.ASGITransport(app=async_service.app)
+            async with httpx.AsyncClient(transport=transport, base_url='http://rag') as client:
+                return await client.post(path, json=body, headers=headers or {})
+
+        response = asyncio.run(send())
+        return response.status_code, response.headers, response.text
+
+
+@pytest.fixture(params=[SyncService, AsyncService], ids=lambda service: service.name)
+def service(request, monkeypatch):
+    return request.param(monkeypatch)
+
+
+def events(text):
+    return [json.loads(line[len("data: "):]) for line in text.split("\n\n") if line.startswith("data: ")]
+
+
+def test_answer(service):
+    status, headers, text = service.post('/submit_query', {"query": QUESTION})
+    assert status == 200
+    body = json.loads(text)
+    assert body["llm_response"] == "".join(TOKENS)
+    assert body["route"] == "retrieval"
+    assert [doc["doc_id"] for doc in body["similar_documents"]] == ["1001", "1002"]
+    assert "embed;dur=" in headers["Server-Timing"]
+
+
+def test_streamed_answer(service):
+    status, headers, text = service.post('/submit_query', {"query": QUESTION, "stream": True})
+    assert status == 200
+    assert headers["Content-Type"].startswith("text/event-stream")
+    received = events(text)
+    assert received[0]["query"] == QUESTION
+    assert [event["llm_response"] for event in received[1:-1]] == TOKENS
+    assert received[-1]["done"] is True
+
+
+FILTERED_QUESTION = "Why is the battery voltage below 11.5 on VIN-1001?"
+FILTERS = {"sensor_readings.battery_voltage": {"lt": 11.5}, "vehicle_id": ["VIN-1001"]}
+
+
+def test_filters_matching_nothing_are_relaxed(service):
+    status, _, text = service.post('/submit_query', {"query": FILTERED_QUESTION})
+    assert status == 200
+    body = json.loads(text)
+    assert body["applied_filters"] == {}
+    assert body["relaxed_filters"] == FILTERS
+    assert [doc["doc_id"] for doc in body["similar_documents"]] == ["1001", "1002"]
+    assert len(service.opensearch.searches) == 2
+
+
+def test_streamed_answer_reports_relaxed_filters(service):
+    _, _, text = service.post('/submit_query', {"query": FILTERED_QUESTION, "stream": True})
+    start = events(text)[0]
+    assert start["applied_filters"] == {}
+    assert start["relaxed_filters"] == FILTERS
+
+
+def test_batch_relaxes_filters_per_question(service):
+    _, _, text = service.post('/submit_queries', {"queries": [QUESTION, FILTERED_QUESTION]})
+    answers = sorted([json.loads(line) for line in text.splitlines()][:-1], key=lambda line: line["index"])
+    assert [answer["relaxed_filters"] for answer in answers] == [{}, FILTERS]
+    assert all(answer["similar_documents"] for answer in answers)
+
+
+def test_relaxing_filters_can_be_turned_off(service, monkeypatch):
+    monkeypatch.setattr(rag_pipeline, 'QUERY_FILTER_FALLBACK', False)
+    _, _, text = service.post('/submit_query', {"query": FILTERED_QUESTION})
+    body = json.loads(text)
+    assert body["applied_filters"] == FILTERS
+    assert body["relaxed_filters"] == {}
+    assert body["similar_documents"] == []
+
+
+def test_missing_query(service):
+    status, _, text = service.post('/submit_query', {"question": QUESTION})
+    assert status == 400
+    assert json.loads(text) == {"error": "Missing query parameter"}
+
+
+@pytest.mark.parametrize("body", [["query"], "query", 42, None])
+def test_body_that_is_not_an_object(service, body):
+    status, _, text = service.post('/submit_query', body)
+    assert status == 400
+    assert json.loads(text) == {"error": "Missing query parameter"}
+    status, _, text = service.post('/submit_queries', body)
+    assert status == 400
+    assert json.loads(text) == {"error": "Missing queries parameter"}
+
+
+def test_overloaded_query_gets_429_with_retry_after(service, monkeypatch):
+    controller = AdmissionController(1, max_wait=1.0, service_time=5.0)
+    monkeypatch.setattr(service.pipeline, 'admission', controller)
+    with controller.slot():
+        status, headers, text = service.post('/submit_query', {"query": QUESTION})
+    assert status == 429
+    assert headers["Retry-After"] == "4"
+    assert json.loads(text)["retry_after"] == 4
+    assert service.vllm.calls == 0
+
+
+def test_cached_answer_is_served_while_overloaded(service, monkeypatch):
+    async def cached(embedding, similar_docs, timeout=None):
+        return "Cached answer."
+
+    controller = AdmissionController(1, max_wait=1.0, service_time=5.0)
+    monkeypatch.setattr(service.pipeline, 'admission', controller)
+    monkeypatch.setattr(service.pipeline, 'lookup_cached_answer', cached)
+    with controller.slot():
+        status, _, text = service.post('/submit_query', {"query": QUESTION})
+    assert status == 200
+    body = json.loads(text)
+    assert body["llm_response"] == "Cached answer." and body["semantic_cache_hit"] is True
+    assert service.vllm.calls == 0
+
+
+def test_batch(service):
+    questions = [QUESTION, "Why is the coolant pressure low?"]
+    status, headers, text = service.post('/submit_queries', {"queries": questions})
+    assert status == 200
+    assert headers["Content-Type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in text.splitlines()]
+    answers = sorted(lines[:-1], key=lambda line: line["index"])
+    assert [answer["query"] for answer in answers] == questions
+    assert all(answer["llm_response"] == "".join(TOKENS) for answer in answers)
+    assert lines[-1]["queries"] == 2 and lines[-1]["failed"] == 0
+
+
+def test_batch_keeps_the_stage_times_of_every_question(monkeypatch):
+    service = SyncService(monkeypatch)
+
+    def slow_chat(payload, timeout=None):
+        time.sleep(0.02)
+        return FakeVLLM.chat(service.vllm, payload, timeout)
+
+    monkeypatch.setattr(service.vllm, 'chat', slow_chat)
+    timer = StageTimer()
+    questions = [f"Why did vehicle {n} stall?" for n in range(8)]
+    reply = rag_pipeline.run_blocking(service.pipeline.submit_queries({"queries": questions, "parallelism": 4}, {},
+                                                                      timer))
+    assert len(list(rag_pipeline.iterate_blocking(reply.events))) == 9
+    assert timer.durations["llm_total"] >= 8 * 0.02
+
+
+def test_failed_search_is_reported(service, monkeypatch):
+    def failing(*args, **kwargs):
+        raise ConnectionError("OpenSearch is down")
+
+    async def failing_async(*args, **kwargs):
+        failing()
+
+    monkeypatch.setattr(service.pipeline.backend, 'search', failing_async)
+    status, _, text = service.post('/submit_query', {"query": QUESTION})
+    assert status == 500
+    assert json.loads(text) == {"error": "Failed to perform vector search"}
+
+
+def test_lifespan_sets_up_and_closes_the_clients(monkeypatch):
+    service = AsyncService(monkeypatch)
+    monkeypatch.setattr(async_service, 'pipeline', None)
+    closed = []
+
+    async def aclose():
+        closed.append("vllm")
+
+    monkeypatch.setattr(service.vllm, 'aclose', aclose)
+
+    async def serve():
+        async with async_service.lifespan(async_service.app):
+            assert async_service.pipeline is not None
+
+    asyncio.run(serve())
+    assert closed == ["vllm"]
+
+
+def test_run_blocking_refuses_to_suspend():
+    async def suspends():
+        await asyncio.sleep(0)
+
+    with pytest.raises(RuntimeError):
+        rag_pipeline.run_blocking(suspends())
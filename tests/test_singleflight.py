@@ -0,0 +1,195 @@
+import time
+import asyncio
+import threading
+
+import pytest
+
+from singleflight import AsyncSingleFlight, FileFlightStore, FlightTimeout, SingleFlight, flight_key
+
+
+class Gate:
+    """A computation that blocks until released, counting its runs"""
+
+    def __init__(self, result="answer", error=None, released=False):
+        self.result = result
+        self.error = error
+        self.started = threading.Event()
+        self.release = threading.Event()
+        if released:
+            self.release.set()
+        self.runs = 0
+
+    def __call__(self):
+        self.runs += 1
+        self.started.set()
+        assert self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def in_thread(fn, *args, **kwargs):
+    outcome = {}
+
+    def run():
+        try:
+            outcome["value"] = fn(*args, **kwargs)
+        except BaseException as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread, outcome
+
+
+def joined():
+    # Long enough for a thread started just before to block on the flight
+    time.sleep(0.05)
+
+
+def test_flight_key_normalizes_the_query():
+    assert flight_key("generate", "Battery  Voltage?", 5) == flight_key("generate", "battery voltage?", 5)
+    assert flight_key("generate", "battery voltage", 5) != flight_key("generate", "battery voltage", 6)
+    assert flight_key("generate", "battery voltage") != flight_key("stream", "battery voltage")
+
+
+def test_followers_share_the_leaders_result():
+    flights = SingleFlight()
+    gate = Gate()
+    leader, led = in_thread(flights.do, "k", gate)
+    assert gate.started.wait(5)
+    follower, followed = in_thread(flights.do, "k", lambda: "not run")
+    joined()
+    gate.release.set()
+    leader.join(5)
+    follower.join(5)
+    assert led["value"] == ("answer", False)
+    assert followed["value"] == ("answer", True)
+    assert gate.runs == 1
+    assert flights.snapshot()["coalesced"] == 1
+
+
+def test_leader_failure_reaches_waiters_and_the_next_call_leads_again():
+    flights = SingleFlight()
+    gate = Gate(error=RuntimeError("vLLM down"))
+    leader, led = in_thread(flights.do, "k", gate)
+    assert gate.started.wait(5)
+    follower, followed = in_thread(flights.do, "k", lambda: "not run")
+    joined()
+    gate.release.set()
+    leader.join(5)
+    follower.join(5)
+    assert isinstance(led["error"], RuntimeError)
+    assert followed["error"] is led["error"]
+    assert flights.in_flight() == 0
+    assert flights.do("k", lambda: "recovered") == ("recovered", False)
+
+
+def test_waiter_timeout_leaves_the_leader_running():
+    flights = SingleFlight()
+    gate = Gate()
+    leader, led = in_thread(flights.do, "k", gate)
+    assert gate.started.wait(5)
+    with pytest.raises(FlightTimeout):
+        flights.do("k", lambda: "not run", timeout=0.05)
+    gate.release.set()
+    leader.join(5)
+    assert led["value"] == ("answer", False)
+    assert flights.snapshot()["coalesced"] == 0
+
+
+def test_abandoned_leader_hands_over_to_a_follower():
+    flights = SingleFlight()
+    gate = Gate(error=KeyboardInterrupt())
+    leader, led = in_thread(flights.do, "k", gate)
+    assert gate.started.wait(5)
+    follower, followed = in_thread(flights.do, "k", lambda: "follower ran")
+    joined()
+    gate.release.set()
+    leader.join(5)
+    follower.join(5)
+    assert isinstance(led["error"], KeyboardInterrupt)
+    assert followed["value"] == ("follower ran", False)
+
+
+def test_stream_followers_replay_tokens_and_see_the_leaders_failure():
+    flights = SingleFlight()
+
+    def tokens():
+        yield "a"
+        yield "b"
+        raise RuntimeError("stream broke")
+
+    source, shared = flights.stream("k", tokens)
+    assert not shared
+    first = next(source)
+    replay, shared = flights.stream("k", lambda: iter(["not run"]))
+    assert shared
+    with pytest.raises(RuntimeError):
+        list(source)
+    assert first == "a"
+    with pytest.raises(RuntimeError):
+        list(replay)
+    assert flights.in_flight() == 0
+
+
+def test_stream_waiter_timeout():
+    flights = SingleFlight()
+    source, _ = flights.stream("k", lambda: iter(["a", "b"]))
+    next(source)
+    replay, _ = flights.stream("k", lambda: iter([]), timeout=0.05)
+    with pytest.raises(FlightTimeout):
+        # "a" is replayed, then nothing more arrives in time
+        list(replay)
+
+
+def test_file_store_coalesces_across_instances(tmp_path):
+    store = FileFlightStore(str(tmp_path), poll_interval=0.005)
+    first, second = SingleFlight(store), SingleFlight(store)
+    gate = Gate()
+    leader, led = in_thread(first.do, "k", gate)
+    assert gate.started.wait(5)
+    follower, followed = in_thread(second.do, "k", lambda: "not run")
+    joined()
+    gate.release.set()
+    leader.join(5)
+    follower.join(5)
+    assert led["value"] == ("answer", False)
+    assert followed["value"] == ("answer", True)
+    assert second.snapshot()["coalesced_remote"] == 1
+
+
+def test_file_store_leader_failure_lets_the_next_process_lead(tmp_path):
+    store = FileFlightStore(str(tmp_path), poll_interval=0.005)
+    with pytest.raises(RuntimeError):
+        SingleFlight(store).do("k", Gate(error=RuntimeError("down"), released=True))
+    assert store.leader("k") is None
+    assert SingleFlight(store).do("k", lambda: "ok") == ("ok", False)
+
+
+def test_async_leader_failure_and_waiter_timeout():
+    async def run():
+        flights = AsyncSingleFlight()
+        release = asyncio.Event()
+
+        async def failing():
+            await release.wait()
+            raise RuntimeError("vLLM down")
+
+        leader = asyncio.ensure_future(flights.do("k", failing))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flights.do("k", failing))
+        await asyncio.sleep(0)
+        with pytest.raises(FlightTimeout):
+            await flights.do("k", failing, timeout=0.01)
+        release.set()
+        results = await asyncio.gather(leader, follower, return_exceptions=True)
+        assert all(isinstance(result, RuntimeError) for result in results)
+        assert flights.snapshot()["coalesced"] == 1
+
+        async def answer():
+            return "recovered"
+
+        assert await flights.do("k", answer) == ("recovered", False)
+
+    asyncio.run(run())
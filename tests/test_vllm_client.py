@@ -0,0 +1,241 @@
+import json
+import time
+import types
+import asyncio
+
+import httpx
+import pytest
+import requests
+
+import vllm_client
+from vllm_client import AsyncVLLMClient, EndpointBalancer, VLLMClient, VLLMTimeout, get_vllm_endpoints
+
+A, B, C = "http://vllm-a:8000", "http://vllm-b:8000", "http://vllm-c:8000"
+COMPLETION = {"choices": [{"message": {"content": "Check the coolant level."}}]}
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(vllm_client, 'backoff_delay', lambda attempt: 0.0)
+
+
+@pytest.fixture
+def first_choice(monkeypatch):
+    # Break ties between idle endpoints by their order instead of at random
+    monkeypatch.setattr(vllm_client, 'random', types.SimpleNamespace(choice=lambda options: options[0]))
+
+
+def test_endpoints_from_env(monkeypatch):
+    monkeypatch.setenv('VLLM_ENDPOINTS', 'vllm-a:8000, https://vllm-b/ ,')
+    assert get_vllm_endpoints() == ["http://vllm-a:8000", "https://vllm-b"]
+    monkeypatch.delenv('VLLM_ENDPOINTS')
+    monkeypatch.setenv('VLLM_HOST', 'localhost')
+    monkeypatch.setenv('VLLM_PORT', '9000')
+    assert get_vllm_endpoints() == ["http://localhost:9000"]
+
+
+def test_balancer_picks_the_least_outstanding_endpoint():
+    balancer = EndpointBalancer([A, B, C])
+    first = [balancer.acquire() for _ in range(3)]
+    assert sorted(first) == [A, B, C]
+    balancer.release(B)
+    assert balancer.acquire() == B
+    balancer.release(A)
+    balancer.release(C)
+    assert sorted([balancer.acquire(), balancer.acquire()]) == [A, C]
+    assert {e: s["outstanding"] for e, s in balancer.stats()["endpoints"].items()} == {A: 1, B: 1, C: 1}
+
+
+def test_balancer_skips_excluded_and_cooling_down_endpoints():
+    balancer = EndpointBalancer([A, B, C], cooldown=60)
+    assert balancer.acquire(exclude=[A, B]) == C
+    balancer.mark_unavailable(B)
+    balancer.release(C)
+    assert balancer.acquire(exclude=[A]) == C
+    # Every candidate excluded or cooling down: fall back rather than fail
+    for endpoint in (A, C):
+        balancer.mark_unavailable(endpoint)
+    assert balancer.acquire(exclude=[A, C]) == B
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, body=b'', lines=(), delay=0.0):
+        self.status_code = status_code
+        self.body = body
+        self.lines = lines
+        self.delay = delay
+        self.closed = False
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.body), chunk_size):
+            yield self.body[start:start + chunk_size]
+
+    def iter_lines(self):
+        for line in self.lines:
+            time.sleep(self.delay)
+            yield line
+
+    def raise_for_status(self):
+        raise requests.exceptions.HTTPError(f"{self.status_code} error")
+
+    def close(self):
+        self.closed = True
+
+
+class FakeSession:
+    """session.post answering from a per-endpoint list of responses or exceptions"""
+
+    def __init__(self, replies):
+        self.replies = {endpoint: list(queue) for endpoint, queue in replies.items()}
+        self.posts = []
+
+    def post(self, url, json=None, timeout=None, stream=False):
+        endpoint = url[:-len(vllm_client.CHAT_COMPLETIONS_PATH)]
+        self.posts.append((endpoint, timeout))
+        reply = self.replies[endpoint].pop(0)
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+
+def client_of(replies, **kwargs):
+    client = VLLMClient(list(replies), **kwargs)
+    client.session = FakeSession(replies)
+    return client
+
+
+def outstanding(client):
+    return sum(s["outstanding"] for s in client.stats()["endpoints"].values())
+
+
+def test_chat_returns_the_completion():
+    client = client_of({A: [FakeResponse(body=json.dumps(COMPLETION).encode())]}, connect_timeout=2.0,
+                       read_timeout=30.0)
+    assert client.chat({"messages": []}) == COMPLETION
+    connect, read = client.session.posts[0][1]
+    assert connect == 2.0 and read == 30.0
+    assert outstanding(client) == 0
+
+
+def test_refused_connection_is_retried_on_another_endpoint(first_choice):
+    ok = FakeResponse(body=json.dumps(COMPLETION).encode())
+    client = client_of({A: [requests.exceptions.ConnectionError("refused")] * 3,
+                        B: [requests.exceptions.ConnectionError("refused")] * 3, C: [ok]}, max_retries=2)
+    assert client.chat({"messages": []}) == COMPLETION
+    assert [endpoint for endpoint, _ in client.session.posts] == [A, B, C]
+    stats = client.stats()
+    assert stats["retries"] == 2
+    assert sum(s["failures"] for s in stats["endpoints"].values()) == 2
+    assert outstanding(client) == 0
+
+
+def test_shed_request_is_retried(first_choice):
+    shed = FakeResponse(status_code=503)
+    ok = FakeResponse(body=json.dumps(COMPLETION).encode())
+    client = client_of({A: [shed], B: [ok]})
+    assert client.chat({"messages": []}) == COMPLETION
+    assert shed.closed
+    assert [endpoint for endpoint, _ in client.session.posts] == [A, B]
+    assert client.stats()["retries"] == 1
+
+
+def test_connection_errors_beyond_the_retries_raise():
+    client = client_of({A: [requests.exceptions.ConnectionError("refused")] * 5}, max_retries=2)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        client.chat({"messages": []})
+    assert len(client.session.posts) == 3
+    assert outstanding(client) == 0
+
+
+def test_client_errors_are_not_retried():
+    client = client_of({A: [FakeResponse(status_code=400)] * 2})
+    with pytest.raises(requests.exceptions.HTTPError):
+        client.chat({"messages": []})
+    assert len(client.session.posts) == 1
+    assert client.stats()["endpoints"][A]["failures"] == 1
+
+
+def test_request_timeout_shortens_the_socket_timeouts():
+    client = client_of({A: [FakeResponse(body=b'{}')]}, connect_timeout=3.0, read_timeout=60.0,
+                       total_timeout=90.0)
+    client.chat({"messages": []}, timeout=1.5)
+    connect, read = client.session.posts[0][1]
+    assert connect <= 1.5 and read <= 1.5
+
+
+def test_expired_deadline_is_not_sent():
+    client = client_of({A: [FakeResponse(body=b'{}')]})
+    with pytest.raises(VLLMTimeout):
+        client.chat({"messages": []}, timeout=-1)
+    assert client.session.posts == []
+    assert outstanding(client) == 0
+
+
+def test_stream_stops_at_the_deadline():
+    response = FakeResponse(lines=[b'data: 1', b'data: 2', b'data: 3', b'data: [DONE]'], delay=0.1)
+    client = client_of({A: [response]})
+    received = []
+    with pytest.raises(VLLMTimeout):
+        for line in client.stream_chat({"stream": True}, timeout=0.25):
+            received.append(line)
+    assert received == [b'data: 1', b'data: 2']
+    assert response.closed
+    assert client.stats()["endpoints"][A]["failures"] == 1
+    assert outstanding(client) == 0
+
+
+def async_client_of(handler, endpoints=(A, B), **kwargs):
+    return AsyncVLLMClient(list(endpoints), transport=httpx.MockTransport(handler), **kwargs)
+
+
+def test_async_chat_retries_a_shed_request(first_choice):
+    hosts = []
+
+    def handler(request):
+        hosts.append(request.url.host)
+        return httpx.Response(503 if len(hosts) == 1 else 200, json=COMPLETION)
+
+    async def run():
+        client = async_client_of(handler)
+        try:
+            return await client.chat({"messages": []}), client.stats()
+        finally:
+            await client.aclose()
+
+    completion, stats = asyncio.run(run())
+    assert completion == COMPLETION
+    assert hosts == ["vllm-a", "vllm-b"]
+    assert stats["retries"] == 1
+
+
+def test_async_chat_times_out():
+    async def handler(request):
+        await asyncio.sleep(1)
+        return httpx.Response(200, json=COMPLETION)
+
+    async def run():
+        client = async_client_of(handler)
+        try:
+            with pytest.raises(VLLMTimeout):
+                await client.chat({"messages": []}, timeout=0.05)
+            return client.stats()
+        finally:
+            await client.aclose()
+
+    stats = asyncio.run(run())
+    assert sum(s["outstanding"] for s in stats["endpoints"].values()) == 0
+    assert sum(s["failures"] for s in stats["endpoints"].values()) == 1
+
+
+def test_async_stream_yields_lines():
+    def handler(request):
+        return httpx.Response(200, content=b'data: 1\n\ndata: [DONE]\n\n')
+
+    async def run():
+        client = async_client_of(handler)
+        try:
+            return [line async for line in client.stream_chat({"stream": True})]
+        finally:
+            await client.aclose()
+
+    assert [line for line in asyncio.run(run()) if line] == ["data: 1", "data: [DONE]"]
@@ -16,7 +16,7 @@ logger = logging.getLogger(__name__)
 RAG_SERVICE_URL = f"http://{os.environ.get('RAG_SERVICE_HOST', 'eks-rag-service')}/submit_query"
 
 
-# Send query to RAG service
+# Send query to RAG service and stream the answer as it is generated
 def send_query(query):
     logger.info(f"Sending query: {query}")
     try:
@@ -36,7 +36,7 @@ def send_query(query):
                                  stream=True)
         response.raise_for_status()
         
-        # Process the streaming response
+        # Process the streaming response, yielding the answer so far after each token
         full_response = ""
         for line in response.iter_lines():
             if line:
@@ -51,16 +51,21 @@ def send_query(query):
                     # Extract and append the LLM response
                     if 'llm_response' in json_response:
                         full_response += json_response['llm_response']
+                        yield full_response
+                    elif 'error' in json_response:
+                        full_response += f"\n\nError: {json_response['error']}"
+                        yield full_response
                 except json.JSONDecodeError:
                     # If not JSON, append the raw text
                     full_response += decoded_line
+                    yield full_response
                 
-        return full_response
+        yield full_response
     
     except requests.RequestException as e:
         error_msg = f"Error: {str(e)}\nResponse content: {response.text if 'response' in locals() else 'No response'}"
         logger.error(error_msg)
-        return error_msg
+        yield error_msg
 
 # Default prompts for testing
 default_prompts = [
@@ -84,4 +89,5 @@ iface = gr.Interface(
 )
 
 if __name__ == "__main__":
-    iface.launch(server_name="0.0.0.0", server_port=7860)
+    # Generator outputs need the queue to stream to the browser
+    iface.queue().launch(server_name="0.0.0.0", server_port=7860)